@@ -0,0 +1,219 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import cv2 as cv
+import numpy as np
+from utils.analysis import SliceAnalysis
+from utils.graph_analysis import skeletonise_image, classify_skeleton, find_nodes, find_endpoints, skeleton_graph
+from utils.preprocess import resize_image, convert_image
+from utils.stack import stack_files, read_slice
+from utils.volume import compute_shape_volumes
+from utils.skeleton import Core_code, render_skeleton
+from utils.circle import circle_image, render_circles
+from utils.eclipse import eclipse_image, render_ellipses
+from utils.draw_node_circles import all_circle, detect_nodes, geodesic_paths, render_all_circle
+
+STACK = "ctrl-1-1.stack image"
+# Slices of STACK benchmarked by default: bottom, middle and top of the stack
+STACK_SLICES = (0, 125, 249)
+
+# Seconds a fresh interpreter may take to import each module: the CLI, and
+# the pipeline every worker process and one-shot run loads
+IMPORT_BUDGET = {"main": 1.0, "utils.io_utils": 1.5}
+
+# Features every analyser shares, computed before an analyser is timed
+SHARED = ("labels", "skeleton", "kind", "nodes", "endpoints", "graph", "dist", "shape_skeletons")
+
+
+def synthetic_network(size=512, cells=4, width=9, seed=0):
+    """
+    Binary 0/255 image of a jittered lattice of thick struts with a few
+    struts left out, a stand-in for trabecular bone with known topology.
+    """
+    rng = np.random.default_rng(seed)
+    step = size / (cells + 1)
+    grid = (np.mgrid[1:cells + 1, 1:cells + 1].transpose(1, 2, 0) * step
+            + rng.uniform(-step / 4, step / 4, (cells, cells, 2))).astype(int)
+    image = np.zeros((size, size), np.uint8)
+    for r in range(cells):
+        for c in range(cells):
+            for dr, dc in ((0, 1), (1, 0)):
+                if r + dr < cells and c + dc < cells and rng.random() > 0.15:
+                    (y1, x1), (y2, x2) = grid[r, c], grid[r + dr, c + dc]
+                    cv.line(image, (int(x1), int(y1)), (int(x2), int(y2)), 255, width)
+    return image
+
+
+def stack_slice(z, scale):
+    files = stack_files(STACK)
+    image = read_slice(files[z])
+    if image is None:
+        raise ValueError(f"Failed to load {files[z]}")
+    return convert_image(resize_image(image, None, scale))
+
+
+def prepared(binary, scale):
+    analysis = SliceAnalysis(binary, "benchmark", scale=scale)
+    for name in SHARED:
+        getattr(analysis, name)
+    return analysis
+
+
+def cases(binary, scale, out_dir):
+    """(name, setup, run) for every benchmarked function; setup builds fresh inputs per run."""
+    png = lambda name: os.path.join(out_dir, f"{name}.png")
+
+    def raw():
+        bw = (binary > 0).astype(np.uint8)
+        skel = skeletonise_image(bw)
+        return bw, skel, classify_skeleton(skel)
+
+    def warm():
+        return prepared(binary, scale)
+
+    def with_tables():
+        analysis = prepared(binary, scale)
+        return (analysis, circle_image(analysis), eclipse_image(analysis), all_circle(analysis)[0])
+
+    def shape_skeleton():
+        analysis = prepared(binary, scale)
+        # Largest component's skeleton, as all_circle sees it
+        shape_id = int(np.argmax(analysis.areas)) + 1
+        sl = analysis.objects[shape_id - 1]
+        skel = analysis.shape_skeletons[sl] * (analysis.labeled[sl] == shape_id)
+        return skel, detect_nodes(skel)
+
+    return [
+        ("graph_analysis.skeletonise_image", raw, lambda a: skeletonise_image(a[0])),
+        ("graph_analysis.classify_skeleton", raw, lambda a: classify_skeleton(a[1])),
+        ("graph_analysis.find_nodes", raw, lambda a: find_nodes(a[1], a[2])),
+        ("graph_analysis.find_endpoints", raw, lambda a: find_endpoints(a[1], a[2])),
+        ("graph_analysis.connections", raw,
+         lambda a: skeleton_graph(a[1], a[2]).connections(max_distance=100)),
+        ("volume.compute_shape_volumes", warm, compute_shape_volumes),
+        ("skeleton.Core_code", warm, Core_code),
+        ("circle.circle_image", warm, circle_image),
+        ("eclipse.eclipse_image", warm, eclipse_image),
+        ("draw_node_circles.detect_nodes", shape_skeleton, lambda a: detect_nodes(a[0])),
+        ("draw_node_circles.geodesic_paths", shape_skeleton, lambda a: geodesic_paths(*a)),
+        ("draw_node_circles.all_circle", warm, all_circle),
+        ("render.skeleton", warm, lambda a: render_skeleton(a, png("skeleton"))),
+        ("render.circles", with_tables, lambda a: render_circles(a[0], a[1], png("circles"))),
+        ("render.ellipses", with_tables, lambda a: render_ellipses(a[0], a[2], png("ellipses"))),
+        ("render.all_circle", with_tables, lambda a: render_all_circle(a[0], a[3], png("all_circle"))),
+    ]
+
+
+def run_case(setup, run, repeat):
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            args = setup()
+            start = time.perf_counter()
+            run(args)
+            times.append(time.perf_counter() - start)
+    return {"min_s": min(times), "median_s": statistics.median(times)}
+
+
+def import_time(module, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        times.append(time.perf_counter() - start)
+    return {"min_s": min(times), "median_s": statistics.median(times)}
+
+
+def startup(args):
+    """Times every IMPORT_BUDGET import and returns (results, how many are over budget)."""
+    results, over = [], 0
+    print("\n▶ startup")
+    for module, budget in IMPORT_BUDGET.items():
+        name = f"import.{module}"
+        if args.only and args.only not in name:
+            continue
+        timing = import_time(module, args.repeat)
+        results.append({"input": "startup", "case": name, **timing})
+        flag = "" if timing["min_s"] <= budget else f"  🐢 over the {budget:.1f}s budget"
+        over += bool(flag)
+        print(f"  {name:<36} {timing['min_s']:8.4f}s  (median {timing['median_s']:.4f}s){flag}")
+    return results, over
+
+
+def inputs(args):
+    for seed in range(args.synthetic):
+        yield f"synthetic_{seed}", synthetic_network(args.size, max(2, args.size // 128), seed=seed), args.scale
+    if os.path.isdir(STACK):
+        for z in args.slices:
+            yield f"stack_z{z}", stack_slice(z, args.scale), args.scale
+    else:
+        print(f"⚠️  {STACK} not found, benchmarking synthetic images only")
+
+
+def compare(results, baseline_path, tolerance):
+    """Prints cases slower than the baseline by more than `tolerance` and returns how many there are."""
+    with open(baseline_path) as f:
+        baseline = {(r["input"], r["case"]): r for r in json.load(f)["results"]}
+    slower = 0
+    for r in results:
+        before = baseline.get((r["input"], r["case"]))
+        if before is None:
+            continue
+        ratio = r["min_s"] / before["min_s"] if before["min_s"] > 0 else 1.0
+        if ratio > 1 + tolerance:
+            slower += 1
+            print(f"  🐢 {r['input']} {r['case']}: {before['min_s']:.4f}s -> {r['min_s']:.4f}s ({ratio:.2f}x)")
+    print(f"{'⚠️ ' if slower else '✅'} {slower} case(s) more than {tolerance:.0%} slower than {baseline_path}")
+    return slower
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the slice analysers")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest counts (default: 3)")
+    parser.add_argument("--scale", type=int, default=1,
+                        help="upscale factor of the stack slices (default: 1, native resolution)")
+    parser.add_argument("--slices", type=int, nargs="*", default=list(STACK_SLICES),
+                        help=f"z indices of '{STACK}' to benchmark (default: {' '.join(map(str, STACK_SLICES))})")
+    parser.add_argument("--synthetic", type=int, default=2, help="synthetic networks to benchmark (default: 2)")
+    parser.add_argument("--size", type=int, default=512, help="side of the synthetic images (default: 512)")
+    parser.add_argument("--only", help="run only cases whose name contains this text")
+    parser.add_argument("--json", default="output/benchmark.json", help="where to write the timings")
+    parser.add_argument("--baseline", help="earlier --json output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown vs. the baseline reported as a regression (default: 0.2)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    out_dir = os.path.dirname(args.json) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    cv.setNumThreads(1)  # Comparable single-core timings
+
+    results, over_budget = startup(args)
+    for input_name, binary, scale in inputs(args):
+        print(f"\n▶ {input_name} ({binary.shape[1]}x{binary.shape[0]})")
+        for name, setup, run in cases(binary, scale, out_dir):
+            if args.only and args.only not in name:
+                continue
+            timing = run_case(setup, run, args.repeat)
+            results.append({"input": input_name, "case": name, **timing})
+            print(f"  {name:<36} {timing['min_s']:8.4f}s  (median {timing['median_s']:.4f}s)")
+
+    with open(args.json, "w") as f:
+        json.dump({"repeat": args.repeat, "scale": args.scale, "results": results}, f, indent=2)
+    print(f"\n📄 Timings saved to {args.json}")
+    slower = compare(results, args.baseline, args.tolerance) if args.baseline else 0
+    if slower or over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,178 @@
-from utils.io_utils import single_file, folder_image
+import argparse
+from utils.choices import MODES, STORE_FORMATS
 
-def main():
+# The analysis pipeline (cv2, scipy, skimage) and pandas are imported by the modes
+# that run them, so --help starts without them
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bone topology analysis")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--image", help="process a single image")
+    source.add_argument("--folder", help="process all slices of a folder or multi-page TIFF")
+    source.add_argument("--volume", help="analyse a folder of slices as one 3D stack")
+    source.add_argument("--sweep", metavar="SOURCE",
+                        help="compare threshold, scale and detector settings on a slice folder or image")
+    source.add_argument("--watch", metavar="DIR",
+                        help="keep analysing slices as they are written into a folder (service mode)")
+    source.add_argument("--export-csv", metavar="STORE",
+                        help="write every table of a results store to CSV in output/results_csv")
+    source.add_argument("--render", metavar="STORE",
+                        help="draw the annotated images of --slices from a results store into output/render")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for --folder (default: 1)")
+    parser.add_argument("--chunksize", type=int, default=1,
+                        help="slices sent to a worker at a time (default: 1)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="max chunks submitted at once (default: 2 x workers)")
+    parser.add_argument("--prefetch", type=int, default=4,
+                        help="slices decoded ahead by a background reader; 0 disables (default: 4)")
+    parser.add_argument("--scale", type=int, default=8,
+                        help="upscale factor per side before 2D analysis; 1 = native resolution (default: 8)")
+    parser.add_argument("--refine", action="store_true",
+                        help="measure radii on component crops upsampled to the 8x grid")
+    parser.add_argument("--threshold", choices=MODES, default="fixed",
+                        help="binarisation: fixed cut-off at 127, per-slice Otsu or adaptive (default: fixed)")
+    parser.add_argument("--adaptive-block", type=int, default=63,
+                        help="with --threshold adaptive, side of the local window in native pixels; "
+                             "it grows with --scale (default: 63)")
+    parser.add_argument("--adaptive-offset", type=float, default=10.0,
+                        help="with --threshold adaptive, grey levels a pixel must be above its local mean (default: 10)")
+    parser.add_argument("--store", choices=STORE_FORMATS,
+                        help="collect --folder tables into one columnar store instead of per-slice CSVs")
+    parser.add_argument("--store-path", default="output/results",
+                        help="folder of the results store (default: output/results)")
+    parser.add_argument("--export", action="store_true", default=None,
+                        help="with --store, also write the per-slice CSVs and PNGs")
+    parser.add_argument("--slices", type=int, nargs="+",
+                        help="slice ids to draw with --render or to use with --sweep")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="reuse binary images, labels, skeletons and EDTs of unchanged slices from DIR")
+    parser.add_argument("--cache-size", type=float, default=2.0,
+                        help="cache size limit in GB; least recently used entries go first (default: 2)")
+    parser.add_argument("--profile", metavar="CSV",
+                        help="record wall time, peak RSS and array sizes of every stage of --image/--folder to CSV")
+    parser.add_argument("--morphometry", action="store_true",
+                        help="also summarise BV/TV, Tb.Th, Tb.Sp, Tb.N and connectivity per slice and per stack")
+    parser.add_argument("--roi", choices=("slice", "stack"),
+                        help="only upscale and analyse the foreground box of each slice, or one box for the "
+                             "whole --folder stack; coordinates stay in the full frame")
+    parser.add_argument("--roi-margin", type=int, default=8,
+                        help="background kept around the --roi box, in native pixels (default: 8)")
+    parser.add_argument("--prune-length", type=float, default=0.0,
+                        help="cut skeleton spurs shorter than this many reported pixels before finding nodes")
+    parser.add_argument("--prune-ratio", type=float, default=0.0,
+                        help="also cut spurs shorter than this many times the bone's radius at their junction")
+    parser.add_argument("--merge-distance", type=float, default=0.0,
+                        help="merge junctions joined by a branch at most this many reported pixels long into one node")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="label, skeletonise and measure distances in tiles of this many analysed pixels per side")
+    parser.add_argument("--tile-threads", type=int, default=1,
+                        help="threads working on the tiles of one slice (default: 1)")
+    parser.add_argument("--sweep-scale", type=int, nargs="+", metavar="N",
+                        help="with --sweep, upscale factors to compare (default: 8)")
+    parser.add_argument("--sweep-threshold", type=int, nargs="+", metavar="T",
+                        help="with --sweep, grey-level binarisation cut-offs to compare (default: 127)")
+    parser.add_argument("--sweep-max-distance", type=float, nargs="+", metavar="D",
+                        help="with --sweep, longest node-to-node branches to compare, in reported pixels (default: 100)")
+    parser.add_argument("--sweep-min-distance", type=float, nargs="+", metavar="D",
+                        help="with --sweep, corner-peak min_distance values to compare, in reported pixels (default: 5)")
+    parser.add_argument("--sweep-threshold-rel", type=float, nargs="+", metavar="R",
+                        help="with --sweep, corner-peak threshold_rel values to compare (default: 0.1)")
+    parser.add_argument("--poll", type=float, default=1.0,
+                        help="with --watch, seconds between folder scans (default: 1)")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="with --watch, seconds a polled file must stay unchanged to count as written (default: 2)")
+    parser.add_argument("--idle", type=float, default=None,
+                        help="with --watch, stop after this many seconds without new slices (default: run until Ctrl+C)")
+    parser.add_argument("--status-every", type=float, default=10.0,
+                        help="with --watch, seconds between status reports (default: 10)")
+    parser.add_argument("--chunk-depth", type=int, default=32,
+                        help="slices per z-chunk for --volume (default: 32)")
+    parser.add_argument("--halo", type=int, default=None,
+                        help="least overlap slices on each side of a z-chunk; chunks that need more get more "
+                             "(default: from the bone's thickness)")
+    return parser.parse_args()
+
+def pruning(args):
+    # Pruning settings, or None when every step is off
+    if not (args.prune_length or args.prune_ratio or args.merge_distance):
+        return None
+    from utils.prune import Pruning
+    return Pruning(args.prune_length, args.prune_ratio, args.merge_distance)
+
+def adaptive(args):
+    # Adaptive threshold settings, or None for the other modes
+    if args.threshold != "adaptive":
+        return None
+    from utils.binarize import Adaptive
+    return Adaptive(args.adaptive_block, args.adaptive_offset)
+
+def menu():
+    from utils.io_utils import single_file, folder_image, volume_folder
     print("=== Image Processing Menu ===")
     print("1. Process a single image")
     print("2. Process all images in a folder")
-    choice = input("Enter your choice (1 or 2): ").strip()
+    print("3. Analyse a folder as a 3D stack")
+    choice = input("Enter your choice (1, 2 or 3): ").strip()
 
     if choice == "1":
         single_file()
     elif choice == "2":
         folder_image()
+    elif choice == "3":
+        volume_folder()
+    else:
+        print("❌ Invalid choice. Please enter 1, 2 or 3.")
+
+def main():
+    args = parse_args()
+    if args.image:
+        from utils.io_utils import single_file
+        single_file(args.image, scale=args.scale, refine=args.refine, mode=args.threshold,
+                    profile=args.profile, tile=args.tile, threads=args.tile_threads,
+                    morphometry=args.morphometry, roi=args.roi and "slice", roi_margin=args.roi_margin,
+                    prune=pruning(args), adaptive=adaptive(args))
+    elif args.folder:
+        from utils.io_utils import folder_image
+        folder_image(args.folder, workers=args.workers, chunksize=args.chunksize,
+                     max_in_flight=args.max_in_flight, scale=args.scale, refine=args.refine,
+                     mode=args.threshold, store=args.store, store_path=args.store_path,
+                     export=args.export, cache_dir=args.cache,
+                     cache_bytes=int(args.cache_size * 1024 ** 3), prefetch=args.prefetch,
+                     profile=args.profile, tile=args.tile, threads=args.tile_threads,
+                     morphometry=args.morphometry, roi=args.roi, roi_margin=args.roi_margin,
+                     prune=pruning(args), adaptive=adaptive(args))
+    elif args.sweep:
+        from utils.sweep import parameter_sweep
+        grid = {"scale": args.sweep_scale, "threshold": args.sweep_threshold,
+                "max_distance": args.sweep_max_distance, "min_distance": args.sweep_min_distance,
+                "threshold_rel": args.sweep_threshold_rel}
+        try:
+            parameter_sweep(args.sweep, {k: v for k, v in grid.items() if v}, slices=args.slices,
+                            workers=args.workers)
+        except ValueError as e:
+            print(f"❌ {e}")
+    elif args.watch:
+        from utils.watch import watch_folder
+        watch_folder(args.watch, workers=args.workers, scale=args.scale, refine=args.refine,
+                     mode=args.threshold, store=args.store, store_path=args.store_path,
+                     export=args.export, cache_dir=args.cache,
+                     cache_bytes=int(args.cache_size * 1024 ** 3), tile=args.tile, threads=args.tile_threads,
+                     poll=args.poll, settle=args.settle, idle=args.idle, report_every=args.status_every,
+                     roi=args.roi and "slice", roi_margin=args.roi_margin, prune=pruning(args),
+                     adaptive=adaptive(args))
+    elif args.volume:
+        from utils.io_utils import volume_folder
+        volume_folder(args.volume, chunk_depth=args.chunk_depth, halo=args.halo, mode=args.threshold,
+                      adaptive=adaptive(args))
+    elif args.export_csv:
+        from utils.results import export_csv
+        export_csv(args.export_csv, "output/results_csv")
+    elif args.render:
+        from utils.render import render_slice
+        render_slice(args.render, args.slices)
     else:
-        print("❌ Invalid choice. Please enter 1 or 2.")
+        menu()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,26 @@
+import numpy as np
+from utils.analysis import SliceAnalysis
+from utils.eclipse import fit_branch_ellipses
+
+WIDTH, ARM = 21, 120
+
+
+def plus_bone():
+    # Two crossing bars: four trabeculae meeting at one node
+    size = 2 * ARM + 41
+    img = np.zeros((size, size), np.uint8)
+    c, h = size // 2, WIDTH // 2
+    img[c - h:c + h + 1, c - ARM:c + ARM + 1] = 255
+    img[c - ARM:c + ARM + 1, c - h:c + h + 1] = 255
+    return img
+
+
+def test_one_ellipse_per_trabecula():
+    analysis = SliceAnalysis(plus_bone(), "plus")
+    ellipses = fit_branch_ellipses(analysis)
+    assert len(ellipses) == 4
+    # A bar of width w has the second moments of an ellipse with semi-minor w / sqrt(3)
+    np.testing.assert_allclose(ellipses['semi_minor'], WIDTH / np.sqrt(3), rtol=0.1)
+    assert (ellipses['semi_major'] > 2 * ellipses['semi_minor']).all()
+    off_axis = ellipses['angle'] % 90
+    assert (np.minimum(off_axis, 90 - off_axis) < 1).all()
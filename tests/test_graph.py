@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from utils.graph_analysis import classify_skeleton, junction_clusters, branch_segments, skeleton_graph
+
+ARM = 10
+
+
+def _canvas():
+    return np.zeros((2 * ARM + 5, 2 * ARM + 5), np.uint8), ARM + 2
+
+
+def plus():
+    skel, c = _canvas()
+    skel[c, c - ARM:c + ARM + 1] = 1
+    skel[c - ARM:c + ARM + 1, c] = 1
+    return skel
+
+
+def tee():
+    skel, c = _canvas()
+    skel[c, c - ARM:c + ARM + 1] = 1
+    skel[c:c + ARM + 1, c] = 1
+    return skel
+
+
+def wye():
+    skel, c = _canvas()
+    skel[c:c + ARM + 1, c] = 1
+    for k in range(1, ARM + 1):
+        skel[c - k, c - k] = skel[c - k, c + k] = 1
+    return skel
+
+
+def corner():
+    # The down-left arm leaves the junction through a pixel that also touches the upper arm
+    skel, c = _canvas()
+    skel[c - ARM:c + 1, c] = 1
+    skel[c, c - 1] = skel[c + 1, c - 1] = 1
+    for k in range(2, ARM):
+        skel[c + k, c + 1 - k] = 1
+    skel[c, c + 1] = 1
+    for k in range(1, ARM):
+        skel[c + k, c + 1 + k] = 1
+    return skel
+
+
+@pytest.mark.parametrize("make, arms, length", [
+    (plus, 4, [ARM] * 4),
+    (tee, 3, [ARM] * 3),
+    (wye, 3, [ARM, ARM * np.sqrt(2), ARM * np.sqrt(2)]),
+])
+def test_arms_are_separate_segments(make, arms, length):
+    skel = make()
+    kind = classify_skeleton(skel)
+    jlbl, n = junction_clusters(skel, kind)
+    assert n == 1
+    assert branch_segments(skel, jlbl)[1] == arms
+
+    graph = skeleton_graph(skel, kind)
+    assert len(graph.endpoints) == arms
+    # Every branch runs from the junction to one endpoint, along its own arm
+    assert sorted(graph.edges.tolist()) == [[0, k] for k in range(1, arms + 1)]
+    np.testing.assert_allclose(np.sort(graph.lengths), np.sort(length))
+
+
+def test_corner_pixel_joins_one_arm():
+    skel = corner()
+    kind = classify_skeleton(skel)
+    jlbl, n = junction_clusters(skel, kind)
+    segments, count = branch_segments(skel, jlbl)
+    assert n == 1 and count == 3
+    assert ((skel > 0) == ((segments > 0) | (jlbl > 0))).all()
+    graph = skeleton_graph(skel, kind)
+    assert sorted(graph.edges.tolist()) == [[0, 1], [0, 2], [0, 3]]
+
+
+def test_node_to_node_branch():
+    # Two tees joined by their stems: one branch between the nodes, four to the endpoints
+    top, bottom = tee(), tee()[::-1]
+    skel = np.concatenate([top[:-2], bottom[2:]])
+    graph = skeleton_graph(skel)
+    assert len(graph.nodes) == 2 and len(graph.endpoints) == 4
+    pairs, lengths = graph.shortest_edges()
+    between = pairs[:, 1] < len(graph.nodes)
+    assert pairs[between].tolist() == [[0, 1]]
+    np.testing.assert_allclose(lengths[between], 2 * ARM + 1)
+    np.testing.assert_allclose(lengths[~between], ARM)
+
+
+def test_segment_past_a_junction_is_split():
+    # A V whose apex touches a junction cluster: two branches meet there, none runs end to end
+    skel, c = _canvas()
+    for k in range(ARM + 1):
+        skel[c - ARM // 2 + k, c - k] = skel[c - ARM // 2 + k, c + k] = 1
+    jlbl = np.zeros(skel.shape, np.int32)
+    jlbl[c - ARM // 2 - 1, c] = 1
+    graph = skeleton_graph(skel, junctions=(jlbl, 1))
+    assert len(graph.endpoints) == 2
+    assert sorted(np.sort(graph.edges, axis=1).tolist()) == [[0, 1], [0, 2]]
+    np.testing.assert_allclose(graph.lengths, ARM * np.sqrt(2) + 1)
@@ -0,0 +1,30 @@
+import numpy as np
+from utils.analysis import SliceAnalysis
+from utils.morphometry import slice_morphometry
+
+SIZE = 241
+
+
+def bars(*spans):
+    # A slice of bone bars at the given (row slice, column slice)
+    img = np.zeros((SIZE, SIZE), np.uint8)
+    for rows, cols in spans:
+        img[rows, cols] = 255
+    return SliceAnalysis(img, "bars")
+
+
+def test_counts_of_a_plus():
+    # Four trabeculae meeting at one node
+    row = slice_morphometry(bars((slice(110, 131), slice(20, 221)), (slice(20, 221), slice(110, 131)))).iloc[0]
+    assert (row['shapes'], row['nodes'], row['endpoints'], row['branches']) == (1, 1, 4, 4)
+    assert (row['euler'], row['connectivity']) == (1, 0)
+
+
+def test_counts_of_a_ladder():
+    # Two rails and three rungs: six nodes, seven trabeculae between them, four ends, two loops
+    rails = [(slice(30, 211), slice(c, c + 15)) for c in (60, 166)]
+    rungs = [(slice(r, r + 15), slice(60, 181)) for r in (50, 113, 176)]
+    row = slice_morphometry(bars(*rails, *rungs)).iloc[0]
+    assert (row['shapes'], row['nodes'], row['endpoints']) == (1, 6, 4)
+    assert row['branches'] == 7 + 4
+    assert (row['euler'], row['connectivity']) == (-1, 2)
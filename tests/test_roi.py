@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.io_utils import process_slice
+from utils.binarize import MODES
+
+
+def slice_image():
+    # A lattice of bars whose brightness falls off to one side, off-centre in a dark noisy frame
+    rng = np.random.default_rng(0)
+    img = 15 + rng.integers(0, 5, (200, 240), dtype=np.uint8)
+    bone = np.zeros((90, 110), bool)
+    for r in (10, 40, 70):
+        bone[r:r + 8, 5:105] = True
+    for c in (10, 50, 90):
+        bone[5:85, c:c + 8] = True
+    shade = np.linspace(230, 90, bone.shape[1]).astype(np.uint8)
+    img[60:150, 100:210] = np.where(bone, shade, 60 + rng.integers(0, 10, bone.shape, dtype=np.uint8))
+    return np.dstack([img] * 3)
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_roi_matches_the_full_frame(mode):
+    image = slice_image()
+    full = process_slice("synthetic.tiff", 0, image=image, scale=2, mode=mode, export=False)
+    roi = process_slice("synthetic.tiff", 0, image=image, scale=2, mode=mode, export=False, roi="slice")
+    box = roi.pop("roi").iloc[0]
+    assert (box["y1"] - box["y0"], box["x1"] - box["x0"]) < image.shape[:2]
+    assert full.keys() == roi.keys()
+    for name, table in full.items():
+        pd.testing.assert_frame_equal(table, roi[name], obj=name)
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+from utils.volume3d import analyse_volume
+
+
+def lattice():
+    # Rods along z, y and x crossing at a few nodes, some ending inside the volume
+    vol = np.zeros((40, 48, 48), np.uint8)
+    for y, x in ((10, 10), (10, 34), (34, 22)):
+        vol[2:38, y - 2:y + 3, x - 2:x + 3] = 1
+    for z, y in ((8, 10), (20, 34), (31, 10)):
+        vol[z - 2:z + 3, y - 2:y + 3, 4:44] = 1
+    vol[15:18, 4:40, 21:24] = 1
+    return vol
+
+
+def test_tables_do_not_depend_on_chunk_depth(tmp_path):
+    vol = lattice()
+    whole = analyse_volume(vol, str(tmp_path / "whole"), chunk_depth=40)
+    chunked = analyse_volume(vol, str(tmp_path / "chunked"), chunk_depth=7)
+    assert len(whole["nodes"]) and len(whole["edges"])
+    for name, table in whole.items():
+        pd.testing.assert_frame_equal(table, chunked[name], obj=name)
@@ -0,0 +1,319 @@
+import os
+from functools import cached_property
+import cv2 as cv
+import numpy as np
+from scipy.ndimage import label, find_objects, distance_transform_edt
+from .graph_analysis import (skeletonise_image, classify_skeleton, find_endpoints, skeleton_graph,
+                             junction_clusters, cluster_centroids, branch_segments, JUNCTION)
+from .radius import distance_map
+from .components import iter_components, label_areas, label_centroids
+from .preprocess import REPORT_SCALE, upsample_crop
+from .binarize import binarize, THRESHOLD
+from .timing import stage, nbytes
+from .tiling import tiled_apply, tiled_label, tiled_edt, tiled_skeleton
+from .prune import prune_spurs, merge_junctions
+
+
+class SliceAnalysis:
+    """
+    One binarised slice with the features every analyser shares.
+
+    The binary mask, labels, skeleton, pixel classes, nodes, endpoints,
+    skeleton graph, branch segments and distance transform are computed lazily on first access and cached, so
+    passing the same object to Core_code, circle_image, eclipse_image,
+    all_circle and compute_shape_volumes does each step once per slice.
+
+    `scale` is how many analysed pixels span one original pixel. Geometry is
+    computed on the analysed grid and converted to the REPORT_SCALE grid with
+    report_coords / report_lengths, so a slice analysed at native resolution
+    (scale=1) reports in the same units as one analysed after an 8x upscale.
+    `source` is the optional native-resolution grey slice that fine_radii
+    upsamples, one component at a time, when sub-pixel radii are wanted.
+    When only a region of interest of the slice was upscaled, `origin` is
+    the region's (row, col) corner in native pixels of the full frame, and
+    reported coordinates refer to the full frame.
+
+    With an ArrayCache and a `cache_key` identifying the binary image (e.g.
+    input file hash, scale and threshold mode), labels, skeletons, branch
+    segments and the distance transform are also kept on disk across runs;
+    branch segments are keyed by the pruning settings too.
+
+    With `prune` settings (a Pruning), short spurs are cut from the skeleton
+    and nearby junction clusters merged before nodes and endpoints are
+    found; `pruning` counts what that removed.
+
+    With a `tile` size, labels, distance transform, skeleton, pixel classes
+    and junction clusters are computed tile by tile, on `threads` threads,
+    and stitched into the same arrays the full-frame routines return, so a
+    large slice never needs their full-frame temporaries at once.
+    """
+
+    def __init__(self, image, name="binary_image", scale=REPORT_SCALE, source=None,
+                 cache=None, cache_key=None, tile=None, threads=1, origin=(0, 0), prune=None):
+        self.gray = image
+        self.name = name
+        self.scale = scale
+        self.source = source
+        self.origin = tuple(origin)
+        self.cache = cache
+        self.cache_key = cache_key
+        self.tile = tile
+        self.threads = threads
+        self.prune = prune
+        self._pruned = {}
+
+    def _stage(self, name, compute, *key):
+        # Extra `key` parts tell apart values of one stage, e.g. under different pruning
+        with stage(name) as record:
+            if self.cache is None or self.cache_key is None:
+                value = compute()
+            else:
+                value = self.cache.fetch(self.cache.key(self.cache_key, name, *key), compute)
+            record["nbytes"] = nbytes(value)
+        return value
+
+    @classmethod
+    def load(cls, source, scale=REPORT_SCALE):
+        if isinstance(source, cls):
+            return source
+        img = cv.imread(source, cv.IMREAD_GRAYSCALE)
+        if img is None:
+            raise ValueError(f"Failed to load image from {source}")
+        return cls(img, os.path.splitext(os.path.basename(source))[0], scale)
+
+    @property
+    def unit(self):
+        # Reported pixels per analysed pixel
+        return REPORT_SCALE / self.scale
+
+    @property
+    def offset(self):
+        # Corner of the analysed region on the report grid
+        return np.asarray(self.origin) * REPORT_SCALE
+
+    def report_coords(self, coords):
+        # Pixel centres map as in cv.resize: (x + 0.5) * unit - 0.5, then shift by the region's corner
+        if self.unit == 1:
+            return np.asarray(coords) + self.offset if any(self.origin) else coords
+        return (np.asarray(coords, dtype=float) + 0.5) * self.unit - 0.5 + self.offset
+
+    def grid_coords(self, coords):
+        # Inverse of report_coords: reported positions back on the analysed grid
+        if self.unit == 1:
+            return np.asarray(coords) - self.offset if any(self.origin) else coords
+        return (np.asarray(coords, dtype=float) - self.offset + 0.5) / self.unit - 0.5
+
+    def report_lengths(self, values, power=1):
+        # power=2 for areas
+        if self.unit == 1:
+            return values
+        return np.asarray(values) * self.unit ** power
+
+    def grid_lengths(self, values):
+        # Inverse of report_lengths: reported lengths on the analysed grid
+        if self.unit == 1:
+            return values
+        return np.asarray(values) / self.unit
+
+    def fine_radii(self, shape_id, slices, nodes):
+        """
+        Radii of `nodes` (coordinates in the `slices` crop) in reported
+        pixels, measured on the component's bounding box re-binarised after
+        upsampling it to the report grid; the rest of the slice is never
+        upsampled.
+        """
+        # Crop `source` (native pixels) or the analysed image itself
+        step = self.scale if self.source is not None else 1
+        image = self.source if self.source is not None else self.gray
+        src_sl = tuple(slice(s.start // step, -(-s.stop // step)) for s in slices)
+        own_sl = tuple(slice(s.start * step, s.stop * step) for s in src_sl)
+
+        fine = upsample_crop(image, src_sl, self.unit * step) > THRESHOLD
+        # Keep the component's own pixels: its mask grown by one analysed pixel
+        own = cv.dilate((self.labeled[own_sl] == shape_id).astype(np.uint8), np.ones((3, 3), np.uint8))
+        fine &= cv.resize(own, fine.shape[::-1], interpolation=cv.INTER_NEAREST) > 0
+        fine_dist = distance_transform_edt(fine)
+
+        shift = np.array([s.start - o.start for s, o in zip(slices, own_sl)])
+        pos = np.asarray(nodes, dtype=float).reshape(-1, 2) + shift
+        pos = np.rint((pos + 0.5) * self.unit - 0.5)
+        pos = np.clip(pos, 0, np.array(fine.shape) - 1).astype(np.intp)
+        return fine_dist[pos[:, 0], pos[:, 1]]
+
+    @cached_property
+    def bw(self):
+        return binarize(self.gray)
+
+    @cached_property
+    def labels(self):
+        def compute():
+            return tiled_label(self.bw, self.tile, self.threads) if self.tile else label(self.bw)
+        labeled, num_shapes = self._stage("labels", compute)
+        return labeled, int(num_shapes)
+
+    @property
+    def labeled(self):
+        return self.labels[0]
+
+    @property
+    def num_shapes(self):
+        return self.labels[1]
+
+    @cached_property
+    def objects(self):
+        return find_objects(self.labeled)
+
+    def components(self, pad=1):
+        return iter_components(self.labeled, self.objects, pad)
+
+    @cached_property
+    def areas(self):
+        return label_areas(self.labeled, self.num_shapes)
+
+    @cached_property
+    def centroids(self):
+        return label_centroids(self.labeled, self.num_shapes)
+
+    def _skeletonise(self, mask, dist):
+        # `dist` returns the mask's distance map, which only tiling needs
+        if self.tile:
+            return tiled_skeleton(mask, dist(), self.tile, self.threads)
+        return skeletonise_image(mask)
+
+    def _edt(self, mask):
+        return tiled_edt(mask, self.tile, threads=self.threads) if self.tile else distance_map(mask)
+
+    @cached_property
+    def raw_skeleton(self):
+        # The skeleton as skeletonize leaves it, before pruning
+        return self._stage("skeleton", lambda: self._skeletonise(self.bw, lambda: self.dist))
+
+    @cached_property
+    def skeleton(self):
+        if self.prune is None or not (self.prune.min_length or self.prune.radius_ratio):
+            return self.raw_skeleton
+        with stage("prune"):
+            skel, self._pruned = prune_spurs(self.raw_skeleton, self.dist,
+                                             self.prune.min_length / self.unit, self.prune.radius_ratio)
+        return skel
+
+    @cached_property
+    def kind(self):
+        # Endpoint/branch/junction/crossing class of every skeleton pixel
+        with stage("classify"):
+            if self.tile:
+                return tiled_apply(classify_skeleton, self.skeleton, self.tile, 1, np.uint8, self.threads)
+            return classify_skeleton(self.skeleton)
+
+    @cached_property
+    def junctions(self):
+        # (labels, count) of the clusters of junction pixels
+        if self.tile:
+            junctions = tiled_label(self.kind >= JUNCTION, self.tile, self.threads)
+        else:
+            junctions = junction_clusters(self.skeleton, self.kind)
+        if self.prune is None or not self.prune.merge_distance:
+            return junctions
+        with stage("merge_junctions"):
+            self._pruned.setdefault("nodes_before", int(junctions[1]))
+            return merge_junctions(self.skeleton, self.kind, junctions, self.prune.merge_distance / self.unit)
+
+    @property
+    def _prune_key(self):
+        # Cache key parts of the stages read from the pruned skeleton and merged junctions
+        return (tuple(self.prune),) if self.prune is not None and any(self.prune) else ()
+
+    @property
+    def pruning(self):
+        """
+        Node and endpoint counts of the slice's skeleton (edges, endpoints and
+        ellipses) before and after pruning, the spurs cut from it, and those
+        cut from the per-shape skeletons (node circles and all_circle).
+        """
+        nodes, endpoints = len(self.nodes), len(self.endpoints)
+        self.shape_skeletons  # counts the per-shape spurs
+        before = {"nodes_before": nodes, "endpoints_before": endpoints, "spurs": 0, "shape_spurs": 0, **self._pruned}
+        return {
+            "nodes_before": before["nodes_before"],
+            "nodes": nodes,
+            "nodes_removed": before["nodes_before"] - nodes,
+            "endpoints_before": before["endpoints_before"],
+            "endpoints": endpoints,
+            "endpoints_removed": before["endpoints_before"] - endpoints,
+            "spurs": before["spurs"],
+            "shape_spurs": before["shape_spurs"],
+        }
+
+    @cached_property
+    def nodes(self):
+        with stage("nodes"):
+            return cluster_centroids(*self.junctions)
+
+    @cached_property
+    def endpoints(self):
+        with stage("endpoints"):
+            return find_endpoints(self.skeleton, self.kind)
+
+    @cached_property
+    def graph(self):
+        with stage("graph"):
+            return skeleton_graph(self.skeleton, self.kind, self.junctions)
+
+    @cached_property
+    def branches(self):
+        # (labels, count) of the skeleton's branch segments between junctions
+        def compute():
+            return branch_segments(self.skeleton, self.junctions[0])
+        segments, num_branches = self._stage("branches", compute, *self._prune_key)
+        return segments, int(num_branches)
+
+    @cached_property
+    def dist(self):
+        return self._stage("dist", lambda: self._edt(self.bw))
+
+    @cached_property
+    def marrow(self):
+        # The background between the trabeculae
+        return (self.bw == 0).astype(np.uint8)
+
+    @cached_property
+    def marrow_dist(self):
+        return self._stage("marrow_dist", lambda: self._edt(self.marrow))
+
+    @cached_property
+    def marrow_skeleton(self):
+        return self._stage("marrow_skeleton", lambda: self._skeletonise(self.marrow, lambda: self.marrow_dist))
+
+    @cached_property
+    def raw_shape_skeletons(self):
+        return self._stage("shape_skeletons", self._shape_skeletons)
+
+    @cached_property
+    def shape_skeletons(self):
+        # The per-shape skeletons, each pruned like the slice's
+        if self.prune is None or not (self.prune.min_length or self.prune.radius_ratio):
+            return self.raw_shape_skeletons
+        out = np.zeros_like(self.raw_shape_skeletons)
+        spurs = 0
+        with stage("prune_shapes"):
+            for _, slices, mask in self.components():
+                skel, info = prune_spurs(self.raw_shape_skeletons[slices] * mask, self.dist[slices],
+                                         self.prune.min_length / self.unit, self.prune.radius_ratio)
+                out[slices] |= skel
+                spurs += info["spurs"]
+        self._pruned["shape_spurs"] = spurs
+        return out
+
+    def shape_junctions(self, skel, kind):
+        # (labels, count) of the junction clusters of one shape's skeleton crop, merged like the slice's
+        junctions = junction_clusters(skel, kind)
+        if self.prune is None or not self.prune.merge_distance:
+            return junctions
+        return merge_junctions(skel, kind, junctions, self.prune.merge_distance / self.unit)
+
+    def _shape_skeletons(self):
+        # Union of the per-shape skeletons; each lies inside its own label
+        out = np.zeros_like(self.bw)
+        for _, slices, mask in self.components():
+            out[slices] |= skeletonise_image(mask.astype(np.uint8))
+        return out
@@ -0,0 +1,85 @@
+import traceback
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+def chunked(items, size):
+    # Works on generators too, so tasks are only produced as chunks are submitted
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def _run_chunk(func, chunk):
+    results = []
+    for task in chunk:
+        try:
+            results.append((task, func(*task), None))
+        except Exception:
+            results.append((task, None, traceback.format_exc()))
+    return results
+
+
+def _handle(results, on_result):
+    failures = []
+    for task, result, error in results:
+        if error is not None:
+            failures.append((task, error))
+        elif on_result is not None:
+            on_result(task, result)
+    return failures
+
+
+def _collect(futures, chunk_of, on_result):
+    failures = []
+    for future in futures:
+        chunk = chunk_of.pop(future)
+        error = future.exception()
+        if error is not None:
+            # The worker itself died; every slice of its chunk is lost
+            failures += [(task, repr(error)) for task in chunk]
+            continue
+        failures += _handle(future.result(), on_result)
+    return failures
+
+
+def run_batch(func, tasks, workers=1, chunksize=1, max_in_flight=None, initializer=None, on_result=None):
+    """
+    Runs func(*task) for every task and returns a list of (task, traceback)
+    for the ones that raised, instead of aborting on the first failure.
+
+    Args:
+        func: module-level (picklable) function
+        tasks: iterable of argument tuples, consumed lazily (a generator
+               is only advanced while fewer than max_in_flight chunks are pending)
+        workers: number of processes; 1 runs in the current process
+        chunksize: tasks sent to a worker per submission
+        max_in_flight: cap on submitted, unfinished chunks (default 2 * workers),
+                       so only a bounded number of slices is held in memory
+        initializer: optional callable run once in each worker
+        on_result: optional callable(task, result) run in this process for
+                   every task that succeeded, e.g. to append its tables to
+                   a single ResultStore
+    """
+    chunks = chunked(tasks, max(1, chunksize))
+
+    if workers <= 1:
+        if initializer is not None:
+            initializer()
+        failures = []
+        for chunk in chunks:
+            failures += _handle(_run_chunk(func, chunk), on_result)
+        return failures
+
+    max_in_flight = max(1, max_in_flight or 2 * workers)
+    failures = []
+    chunk_of = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as pool:
+        for chunk in chunks:
+            if len(chunk_of) >= max_in_flight:
+                done, _ = wait(list(chunk_of), return_when=FIRST_COMPLETED)
+                failures += _collect(done, chunk_of, on_result)
+            chunk_of[pool.submit(_run_chunk, func, chunk)] = chunk
+        done, _ = wait(list(chunk_of))
+        failures += _collect(done, chunk_of, on_result)
+    return failures
@@ -0,0 +1,70 @@
+import cv2 as cv
+from typing import NamedTuple
+from .choices import MODES
+
+THRESHOLD = 127
+# Neighbourhood of the adaptive threshold in native pixels, about two trabecular spacings
+ADAPTIVE_BLOCK = 63
+# Grey levels a pixel must be above its neighbourhood's mean to count as bone
+ADAPTIVE_OFFSET = 10
+
+
+class Adaptive(NamedTuple):
+    """
+    Settings of the "adaptive" threshold.
+
+    block_size: side of the neighbourhood the local mean is taken over, in
+                native pixels; it grows with the upscale, so the window
+                covers the same tissue at every scale
+    offset: grey levels a pixel must exceed the local mean by
+    """
+    block_size: int = ADAPTIVE_BLOCK
+    offset: float = ADAPTIVE_OFFSET
+
+    def kernel(self, scale=1):
+        # Odd window on an image upscaled `scale` times
+        return max(3, self.block_size * scale) | 1
+
+
+def to_gray(image):
+    return cv.cvtColor(image, cv.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def otsu_threshold(image):
+    """Otsu's cut-off for an 8-bit image, from its histogram."""
+    t, _ = cv.threshold(to_gray(image), 0, 255, cv.THRESH_BINARY | cv.THRESH_OTSU)
+    return t
+
+
+def binarize(image, mode="fixed", maxval=1, threshold=None, adaptive=None, scale=1, out=None):
+    """
+    Thresholds an 8-bit image straight to a uint8 mask of 0 / maxval, with no
+    float or int64 temporaries.
+
+    Args:
+        image: grey or BGR uint8 image
+        mode: "fixed" (pixels > threshold), "otsu" (per-image threshold from
+              the histogram) or "adaptive" (local Gaussian mean, for CT slices
+              with uneven brightness)
+        maxval: value of foreground pixels, 1 for masks or 255 for images
+        threshold: cut-off for "fixed" (default 127); for "otsu", a cut-off
+                   already found with otsu_threshold, e.g. on the whole
+                   frame an image was cropped from
+        adaptive: Adaptive settings for "adaptive", the defaults when None
+        scale: how many times `image` was upscaled from the native slice
+        out: optional preallocated uint8 array (e.g. one slice of a
+             memory-mapped stack) to write the mask into
+    """
+    gray = to_gray(image)
+    if mode == "fixed" or (mode == "otsu" and threshold is not None):
+        cut = THRESHOLD if threshold is None else threshold
+        _, bw = cv.threshold(gray, cut, maxval, cv.THRESH_BINARY, dst=out)
+    elif mode == "otsu":
+        _, bw = cv.threshold(gray, 0, maxval, cv.THRESH_BINARY | cv.THRESH_OTSU, dst=out)
+    elif mode == "adaptive":
+        adaptive = adaptive or Adaptive()
+        bw = cv.adaptiveThreshold(gray, maxval, cv.ADAPTIVE_THRESH_GAUSSIAN_C, cv.THRESH_BINARY,
+                                  adaptive.kernel(scale), -adaptive.offset, dst=out)
+    else:
+        raise ValueError(f"Unknown threshold mode {mode!r}, expected one of {MODES}")
+    return bw
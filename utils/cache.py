@@ -0,0 +1,81 @@
+import os
+import hashlib
+import numpy as np
+
+
+def array_hash(array):
+    # Hash of a decoded slice: its pixels, shape and dtype
+    digest = hashlib.sha1(np.ascontiguousarray(array).data)
+    digest.update(repr((array.shape, array.dtype.str)).encode())
+    return digest.hexdigest()
+
+
+class ArrayCache:
+    """
+    On-disk cache of intermediate arrays (binary mask, labels, skeleton,
+    EDT, ...) as compressed .npz files.
+
+    Keys are hashes of whatever the arrays depend on, typically the input
+    slice's content hash, the stage name and the stage's parameters, so a
+    rerun only recomputes stages whose inputs or parameters changed. Once
+    the cache grows past `max_bytes` the least recently used entries are
+    deleted. Several processes may share one cache folder.
+    """
+
+    def __init__(self, root="output/cache", max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.npz")
+
+    def get(self, key):
+        """Returns the cached array, or tuple of arrays, for `key`, or None on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = tuple(data[f"arr_{i}"] for i in range(len(data.files)))
+            os.utime(path)  # Mark as recently used
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return arrays[0] if len(arrays) == 1 else arrays
+
+    def put(self, key, *arrays):
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, *arrays)
+        os.replace(tmp, path)  # Readers never see a partial file
+        self.evict()
+
+    def fetch(self, key, compute):
+        """Returns the cached value for `key`, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, *(value if isinstance(value, tuple) else (value,)))
+        return value
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,4 @@
+# Choices of the command line options, kept free of dependencies so main.py --help starts without cv2 or pandas
+
+MODES = ("fixed", "otsu", "adaptive")
+STORE_FORMATS = ("parquet", "hdf5")
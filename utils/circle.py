@@ -1,90 +1,102 @@
-import os
 import cv2
 import numpy as np
-from skimage.morphology import skeletonize
-from scipy.ndimage import distance_transform_edt, label
 import pandas as pd
-from .graph_analysis import *
-from .skeleton import *
+from .graph_analysis import classify_skeleton, cluster_centroids, find_endpoints
+from .radius import node_radii
+from .analysis import SliceAnalysis
+from .components import crop_offset
+from .records import make_records, coords, NODE_DTYPE
+from .visualization import draw_circles, draw_skeleton, draw_labels, draw_shape_labels
+from .timing import stage, timed
 
-def geodesic_radius(binary_img, node):
-    mask = (binary_img > 0).astype(np.uint8)
-    dist = distance_transform_edt(mask)
-    y, x = node
-    return dist[y, x]
+def circle_image(img_path, out_img_path=None, out_csv_path=None, refine=False):
+    # Load binary image and its cached labels
+    analysis = SliceAnalysis.load(img_path)
+    shape_name = analysis.name
 
-def circle_image(img_path, out_img_path, out_csv_path):
-    # Load binary image
-    bw = load_binary(img_path)
-    shape_name = os.path.splitext(os.path.basename(img_path))[0]
+    labeled, num_shapes = analysis.labels
 
-    # Label connected components
-    labeled, num_shapes = label(bw)
-    out_img = cv2.cvtColor((bw * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    # One distance transform for every node in the image
+    dist = analysis.dist
 
-    node_data = []
-
-    node_id_counter = 1  # Global node ID
+    node_records = []
+    endpoints_by_shape = {}
 
     print(f"🔎 Found {num_shapes} shapes in {shape_name}")
 
-    for shape_id in range(1, num_shapes + 1):
-        mask = (labeled == shape_id).astype(np.uint8)
-
-        # Skeletonize shape
-        skel = skeletonise_image(mask)
-
-        # Find nodes and endpoints
-        nodes = find_nodes(skel)
-        endpoints = find_endpoints(skel)
-
-        print(f"  ▶ Shape {shape_id}: {len(nodes)} nodes, {len(endpoints)} endpoints")
-
-        # Draw skeleton in red
-        ys, xs = np.where(skel)
-        out_img[ys, xs] = (0, 0, 255)  # Red
-
-        for idx, (r, c) in enumerate(nodes):
-            binary_255 = (mask * 255).astype(np.uint8)
-            radius = geodesic_radius(binary_255, (r, c))
-
-            node_data.append({
-                'shape_name': shape_name,
-                'shape_id': shape_id,
-                'node_id': node_id_counter,
-                'x': c,
-                'y': r,
-                'radius': radius
-            })
-
-            # Draw node and radius
-            cv2.circle(out_img, (c, r), int(radius), (0, 255, 0), 2)
-            cv2.circle(out_img, (c, r), 5, (0, 255, 0), -1)
-            cv2.putText(out_img, str(node_id_counter), (c + 8, r - 8),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 1)
-            node_id_counter += 1
-
-        # Draw endpoints
-        for ep_idx, (r, c) in enumerate(endpoints):
-            label_txt = chr(ord('A') + ep_idx)
-            cv2.circle(out_img, (c, r), 5, (255, 0, 0), -1)
-            cv2.putText(out_img, label_txt, (c + 8, r - 8),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
-
-        # Label shape ID in center
-        ys_s, xs_s = np.where(mask)
-        if len(xs_s) > 0 and len(ys_s) > 0:
-            cx, cy = int(np.mean(xs_s)), int(np.mean(ys_s))
-            cv2.putText(out_img, f'S{shape_id}', (cx - 10, cy),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
+    for shape_id, sl, mask in analysis.components():
+        r0, c0 = crop_offset(sl)
+
+        # Skeleton of this shape, cropped to its bounding box (shared with all_circle)
+        skel = analysis.shape_skeletons[sl] * mask
+
+        # Find nodes and endpoints (crop coordinates), junctions merged like the slice's
+        kind = classify_skeleton(skel)
+        local_nodes = cluster_centroids(*analysis.shape_junctions(skel, kind))
+        local_endpoints = find_endpoints(skel, kind)
+        pos = np.asarray(local_nodes, dtype=np.int64).reshape(-1, 2)
+        rec = make_records(NODE_DTYPE, len(pos), shape_id=shape_id, r=pos[:, 0] + r0, c=pos[:, 1] + c0)
+        if refine:
+            rec['radius'] = analysis.fine_radii(shape_id, sl, pos)
+        else:
+            rec['radius'] = analysis.report_lengths(node_radii(mask, pos, dist=dist[sl]))
+        node_records.append(rec)
+        endpoints_by_shape[shape_id] = [(r + r0, c + c0) for r, c in local_endpoints]
+
+        print(f"  ▶ Shape {shape_id}: {len(rec)} nodes, {len(local_endpoints)} endpoints")
+
+    # Global node ids, then one table built from the record columns
+    nodes = np.concatenate(node_records) if node_records else make_records(NODE_DTYPE)
+    nodes['id'] = np.arange(1, len(nodes) + 1)
+    nodes_out = analysis.report_coords(coords(nodes))
+    df = pd.DataFrame({'shape_name': shape_name, 'shape_id': nodes['shape_id'], 'node_id': nodes['id'],
+                       'x': nodes_out[:, 1], 'y': nodes_out[:, 0], 'radius': nodes['radius']})
 
     # Save final annotated image
-    cv2.imwrite(out_img_path, out_img)
+    if out_img_path:
+        render_circles(analysis, df, out_img_path, endpoints_by_shape)
 
     # Save node data to CSV
-    if node_data:
-        df = pd.DataFrame(node_data)
-        df.to_csv(out_csv_path, index=False)
-        print(f"✅ Saved {len(node_data)} node entries to {out_csv_path}")
-    else:
+    if not len(nodes):
         print("⚠️ No nodes detected.")
+    elif out_csv_path:
+        with stage("io"):
+            df.to_csv(out_csv_path, index=False)
+        print(f"✅ Saved {len(nodes)} node entries to {out_csv_path}")
+    return df
+
+
+def shape_endpoints(analysis):
+    # Endpoints of every shape's own skeleton, as circle_image finds them
+    endpoints = {}
+    for shape_id, sl, mask in analysis.components():
+        r0, c0 = crop_offset(sl)
+        endpoints[shape_id] = [(r + r0, c + c0) for r, c in find_endpoints(analysis.shape_skeletons[sl] * mask)]
+    return endpoints
+
+
+@timed("render")
+def render_circles(analysis, nodes, out_img_path, endpoints_by_shape=None):
+    """
+    Draws a circle_image table: per-shape skeletons, node radius circles and
+    ids, endpoint letters and shape ids, on the analysed grid.
+    """
+    if endpoints_by_shape is None:
+        endpoints_by_shape = shape_endpoints(analysis)
+    out_img = cv2.cvtColor((analysis.bw * 255).astype(np.uint8), cv2.COLOR_GRAY2BGR)
+    draw_skeleton(out_img, analysis.shape_skeletons)
+
+    if len(nodes):
+        centers = np.rint(analysis.grid_coords(nodes[['y', 'x']].to_numpy())).astype(int)
+        radii = (nodes['radius'].to_numpy() / analysis.unit).astype(int)
+        draw_circles(out_img, centers, radii, (0, 255, 0), 2)
+        draw_circles(out_img, centers, 5, (0, 255, 0))
+        draw_labels(out_img, centers, nodes['node_id'], (0, 255, 255), 0.6, 1, (8, -8))
+
+    ends = [p for shape_ends in endpoints_by_shape.values() for p in shape_ends]
+    letters = [chr(ord('A') + i) for shape_ends in endpoints_by_shape.values() for i in range(len(shape_ends))]
+    draw_circles(out_img, ends, 5, (255, 0, 0))
+    draw_labels(out_img, ends, letters, (255, 255, 0), 0.6, 1, (8, -8))
+
+    draw_shape_labels(out_img, analysis.centroids)
+    cv2.imwrite(out_img_path, out_img)
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.ndimage import find_objects
+
+
+def pad_slices(slices, shape, pad):
+    return tuple(
+        slice(max(s.start - pad, 0), min(s.stop + pad, size))
+        for s, size in zip(slices, shape)
+    )
+
+
+def iter_components(labeled, objects=None, pad=1):
+    """
+    Yields (shape_id, slices, mask) for every labelled shape, where `mask` is
+    the shape cropped to its bounding box grown by `pad` pixels and `slices`
+    locates that crop in the full frame. Per-shape work then scales with the
+    size of the shape instead of the size of the image.
+    """
+    if objects is None:
+        objects = find_objects(labeled)
+    for shape_id, slices in enumerate(objects, start=1):
+        if slices is None:
+            continue
+        slices = pad_slices(slices, labeled.shape, pad)
+        yield shape_id, slices, labeled[slices] == shape_id
+
+
+def crop_offset(slices):
+    return tuple(s.start for s in slices)
+
+
+def label_areas(labeled, num_shapes):
+    return np.bincount(labeled.ravel(), minlength=num_shapes + 1)[1:]
+
+
+def label_centroids(labeled, num_shapes):
+    """Returns a (num_shapes, ndim) array of centroids, e.g. (row, col), NaN for empty labels."""
+    coords = np.nonzero(labeled)
+    ids = labeled[coords]
+    counts = np.bincount(ids, minlength=num_shapes + 1)[1:]
+    sums = [np.bincount(ids, weights=axis, minlength=num_shapes + 1)[1:] for axis in coords]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.stack([s / counts for s in sums], axis=1)
+
+
+def group_by_label(points, labeled, num_shapes):
+    """Splits (row, col) points into one list per shape, keeping their order."""
+    groups = [[] for _ in range(num_shapes + 1)]
+    if len(points):
+        coords = np.asarray(points, dtype=np.intp).reshape(-1, labeled.ndim)
+        for p, shape_id in zip(points, labeled[tuple(coords.T)]):
+            groups[shape_id].append(p)
+    return groups[1:]
@@ -1,47 +1,98 @@
 import os
 import cv2
 import numpy as np
-from skimage.morphology import skeletonize
-from skimage.feature import corner_peaks
-from scipy.ndimage import distance_transform_edt, label
 import pandas as pd
 import random
-from skimage.graph import route_through_array
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra, breadth_first_order
+from .radius import node_radii
+from .analysis import SliceAnalysis
+from .components import crop_offset
+from .records import make_records, coords, NODE_DTYPE
+from .timing import stage, timed
+from .visualization import draw_circles, draw_shape_labels
+
+def _trace_back(traceback, offsets, start, ends, path_mask):
+    # The traversal's predecessor links form a tree rooted at `start`; mark the
+    # branches leading to `ends` and return their along-path lengths
+    width = traceback.shape[1]
+    start_flat = start[0] * width + start[1]
+    rows, cols = np.nonzero(traceback >= 0)
+    pix = rows * width + cols
+    step = offsets[traceback[rows, cols]]
+    keep = pix != start_flat
+    pix, step = pix[keep], step[keep]
+    verts = np.insert(pix, np.searchsorted(pix, start_flat), start_flat)
+    child = np.searchsorted(verts, pix)
+    parent = np.searchsorted(verts, pix - (step[:, 0] * width + step[:, 1]))
+    end_ids = np.searchsorted(verts, ends[:, 0] * width + ends[:, 1])
+    n = len(verts)
+
+    down = csr_matrix((np.hypot(step[:, 0], step[:, 1]), (parent, child)), shape=(n, n))
+    lengths = dijkstra(down, indices=np.searchsorted(verts, start_flat))[end_ids]
+
+    # Walk up from every end at once through an extra root joined to the ends
+    up = csr_matrix((np.ones(len(child) + len(end_ids)),
+                     (np.concatenate([child, np.full(len(end_ids), n)]),
+                      np.concatenate([parent, end_ids]))), shape=(n + 1, n + 1))
+    on_path = breadth_first_order(up, n, directed=True, return_predecessors=False)
+    path_mask.flat[verts[on_path[on_path < n]]] = True
+    return lengths
+
+def geodesic_paths(skeleton, nodes, max_ratio=1.5):
+    """
+    Minimum-cost paths between every pair of nodes over the cost map
+    1 - skeleton, using one MCP_Geometric traversal per node instead of one
+    route_through_array call per pair. Each traversal stops once every
+    later node has been reached. Pairs whose cost exceeds max_ratio times
+    their Euclidean distance are dropped.
+
+    Returns (connections, path_mask): a list of (i, j, cost, length) with the
+    along-path length in pixels, and a boolean mask of every kept path pixel.
+    """
+    from skimage.graph import MCP_Geometric  # Heavy, only needed once paths are traced
+
+    cost_map = 1.0 - skeleton.astype(np.uint8)  # low cost where skeleton is present
+    path_mask = np.zeros(cost_map.shape, bool)
+    nodes = np.asarray(nodes, dtype=np.intp).reshape(-1, 2)
+    connections = []
+    if len(nodes) < 2:
+        return connections, path_mask
+
+    mcp = MCP_Geometric(cost_map, fully_connected=True)
+    offsets = np.asarray(mcp.offsets, dtype=np.intp)
+    for i in range(len(nodes) - 1):
+        start = nodes[i]
+        costs, traceback = mcp.find_costs([tuple(start)], [tuple(p) for p in nodes[i + 1:]])
+        later = np.arange(i + 1, len(nodes))
+        cost = costs[nodes[later, 0], nodes[later, 1]]
+        euclid = np.hypot(*(nodes[later] - start).T)
+        keep = cost <= max_ratio * euclid  # Skip very long or unreachable connections
+        lengths = _trace_back(traceback, offsets, start, nodes[later[keep]], path_mask)
+        connections += [(i, int(j), c, l) for j, c, l in zip(later[keep], cost[keep], lengths)]
+    return connections, path_mask
 
 def connect_nodes_with_geodesic_lines(image, skeleton, nodes, color=(0, 255, 255)):
-    skeleton = skeleton.astype(np.uint8)
-    cost_map = 1.0 - skeleton  # low cost where skeleton is present
-
-    for i in range(len(nodes)):
-        for j in range(i + 1, len(nodes)):
-            start = tuple(nodes[i])
-            end = tuple(nodes[j])
-
-            # Use geodesic route through the skeleton
-            try:
-                path, cost = route_through_array(cost_map, start, end, fully_connected=True)
-                path = np.array(path)
-                if len(path) < 2 or cost > 1.5 * np.linalg.norm(np.array(start) - np.array(end)):
-                    continue  # Skip very long or invalid connections
-
-                # Draw the path in yellow
-                for k in range(len(path) - 1):
-                    pt1 = (path[k][1], path[k][0])
-                    pt2 = (path[k + 1][1], path[k + 1][0])
-                    cv2.line(image, pt1, pt2, color, 1)
-            except:
-                continue
-
-
-def detect_nodes(skel_img):
-    coords = corner_peaks(skel_img.astype(np.uint8), min_distance=5, threshold_rel=0.1)
+    connections, path_mask = geodesic_paths(skeleton, nodes)
+    # Paths are chains of neighbouring pixels, so colouring the mask matches drawing them line by line
+    image[path_mask] = color
+    return connections
+
+
+# corner_peaks' minimum distance between nodes, in reported pixels
+NODE_MIN_DISTANCE = 5
+
+# One record per shape of an all_circle run, skeleton length in analysed pixels
+SHAPE_DTYPE = np.dtype([('shape_id', np.int64), ('num_nodes', np.int64), ('skeleton_length', np.int64)])
+
+def detect_nodes(skel_img, min_distance=NODE_MIN_DISTANCE, threshold_rel=0.1):
+    from skimage.feature import corner_peaks  # Pulls in scipy.stats, so loaded on first use
+    coords = corner_peaks(skel_img.astype(np.uint8), min_distance=min_distance, threshold_rel=threshold_rel)
     return coords
 
-def geodesic_radius(binary_img, node):
-    mask = (binary_img > 0).astype(np.uint8)
-    dist = distance_transform_edt(mask)
-    y, x = node
-    return dist[y, x]
+def peak_distance(analysis, min_distance=NODE_MIN_DISTANCE):
+    # A reported min_distance on the analysed grid; corner_peaks needs a whole number of at least 1
+    return max(1, int(round(analysis.grid_lengths(min_distance))))
 
 def generate_unique_color(existing_colors):
     while True:
@@ -49,75 +100,97 @@ def generate_unique_color(existing_colors):
         if color not in existing_colors and color not in [(0, 0, 255), (0, 255, 0), (255, 0, 0), (0, 255, 255)]:  # Avoid red, green, blue, yellow
             return color
 
-def all_circle(img_path, out_img_path, out_csv_path, shape_csv):
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
+def all_circle(img_path, out_img_path=None, out_csv_path=None, shape_csv=None, refine=False,
+               min_distance=NODE_MIN_DISTANCE):
+    try:
+        analysis = SliceAnalysis.load(img_path)
+    except ValueError:
         print(f"Failed to load {img_path}")
         return
+    min_distance = peak_distance(analysis, min_distance)
+
+    labeled, num_shapes = analysis.labels
+    dist = analysis.dist
+
+    shapes = make_records(SHAPE_DTYPE, num_shapes)
+    node_records = []
+
+    base_path = os.path.splitext(shape_csv)[0] if shape_csv else None
+
+    # Crops keep a margin wider than the corner_peaks border exclusion,
+    # so detection matches running it on the full frame
+    for shape_id, sl, shape_mask in analysis.components(pad=min_distance + 1):
+        r0, c0 = crop_offset(sl)
+        mask = shape_mask.astype(np.uint8) * 255
+        skel = analysis.shape_skeletons[sl] * shape_mask
+
+        # Peaks in y, x order
+        nodes = detect_nodes(skel, min_distance)
+        nodes = nodes[np.lexsort((nodes[:, 1], nodes[:, 0]))]
+        rec = make_records(NODE_DTYPE, len(nodes), shape_id=shape_id, r=nodes[:, 0] + r0, c=nodes[:, 1] + c0)
+        if refine:
+            rec['radius'] = analysis.fine_radii(shape_id, sl, nodes)
+        else:
+            rec['radius'] = analysis.report_lengths(node_radii(mask, nodes, dist=dist[sl]))
+        node_records.append(rec)
+
+        k = shape_id - 1
+        shapes['shape_id'][k] = shape_id
+        shapes['num_nodes'][k] = len(nodes)
+        shapes['skeleton_length'][k] = np.count_nonzero(skel)
+
+    # Global node ids from 0, then the tables built once from the record columns
+    nodes = np.concatenate(node_records) if node_records else make_records(NODE_DTYPE)
+    nodes['id'] = np.arange(len(nodes))
+    nodes_out = analysis.report_coords(coords(nodes))
+    nodes_df = pd.DataFrame({'node_id': nodes['id'], 'shape_id': nodes['shape_id'],
+                             'x': nodes_out[:, 1], 'y': nodes_out[:, 0], 'radius': nodes['radius']})
+    shapes = shapes[shapes['shape_id'] > 0]
+    shapes_df = pd.DataFrame({'shape_id': shapes['shape_id'], 'num_nodes': shapes['num_nodes'],
+                              'skeleton_length': analysis.report_lengths(shapes['skeleton_length'])})
+
+    # Save per-shape node data
+    if base_path:
+        starts = np.searchsorted(nodes['shape_id'], shapes['shape_id'])
+        ends = np.searchsorted(nodes['shape_id'], shapes['shape_id'], side='right')
+        for shape_id, lo, hi in zip(shapes['shape_id'], starts, ends):
+            nodes_df.iloc[lo:hi].to_csv(f"{base_path}_shape_{shape_id}_nodes.csv", index=False)
 
-    _, binary = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY)
-    labeled, num_shapes = label(binary)
+    # Save overall outputs
+    if out_img_path:
+        render_all_circle(analysis, nodes_df, out_img_path)
+    if out_csv_path:
+        with stage("io"):
+            nodes_df.to_csv(out_csv_path.replace('.csv', '_nodes.csv'), index=False)
+            shapes_df.to_csv(out_csv_path.replace('.csv', '_shapes.csv'), index=False)
+    return nodes_df, shapes_df
+
+
+@timed("render")
+def render_all_circle(analysis, nodes, out_img_path):
+    """
+    Draws an all_circle node table: radius circles in one colour per shape,
+    node markers, and the geodesic paths between each shape's nodes.
+    """
+    final_img = cv2.cvtColor(analysis.bw * 255, cv2.COLOR_GRAY2BGR)
+    centers, radii, shape_ids = np.empty((0, 2), int), np.empty(0, int), np.empty(0, int)
+    if len(nodes):
+        centers = np.rint(analysis.grid_coords(nodes[['y', 'x']].to_numpy())).astype(int)
+        radii = (nodes['radius'].to_numpy() / analysis.unit).astype(int)
+        shape_ids = nodes['shape_id'].to_numpy()
 
-    final_img = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
-    shape_data = []
-    node_data = []
     existing_colors = set()
-    node_id_counter = 0
-
-    base_path = os.path.splitext(shape_csv)[0]
-
-    for shape_id in range(1, num_shapes + 1):
-        mask = (labeled == shape_id).astype(np.uint8) * 255
-        skel = skeletonize(mask // 255)
-
-        nodes = detect_nodes(skel)
+    for shape_id, sl, shape_mask in analysis.components(pad=peak_distance(analysis) + 1):
         color = generate_unique_color(existing_colors)
         existing_colors.add(color)
+        in_shape = shape_ids == shape_id
+        draw_circles(final_img, centers[in_shape], radii[in_shape], color, 1)
+        draw_circles(final_img, centers[in_shape], 2, (0, 255, 0))
 
-        shape_length = np.count_nonzero(skel)
-
-        sorted_nodes = sorted(nodes, key=lambda p: (p[0], p[1]))  # y, x order
-
-        per_shape_nodes = []
-
-        for idx, (y, x) in enumerate(sorted_nodes):
-            radius = geodesic_radius(mask, (y, x))
-            node_info = {
-                'node_id': node_id_counter,
-                'shape_id': shape_id,
-                'x': x,
-                'y': y,
-                'radius': radius
-            }
-            node_data.append(node_info)
-            per_shape_nodes.append(node_info)
-
-            # Draw radius circle
-            cv2.circle(final_img, (x, y), int(radius), color, 1)
-            cv2.circle(final_img, (x, y), 2, (0, 255, 0), -1)
-            node_id_counter += 1
-
-        # Save per-shape node data
-        per_shape_df = pd.DataFrame(per_shape_nodes)
-        shape_csv_path = f"{base_path}_shape_{shape_id}_nodes.csv"
-        per_shape_df.to_csv(shape_csv_path, index=False)
-
-        connect_nodes_with_geodesic_lines(final_img, skel, sorted_nodes, color=(255, 0, 0))
-
-        ys, xs = np.nonzero(mask)
-        if len(xs) > 0 and len(ys) > 0:
-            cx = int(np.mean(xs))
-            cy = int(np.mean(ys))
-            cv2.putText(final_img, f'S{shape_id}', (cx - 10, cy), cv2.FONT_HERSHEY_SIMPLEX,
-                        0.5, (255, 0, 255), 2, cv2.LINE_AA)
-
-        shape_data.append({
-            'shape_id': shape_id,
-            'num_nodes': len(nodes),
-            'skeleton_length': shape_length
-        })
+        # Paths are traced in the crop and drawn through a view of the canvas
+        skel = analysis.shape_skeletons[sl] * shape_mask
+        connect_nodes_with_geodesic_lines(final_img[sl], skel, centers[in_shape] - crop_offset(sl),
+                                          color=(255, 0, 0))
 
-    # Save overall outputs
+    draw_shape_labels(final_img, analysis.centroids, cv2.LINE_AA)
     cv2.imwrite(out_img_path, final_img)
-    pd.DataFrame(node_data).to_csv(out_csv_path.replace('.csv', '_nodes.csv'), index=False)
-    pd.DataFrame(shape_data).to_csv(out_csv_path.replace('.csv', '_shapes.csv'), index=False)
@@ -1,144 +1,137 @@
-import os
 import cv2
 import numpy as np
 import pandas as pd
-from skimage.morphology import skeletonize
-from scipy.ndimage import distance_transform_edt, label
-from .graph_analysis import *
-
-
-def load_binary(img_path):
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise ValueError(f"Failed to load image from {img_path}")
-    _, bw = cv2.threshold(img, 127, 1, cv2.THRESH_BINARY)
-    return bw.astype(np.uint8), img
-
-
-def angle_between(p1, p2):
-    dy = p2[0] - p1[0]
-    dx = p2[1] - p1[1]
-    return np.degrees(np.arctan2(dy, dx)) % 180
-
-
-def midpoint(p1, p2):
-    return ((p1[0] + p2[0]) // 2, (p1[1] + p2[1]) // 2)
-
-
-def euclidean_dist(p1, p2):
-    return np.linalg.norm(np.array(p1) - np.array(p2))
-
-
-def fit_chain_ellipses(region_nodes, region_ends, out_img, ellipse_data, id_start, shape_id, shape_name):
-    count = id_start
-    visited = set()
-    all_points = region_nodes + region_ends
-
-    for p1 in all_points:
-        if p1 in visited:
-            continue
-        candidates = [p2 for p2 in all_points if p2 != p1 and (p1, p2) not in visited and (p2, p1) not in visited]
-        if not candidates:
-            continue
-
-        p2 = min(candidates, key=lambda x: euclidean_dist(p1, x))
-
-        mid = midpoint(p1, p2)
-        major = euclidean_dist(p1, p2) / 2
-        minor = max(3, major * 0.5)
-        angle = angle_between(p1, p2)
-
-        ellipse_data.append({
-            'shape_name': shape_name,
-            'shape_id': shape_id,
-            'pair_id': count,
-            'x': mid[1],
-            'y': mid[0],
-            'semi_major': major,
-            'semi_minor': minor,
-            'angle': angle
-        })
-
-        cv2.ellipse(out_img, (mid[1], mid[0]), (int(major), int(minor)),
-                    angle, 0, 360, (0, 255, 0), 2)
-
-        visited.add(p1)
-        visited.add(p2)
-        count += 1
-
-    return count
-
-
-def eclipse_image(img_path, out_img_path, out_csv_path):
+from scipy.ndimage import distance_transform_edt
+from .analysis import SliceAnalysis
+from .components import group_by_label
+from .visualization import draw_circles, draw_skeleton, draw_shape_labels
+from .timing import stage, timed
+
+
+ELLIPSE_COLUMNS = ['shape_name', 'shape_id', 'branch_id', 'x', 'y', 'semi_major', 'semi_minor', 'angle', 'area']
+
+
+def fit_branch_ellipses(analysis):
+    """
+    Fits one ellipse per skeleton branch segment: every foreground pixel is
+    assigned to the nearest branch of its own shape, and each branch gets the
+    ellipse with the same centroid and second moments as its pixels, so the
+    semi-minor axis follows the trabecula's thickness. All branches are
+    fitted at once from per-label sums, in O(pixels).
+
+    Returns a DataFrame of ELLIPSE_COLUMNS on the report grid; the angle is
+    the major axis' direction in degrees, as cv2.ellipse draws it.
+    """
+    segments, num_branches = analysis.branches
+    labeled = analysis.labeled
+    if num_branches == 0:
+        return pd.DataFrame(columns=ELLIPSE_COLUMNS)
+
+    # Nearest branch pixel of every pixel; pixels closer to another shape's branch are dropped
+    iy, ix = distance_transform_edt(segments == 0, return_distances=False, return_indices=True)
+    ys, xs = np.nonzero(labeled)
+    ny, nx = iy[ys, xs], ix[ys, xs]
+    own = labeled[ny, nx] == labeled[ys, xs]
+    branch = segments[ny[own], nx[own]]
+    ys, xs = ys[own].astype(float), xs[own].astype(float)
+
+    # Moments about the first pixel of each branch, so they come out the same wherever the frame starts
+    _, first = np.unique(branch, return_index=True)
+    oy, ox = np.zeros(num_branches + 1), np.zeros(num_branches + 1)
+    oy[branch[first]], ox[branch[first]] = ys[first], xs[first]
+    ys, xs = ys - oy[branch], xs - ox[branch]
+
+    def total(weights=None):
+        return np.bincount(branch, weights, minlength=num_branches + 1)[1:]
+
+    area = total()
+    n = np.maximum(area, 1)
+    my, mx = total(ys) / n, total(xs) / n
+    vyy = total(ys * ys) / n - my ** 2
+    vxx = total(xs * xs) / n - mx ** 2
+    vxy = total(ys * xs) / n - my * mx
+    my, mx = my + oy[1:], mx + ox[1:]
+
+    # Eigenvalues of each 2x2 covariance; a uniform ellipse has variance (semi-axis / 2)^2
+    half_trace = (vxx + vyy) / 2
+    spread = np.sqrt(((vxx - vyy) / 2) ** 2 + vxy ** 2)
+    semi_major = 2 * np.sqrt(np.maximum(half_trace + spread, 0))
+    semi_minor = 2 * np.sqrt(np.maximum(half_trace - spread, 0))
+    angle = np.degrees(0.5 * np.arctan2(2 * vxy, vxx - vyy)) % 180
+
+    shape_of = np.zeros(num_branches + 1, int)
+    on_branch = segments > 0
+    shape_of[segments[on_branch]] = labeled[on_branch]
+
+    centres = analysis.report_coords(np.stack([my, mx], axis=1))
+    df = pd.DataFrame({
+        'shape_name': analysis.name,
+        'shape_id': shape_of[1:],
+        'branch_id': np.arange(1, num_branches + 1),
+        'x': centres[:, 1],
+        'y': centres[:, 0],
+        'semi_major': analysis.report_lengths(semi_major),
+        'semi_minor': analysis.report_lengths(semi_minor),
+        'angle': angle,
+        'area': analysis.report_lengths(area, power=2),
+    })
+    return df.sort_values(['shape_id', 'branch_id'], kind='stable').reset_index(drop=True)
+
+
+def eclipse_image(img_path, out_img_path=None, out_csv_path=None):
     # Prepare input
-    bw, img_gray = load_binary(img_path)
-    shape_name = os.path.splitext(os.path.basename(img_path))[0]
-    labeled, num_shapes = label(bw)
-    out_img = cv2.cvtColor(img_gray, cv2.COLOR_GRAY2BGR)
+    analysis = SliceAnalysis.load(img_path)
+    shape_name = analysis.name
+    labeled, num_shapes = analysis.labels
 
-    # Detect full skeleton, nodes, and endpoints
-    skel = skeletonize(bw).astype(np.uint8)
-    nodes = find_nodes(skel)
-    endpoints = find_endpoints(skel)
+    # Full skeleton, nodes, and endpoints (shared with Core_code)
+    nodes = analysis.nodes
+    endpoints = analysis.endpoints
 
     print(f"  Found {len(nodes)} nodes and {len(endpoints)} endpoints in {shape_name}")
     print(f"  Detected {num_shapes} shapes in image.")
 
-    # Visual markers
-    ys, xs = np.where(skel)
-    out_img[ys, xs] = (0, 0, 255)
-
-    for r, c in nodes:
-        cv2.circle(out_img, (c, r), 3, (0, 255, 0), -1)
-    for r, c in endpoints:
-        cv2.circle(out_img, (c, r), 3, (255, 0, 0), -1)
-
-    # Begin fitting ellipses
-    ellipse_data = []
-    global_pair_id = 1
-    total_possible_pairs = 0
+    with stage("ellipse_fit"):
+        df = fit_branch_ellipses(analysis)
 
+    # Assign nodes and endpoints to shapes with one label lookup each
+    nodes_by_shape = group_by_label(nodes, labeled, num_shapes)
+    ends_by_shape = group_by_label(endpoints, labeled, num_shapes)
+    branches_by_shape = np.bincount(df['shape_id'].to_numpy(int), minlength=num_shapes + 1)
     for shape_id in range(1, num_shapes + 1):
-        mask = labeled == shape_id
-        region_nodes = [p for p in nodes if mask[p]]
-        region_ends = [p for p in endpoints if mask[p]]
-
-        print(f"    ▶ Shape {shape_id}: {len(region_nodes)} nodes, {len(region_ends)} endpoints")
-
-        global_pair_id = fit_chain_ellipses(
-            region_nodes, region_ends, out_img, ellipse_data,
-            global_pair_id, shape_id, shape_name
-        )
-
-        # Count expected pairs
-        unique_pairs = set()
-        for i in range(len(region_nodes)):
-            for j in range(i + 1, len(region_nodes)):
-                unique_pairs.add(tuple(sorted((region_nodes[i], region_nodes[j]))))
-        for ept in region_ends:
-            if region_nodes:
-                closest = min(region_nodes, key=lambda n: euclidean_dist(ept, n))
-                unique_pairs.add(tuple(sorted((ept, closest))))
-        total_possible_pairs += len(unique_pairs)
-
-        # Annotate shape ID
-        ys_s, xs_s = np.where(mask)
-        if len(xs_s) > 0 and len(ys_s) > 0:
-            cx, cy = int(np.mean(xs_s)), int(np.mean(ys_s))
-            cv2.putText(out_img, f'S{shape_id}', (cx - 10, cy),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 255), 2)
-
-    total_drawn_ellipses = len(ellipse_data)
-    error_percentage = 100 * (total_possible_pairs - total_drawn_ellipses) / total_possible_pairs if total_possible_pairs > 0 else 0
-
-    print(f"✅ Total possible ellipse connections : {total_possible_pairs}")
-    print(f"✅ Total ellipses drawn               : {total_drawn_ellipses}")
-    print(f"⚠️  Error percentage                   : {error_percentage:.2f}%")
+        print(f"    ▶ Shape {shape_id}: {len(nodes_by_shape[shape_id - 1])} nodes, "
+              f"{len(ends_by_shape[shape_id - 1])} endpoints, {branches_by_shape[shape_id]} branches")
 
-    # Save outputs
-    df = pd.DataFrame(ellipse_data)
-    df.to_csv(out_csv_path, index=False)
-    print(f"📄 Ellipse data saved to {out_csv_path}")
+    print(f"✅ Total ellipses fitted               : {len(df)}")
+    if len(df):
+        print(f"✅ Median semi-minor axis              : {df['semi_minor'].median():.2f}")
 
+    # Save outputs
+    if out_csv_path:
+        with stage("io"):
+            df.to_csv(out_csv_path, index=False)
+        print(f"📄 Ellipse data saved to {out_csv_path}")
+
+    if out_img_path:
+        render_ellipses(analysis, df, out_img_path)
+        print(f"🖼️  Output image saved to {out_img_path}")
+    return df
+
+
+@timed("render")
+def render_ellipses(analysis, ellipses, out_img_path):
+    """Draws an eclipse_image table over the slice with its skeleton, nodes and endpoints."""
+    out_img = cv2.cvtColor(analysis.gray, cv2.COLOR_GRAY2BGR)
+    draw_skeleton(out_img, analysis.skeleton)
+    draw_circles(out_img, analysis.nodes, 3, (0, 255, 0))
+    draw_circles(out_img, analysis.endpoints, 3, (255, 0, 0))
+
+    if len(ellipses):
+        mids = np.rint(analysis.grid_coords(ellipses[['y', 'x']].to_numpy())).astype(int)
+        axes = (ellipses[['semi_major', 'semi_minor']].to_numpy() / analysis.unit).astype(int)
+        for (r, c), (major, minor), angle in zip(mids, axes, ellipses['angle']):
+            cv2.ellipse(out_img, (int(c), int(r)), (int(major), int(minor)),
+                        angle, 0, 360, (0, 255, 0), 2)
+
+    draw_shape_labels(out_img, analysis.centroids)
     cv2.imwrite(out_img_path, out_img)
-    print(f"🖼️  Output image saved to {out_img_path}")
@@ -1,57 +1,393 @@
 import numpy as np
-from scipy.ndimage import convolve, label, center_of_mass
-from skimage.morphology import skeletonize
-from collections import deque
-from typing import List, Tuple, Dict
+from scipy.ndimage import convolve, label, grey_dilation, grey_erosion, find_objects
+from itertools import combinations, product
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+from typing import List, Tuple, Dict, Optional, NamedTuple
+from .components import label_centroids
+from .records import make_records, EDGE_DTYPE
 
 def skeletonise_image(bw: np.ndarray) -> np.ndarray:
+    # skimage.morphology takes a large share of start-up, so it loads with the first skeleton
+    from skimage.morphology import skeletonize
     return skeletonize(bw).astype(np.uint8)
 
 def neighbour_count(skel: np.ndarray) -> np.ndarray:
-    kernel = np.ones((3, 3), np.uint8)
+    # 8 neighbours in 2D, 26 in 3D
+    kernel = np.ones((3,) * skel.ndim, np.uint8)
     return convolve(skel, kernel, mode="constant", cval=0) - skel
 
-def find_endpoints(skel: np.ndarray) -> List[Tuple[int, int]]:
-    deg = neighbour_count(skel)
-    return [tuple(p) for p in np.argwhere((skel == 1) & (deg == 1))]
+# Classes of skeleton pixels; 0 is background or an isolated pixel
+ENDPOINT, BRANCH, JUNCTION, CROSSING = 1, 2, 3, 4
 
-def find_nodes(skel: np.ndarray) -> List[Tuple[int, int]]:
-    deg = neighbour_count(skel)
-    node_mask = (skel == 1) & (deg >= 3)
-    lbl, n_comp = label(node_mask)
-    centroids = center_of_mass(node_mask, lbl, range(1, n_comp + 1))
-    return [(int(round(r)), int(round(c))) for r, c in centroids]
+# Bit of each 8-neighbour in a 2D neighbourhood code, clockwise from north
+_RING = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+def _neighbourhood_lut() -> np.ndarray:
+    # Class for each of the 256 codes, from the neighbour count and the crossing
+    # number (0 -> 1 transitions around the ring). Staircase corners have three
+    # neighbours but only two crossings, so they stay branch pixels.
+    lut = np.zeros(256, np.uint8)
+    for code in range(256):
+        ring = [(code >> bit) & 1 for bit in range(8)]
+        count = sum(ring)
+        crossings = sum(ring[i - 1] == 0 and ring[i] == 1 for i in range(8))
+        if crossings >= 4:
+            lut[code] = CROSSING
+        elif crossings == 3:
+            lut[code] = JUNCTION
+        elif crossings == 1 and count <= 2:
+            lut[code] = ENDPOINT
+        elif count:
+            lut[code] = BRANCH
+    return lut
+
+_NEIGHBOURHOOD_LUT = _neighbourhood_lut()
+
+def classify_skeleton(skel: np.ndarray) -> np.ndarray:
+    """
+    Endpoint/branch/junction/crossing class of every skeleton pixel. In 2D
+    each skeleton pixel gets one 8-bit code of its neighbours, mapped through
+    a 256-entry table; 3D skeletons fall back to the 26-neighbour count.
+    """
+    skel = skel > 0
+    kind = np.zeros(skel.shape, np.uint8)
+    if skel.ndim != 2:
+        deg = neighbour_count(skel.astype(np.uint8))[skel]
+        kind[skel] = np.select([deg == 1, deg == 2, deg >= 3], [ENDPOINT, BRANCH, JUNCTION], 0)
+        return kind
+    padded = np.pad(skel, 1)
+    width = padded.shape[1]
+    pix = np.flatnonzero(padded)
+    code = np.zeros(len(pix), np.uint8)
+    for bit, (dy, dx) in enumerate(_RING):
+        code |= padded.flat[pix + dy * width + dx].astype(np.uint8) << bit
+    kind[pix // width - 1, pix % width - 1] = _NEIGHBOURHOOD_LUT[code]
+    return kind
+
+def find_endpoints(skel: np.ndarray, kind: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+    if kind is None:
+        kind = classify_skeleton(skel)
+    return [tuple(p) for p in np.argwhere(kind == ENDPOINT)]
+
+def junction_clusters(skel: np.ndarray, kind: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+    if kind is None:
+        kind = classify_skeleton(skel)
+    return label(kind >= JUNCTION)
+
+def _cluster_ring(jlbl: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Highest and lowest junction cluster next to every pixel, 0 where there is none
+    size = (3,) * jlbl.ndim
+    top = int(jlbl.max()) + 1
+    hi = grey_dilation(jlbl, size=size, mode="constant", cval=0)
+    lo = grey_erosion(np.where(jlbl > 0, jlbl, top), size=size, mode="constant", cval=top)
+    lo[lo == top] = 0
+    return hi, lo
+
+def branch_segments(skel: np.ndarray, jlbl: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    The skeleton minus its junction clusters, labelled into branch segments,
+    numbered in raster order like label. Arms that leave one cluster side by
+    side touch each other next to it, so a step between two pixels that are
+    both next to the same cluster does not join them: every arm is its own
+    segment. A corner pixel whose every step is of that kind joins the arm
+    with the lowest label beside it.
+    """
+    mask = np.pad((skel > 0) & (jlbl == 0), 1)
+    hi, lo = (np.pad(a, 1) for a in _cluster_ring(jlbl))
+    strides = np.array(mask.strides) // mask.itemsize
+    pix = np.flatnonzero(mask)
+    index = np.full(mask.size, -1, np.intp)
+    index[pix] = np.arange(len(pix))
+    rows, cols, cut = [], [], []
+    for offset in _forward_offsets(skel.ndim):
+        other = pix + int(np.dot(offset, strides))
+        hit = mask.flat[other]
+        p, q = pix[hit], other[hit]
+        hp, lp, hq, lq = hi.flat[p], lo.flat[p], hi.flat[q], lo.flat[q]
+        rows.append(index[p])
+        cols.append(index[q])
+        cut.append((hp > 0) & (hq > 0) & ((hp == hq) | (hp == lq) | (lp == hq) | (lp == lq)))
+    rows, cols, cut = np.concatenate(rows), np.concatenate(cols), np.concatenate(cut)
+    n = len(pix)
+    links = csr_matrix((np.ones((~cut).sum(), np.uint8), (rows[~cut], cols[~cut])), shape=(n, n))
+    _, comp = connected_components(links, directed=False)
+
+    # Corner pixels: two or more neighbours, all of them cut off
+    steps = np.bincount(rows, minlength=n) + np.bincount(cols, minlength=n)
+    kept = np.bincount(rows[~cut], minlength=n) + np.bincount(cols[~cut], minlength=n)
+    corner = (steps >= 2) & (kept == 0)
+    joined = comp.copy()
+    lowest = np.full(n, np.iinfo(np.intp).max)
+    for a, b in ((rows[cut], cols[cut]), (cols[cut], rows[cut])):
+        join = corner[a] & ~corner[b]
+        np.minimum.at(lowest, a[join], comp[b[join]])
+    moved = corner & (lowest < np.iinfo(np.intp).max)
+    joined[moved] = lowest[moved]
+
+    # Renumber from 1 in raster order of each segment's first pixel
+    used, first, inverse = np.unique(joined, return_index=True, return_inverse=True)
+    rank = np.empty(len(used), np.int32)
+    rank[np.argsort(first)] = np.arange(1, len(used) + 1)
+    labels = np.zeros(mask.shape, np.int32)
+    labels.flat[pix] = rank[inverse]
+    return labels[(slice(1, -1),) * skel.ndim], len(used)
+
+def cluster_centroids(lbl: np.ndarray, n_comp: int) -> List[Tuple[int, int]]:
+    centroids = label_centroids(lbl, n_comp)
+    return [tuple(int(round(v)) for v in p) for p in centroids]
+
+def find_nodes(skel: np.ndarray, kind: Optional[np.ndarray] = None) -> List[Tuple[int, int]]:
+    return cluster_centroids(*junction_clusters(skel, kind))
 
 def euclidean_distance(p: Tuple[int, int], q: Tuple[int, int]) -> float:
     return float(np.hypot(p[0] - q[0], p[1] - q[1]))
 
+def neighbour_offsets(ndim: int) -> List[Tuple[int, ...]]:
+    return [o for o in product((-1, 0, 1), repeat=ndim) if any(o)]
+
+def _forward_offsets(ndim: int) -> List[Tuple[int, ...]]:
+    # One of each +/- pair: the first non-zero component is positive
+    return [o for o in neighbour_offsets(ndim) if next(v for v in o if v) > 0]
+
+def _sub_steps(offset: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+    # Shorter steps inside a diagonal step, e.g. (1, 0) and (0, 1) for (1, 1)
+    axes = [k for k, v in enumerate(offset) if v]
+    subs = []
+    for n in range(1, len(axes)):
+        for chosen in combinations(axes, n):
+            subs.append(tuple(v if k in chosen else 0 for k, v in enumerate(offset)))
+    return subs
+
+class SkeletonGraph(NamedTuple):
+    """
+    Branch graph of a skeleton. Vertices 0..len(nodes)-1 are the junction
+    clusters (in find_nodes order), the rest are the endpoints (in
+    find_endpoints order). `edges` is an (M, 2) array of vertex ids and
+    `lengths` the along-skeleton length of each branch.
+    """
+    nodes: List[Tuple[int, int]]
+    endpoints: List[Tuple[int, int]]
+    edges: np.ndarray
+    lengths: np.ndarray
+
+    @property
+    def num_vertices(self) -> int:
+        return len(self.nodes) + len(self.endpoints)
+
+    def shortest_edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        # One (u < v) edge per vertex pair, keeping the shortest branch; no self-loops
+        u, v = np.sort(self.edges, axis=1).T if len(self.edges) else (np.empty(0, int), np.empty(0, int))
+        keep = u != v
+        u, v, w = u[keep], v[keep], self.lengths[keep]
+        key = u * self.num_vertices + v
+        order = np.lexsort((w, key))
+        first = np.ones(len(order), bool)
+        first[1:] = key[order][1:] != key[order][:-1]
+        order = order[first]
+        return np.stack([u[order], v[order]], axis=1), w[order]
+
+    def edge_records(self, max_distance: Optional[float] = None) -> np.ndarray:
+        """
+        EDGE_DTYPE records of the node-to-node branches at most `max_distance`
+        long, node ids from 1, with the straight distance between the nodes
+        and the branch length. Ordered as compute_distances_from_connections
+        lists connections(): by first node, then nearest branch first.
+        """
+        pairs, w = self.shortest_edges()
+        keep = pairs[:, 1] < len(self.nodes)
+        if max_distance is not None:
+            keep &= w <= max_distance
+        u, v, w = pairs[keep, 0], pairs[keep, 1], w[keep]
+        order = np.lexsort((v, w, u))
+        u, v, w = u[order], v[order], w[order]
+        pos = np.asarray(self.nodes, dtype=float).reshape(-1, 2)
+        return make_records(EDGE_DTYPE, len(u), node1=u + 1, node2=v + 1,
+                            distance=np.hypot(*(pos[u] - pos[v]).T), length=w)
+
+    def connections(self, max_distance: Optional[float] = None) -> Dict[int, List[int]]:
+        connections = {i: [] for i in range(len(self.nodes))}
+        pairs, w = self.shortest_edges()
+        n = len(self.nodes)
+        keep = pairs[:, 1] < n
+        if max_distance is not None:
+            keep &= w <= max_distance
+        # Nearest branches first, like the order a search along the skeleton finds them
+        for k in np.argsort(w[keep], kind="stable"):
+            i, j = pairs[keep][k]
+            connections[int(i)].append(int(j))
+            connections[int(j)].append(int(i))
+        return connections
+
+def segment_lengths(blbl: np.ndarray, count: int) -> np.ndarray:
+    """
+    Internal length of each branch segment, indexed by label (0 unused): unit
+    steps plus diagonal steps that do not cut the corner of a path through
+    shorter steps.
+    """
+    padded = np.pad(blbl, 1)
+    strides = np.array(padded.strides) // padded.itemsize
+    flat = lambda offset: int(np.dot(offset, strides))
+    internal = np.zeros(count + 1)
+    pix = np.flatnonzero(padded)
+    own = padded.flat[pix]
+    for offset in _forward_offsets(blbl.ndim):
+        same = padded.flat[pix + flat(offset)] == own
+        for sub in _sub_steps(offset):
+            same &= padded.flat[pix + flat(sub)] != own
+        internal += np.linalg.norm(offset) * np.bincount(own[same], minlength=count + 1)
+    return internal
+
+def segment_contacts(blbl: np.ndarray, jlbl: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    (segment, cluster, step) of every segment/junction cluster pair that
+    touch, once per pair with the shortest step between them, ordered by
+    segment then cluster.
+    """
+    padded = np.pad(blbl, 1)
+    pj = np.pad(jlbl, 1)
+    strides = np.array(padded.strides) // padded.itemsize
+    pix = np.flatnonzero(padded)
+    own = padded.flat[pix]
+    seg, jun, step = [], [], []
+    for offset in neighbour_offsets(blbl.ndim):
+        nj = pj.flat[pix + int(np.dot(offset, strides))]
+        hit = nj > 0
+        seg.append(own[hit])
+        jun.append(nj[hit])
+        step.append(np.full(hit.sum(), np.linalg.norm(offset)))
+    seg, jun, step = (np.concatenate(a) for a in (seg, jun, step))
+    key = seg.astype(np.int64) * (int(jlbl.max()) + 1) + jun
+    order = np.lexsort((step, key))
+    first = np.ones(len(order), bool)
+    first[1:] = key[order][1:] != key[order][:-1]
+    order = order[first]
+    return seg[order], jun[order], step[order]
+
+def _path_edges(blbl: np.ndarray, jlbl: np.ndarray, box: Tuple[slice, ...], seg: int, vertex: np.ndarray,
+                extra: np.ndarray, n_junc: int, endpoints: List[Tuple[int, ...]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Edges of one segment with more than two attachments. A segment holds no
+    junction pixel, so it is a path: its attachments are ordered along it
+    and each is joined to the next, with the length between them.
+    """
+    box = tuple(slice(max(b.start - 1, 0), b.stop + 1) for b in box)
+    own = np.pad(blbl[box] == seg, 1)
+    clusters = np.pad(jlbl[box], 1)
+    strides = np.array(own.strides) // own.itemsize
+    flat = lambda offset: int(np.dot(offset, strides))
+    pix = np.flatnonzero(own)
+    index = np.full(own.size, -1, np.intp)
+    index[pix] = np.arange(len(pix))
+
+    # Steps along the path, as segment_lengths counts them
+    rows, cols, weights = [], [], []
+    for offset in _forward_offsets(blbl.ndim):
+        same = own.flat[pix + flat(offset)]
+        for sub in _sub_steps(offset):
+            same &= ~own.flat[pix + flat(sub)]
+        rows.append(index[pix[same]])
+        cols.append(index[pix[same] + flat(offset)])
+        weights.append(np.full(same.sum(), np.linalg.norm(offset)))
+    steps = csr_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(cols))),
+                       shape=(len(pix), len(pix)))
+
+    # The path pixel each attachment sits at: the endpoint itself, or the
+    # pixel nearest the junction cluster
+    corner = np.array([b.start for b in box]) - 1
+    at = np.empty(len(vertex), np.intp)
+    for k, (v, step) in enumerate(zip(vertex, extra)):
+        if v >= n_junc:
+            at[k] = index[np.ravel_multi_index(np.subtract(endpoints[v - n_junc], corner), own.shape)]
+            continue
+        for offset in neighbour_offsets(blbl.ndim):
+            if np.isclose(np.linalg.norm(offset), step):
+                hit = pix[clusters.flat[pix + flat(offset)] == v + 1]
+                if len(hit):
+                    at[k] = index[hit[0]]
+                    break
+
+    # Positions along the path, measured from its end farthest from the first attachment
+    far = at[np.argmax(dijkstra(steps, directed=False, indices=at[0])[at])]
+    pos = dijkstra(steps, directed=False, indices=far)[at]
+    order = np.argsort(pos, kind="stable")
+    a, b = order[:-1], order[1:]
+    return (np.stack([vertex[a], vertex[b]], axis=1),
+            pos[b] - pos[a] + extra[a] + extra[b])
+
+def skeleton_graph(skel: np.ndarray, kind: Optional[np.ndarray] = None,
+                   junctions: Optional[Tuple[np.ndarray, int]] = None) -> SkeletonGraph:
+    """
+    Builds the branch graph of a skeleton in one labelling pass: the skeleton
+    minus its junction pixels splits into branch segments, and every segment
+    is joined to the junction clusters it touches and the endpoints it holds.
+    `junctions` are (labels, count) of the clusters when they do not come
+    straight from junction_clusters, e.g. after merging. Works on 2D and 3D
+    skeletons.
+    """
+    skel = (skel > 0).astype(np.uint8)
+    if kind is None:
+        kind = classify_skeleton(skel)
+    jlbl, n_junc = junction_clusters(skel, kind) if junctions is None else junctions
+    nodes = cluster_centroids(jlbl, n_junc)
+    end_mask = kind == ENDPOINT
+    endpoints = [tuple(p) for p in np.argwhere(end_mask)]
+    blbl, n_branch = branch_segments(skel, jlbl)
+    internal = segment_lengths(blbl, n_branch)
+    seg_c, jun_c, step_c = segment_contacts(blbl, jlbl)
+
+    # Junction clusters that touch each other diagonally
+    jj_a, jj_b, jj_step = [], [], []
+    pj = np.pad(jlbl, 1)
+    strides = np.array(pj.strides) // pj.itemsize
+    jpix = np.flatnonzero(pj)
+    jown = pj.flat[jpix]
+    for offset in neighbour_offsets(skel.ndim):
+        nj = pj.flat[jpix + int(np.dot(offset, strides))]
+        hit = nj > jown
+        jj_a.append(jown[hit])
+        jj_b.append(nj[hit])
+        jj_step.append(np.full(hit.sum(), np.linalg.norm(offset)))
+
+    # Attachments of every segment: touched junctions and contained endpoints
+    end_seg = blbl[end_mask]
+    att_seg = np.concatenate([seg_c, end_seg])
+    att_vertex = np.concatenate([jun_c - 1, n_junc + np.arange(len(endpoints))])
+    att_extra = np.concatenate([step_c, np.zeros(len(endpoints))])
+    order = np.argsort(att_seg, kind="stable")
+    att_seg, att_vertex, att_extra = att_seg[order], att_vertex[order], att_extra[order]
+    segs, starts, counts = np.unique(att_seg, return_index=True, return_counts=True)
+
+    pair = counts == 2
+    a, b = starts[pair], starts[pair] + 1
+    edges = [np.stack([att_vertex[a], att_vertex[b]], axis=1)]
+    lengths = [internal[segs[pair]] + att_extra[a] + att_extra[b]]
+    # A segment that passes more junctions on its way is split between them
+    if (counts > 2).any():
+        boxes = find_objects(blbl)
+        for seg, start, count in zip(segs[counts > 2], starts[counts > 2], counts[counts > 2]):
+            at = slice(start, start + count)
+            e, w = _path_edges(blbl, jlbl, boxes[seg - 1], seg, att_vertex[at], att_extra[at],
+                               n_junc, endpoints)
+            edges.append(e)
+            lengths.append(w)
+    edges.append(np.stack([np.concatenate(jj_a), np.concatenate(jj_b)], axis=1) - 1)
+    lengths.append(np.concatenate(jj_step))
+
+    return SkeletonGraph(nodes, endpoints,
+                         np.concatenate(edges).astype(np.intp),
+                         np.concatenate(lengths))
+
 def find_connections(skel: np.ndarray, nodes: List[Tuple[int, int]], max_distance: int = 100) -> Dict[int, List[int]]:
-    node_pos_to_index = {pos: idx for idx, pos in enumerate(nodes)}
-    connections = {i: [] for i in range(len(nodes))}
-    h, w = skel.shape
-    for i, (sr, sc) in enumerate(nodes):
-        visited = set()
-        queue = deque([(sr, sc, 0)])
-        while queue:
-            r, c, d = queue.popleft()
-            if d > max_distance:
-                continue
-            if (r, c) in node_pos_to_index and node_pos_to_index[(r, c)] != i:
-                j = node_pos_to_index[(r, c)]
-                if j not in connections[i]:
-                    connections[i].append(j)
-                continue
-            visited.add((r, c))
-            for dr in [-1, 0, 1]:
-                for dc in [-1, 0, 1]:
-                    if dr == 0 and dc == 0:
-                        continue
-                    nr, nc = r + dr, c + dc
-                    if 0 <= nr < h and 0 <= nc < w and skel[nr, nc] and (nr, nc) not in visited:
-                        queue.append((nr, nc, d + 1))
-    return connections
-
-def compute_distances_from_connections(nodes: List[Tuple[int, int]], connections: Dict[int, List[int]]) -> List[Tuple[int, int, int, int, int, int, float]]:
+    # Junction clusters are matched to `nodes` by order, so they must come from find_nodes(skel)
+    graph = skeleton_graph(skel)
+    if len(graph.nodes) != len(nodes):
+        raise ValueError("nodes must come from find_nodes(skel)")
+    return graph.connections(max_distance)
+
+def compute_distances_from_connections(nodes: List[Tuple[int, int]], connections) -> List[Tuple[int, int, int, int, int, int, float]]:
+    if isinstance(connections, SkeletonGraph):
+        connections = connections.connections()
     result = []
     visited = set()
     for i, neighbors in connections.items():
@@ -1,84 +1,351 @@
 import os
+from contextlib import nullcontext
+from functools import partial
 import cv2 as cv
-from .preprocess import resize_image, convert_image
-from utils.graph_analysis import *
+import pandas as pd
+from .preprocess import resize_image, convert_image, ANALYSIS_SCALE
+from .binarize import otsu_threshold
 from .skeleton import Core_code
-from .circle import *
-from .eclipse import *
-from .volume import *
-from .draw_node_circles import *
+from .circle import circle_image
+from .eclipse import eclipse_image
+from .volume import compute_shape_volumes
+from .draw_node_circles import all_circle
+from .analysis import SliceAnalysis
+from .batch import run_batch
+from .results import ResultStore
+from .cache import ArrayCache, array_hash
+from .stack import iter_stack, read_slice, stack_size
+from .volume3d import load_volume, analyse_volume
+from .timing import stage, stage_report, write_report
+from .morphometry import slice_morphometry, stack_morphometry
+from .roi import slice_roi, stack_roi, roi_slices, ROI_MARGIN
 
-def single_file():
-    image_path = input("Enter path to image: ").strip()
+CACHE_BYTES = 2 * 1024 ** 3
+
+OUTPUT_DIRS = [
+    "output/new_resize",
+    "output/new_binary",
+    "output/new_skeletonise/image",
+    "output/new_skeletonise/csv",
+    "output/circles/image",
+    "output/circles/csv",
+    "output/eclipse/image",
+    "output/eclipse/csv",
+    "output/all_circle/image",
+    "output/all_circle/csv",
+    "output/all_circle/shape",
+]
+
+def _slice_analysis(image, binary_image, name, scale, refine, cache=None, cache_key=None,
+                    tile=None, threads=1, origin=(0, 0), prune=None):
+    # The native grey slice is only kept when components get re-upsampled for radii
+    source = cv.cvtColor(image, cv.COLOR_BGR2GRAY) if refine else None
+    return SliceAnalysis(binary_image, name, scale=scale, source=source, cache=cache, cache_key=cache_key,
+                         tile=tile, threads=threads, origin=origin, prune=prune)
+
+def _report_pruning(analysis):
+    # The slice's pruning counts, printed and as a one-row table
+    r = analysis.pruning
+    print(f"🌿 Pruning removed {r['nodes_removed']} of {r['nodes_before']} nodes and "
+          f"{r['endpoints_removed']} of {r['endpoints_before']} endpoints ({r['spurs']} spurs, "
+          f"{r['shape_spurs']} from the per-shape skeletons)")
+    return pd.DataFrame([r])
+
+def frame_threshold(image, mode="fixed"):
+    """
+    The "otsu" cut-off of a whole native slice, None for the other modes.
+    Found before any crop and upscale, so a region is binarised exactly like
+    the same pixels of the full frame.
+    """
+    return otsu_threshold(image) if mode == "otsu" else None
+
+def crop_roi(image, roi=None, mode="fixed", margin=ROI_MARGIN, adaptive=None):
+    """
+    The part of a native slice to upscale and analyse, and its (y0, x0, y1, x1)
+    box. `roi` is None for the whole frame, "slice" for the slice's own
+    foreground box grown by `margin`, or a box, e.g. from stack_roi.
+    """
+    if roi is None:
+        return image, (0, 0) + image.shape[:2]
+    box = slice_roi(image, mode, margin, adaptive) if roi == "slice" else tuple(int(v) for v in roi)
+    return image[roi_slices(box)], box
+
+def _roi_table(box):
+    return pd.DataFrame([dict(zip(("y0", "x0", "y1", "x1"), box))])
+
+def single_file(image_path=None, scale=ANALYSIS_SCALE, refine=False, mode="fixed", profile=None,
+                tile=None, threads=1, morphometry=False, roi=None, roi_margin=ROI_MARGIN, prune=None,
+                adaptive=None):
+    if profile:
+        with stage_report() as records:
+            single_file(image_path, scale, refine, mode, tile=tile, threads=threads, morphometry=morphometry,
+                        roi=roi, roi_margin=roi_margin, prune=prune, adaptive=adaptive)
+        if records:
+            write_report(pd.DataFrame(records), profile)
+        return
+    if image_path is None:
+        image_path = input("Enter path to image: ").strip()
     if not os.path.exists(image_path):
         print("File does not exist.")
         return
-    image = cv.imread(image_path)
+    with stage("load"):
+        image = cv.imread(image_path)
     if image is None:
         print("Unable to read the image.")
         return
+    threshold = frame_threshold(image, mode)
+    if roi is not None:
+        with stage("roi"):
+            image, box = crop_roi(image, roi, mode, roi_margin, adaptive)
+        print(f"✂️  Analysing rows {box[0]}:{box[2]}, columns {box[1]}:{box[3]}")
+    else:
+        box = (0, 0) + image.shape[:2]
 
     resize_image_path = f"resize_image.png"
-    image = resize_image(image, resize_image_path)
-    binary_image = convert_image(image)
+    with stage("resize"):
+        resized = resize_image(image, resize_image_path, scale)
+    with stage("binarise"):
+        binary_image = convert_image(resized, mode, threshold, adaptive, scale)
     binary_image_path = "binary_image.png"
     cv.imwrite(binary_image_path, binary_image)
+    analysis = _slice_analysis(image, binary_image, "binary_image", scale, refine,
+                               tile=tile, threads=threads, origin=box[:2], prune=prune)
+
+    volumes = compute_shape_volumes(analysis, "Volume_file.csv")
+
+    img_path = Core_code(analysis, "skeletonise_image.csv", "skeletonise_image.png")
+    circle_image(analysis, "circle_image.png", "circle_image.csv", refine=refine)
+    eclipse_image(analysis, "eclipse_image.png", "eclipse_image.csv")
+    all_circle(analysis, "all_circle.png", "all_circle.csv","shape/node_circle.csv", refine=refine)
+    if prune is not None:
+        _report_pruning(analysis)
+    if morphometry:
+        with stage("morphometry"):
+            slice_morphometry(analysis, volumes).to_csv("morphometry.csv", index=False)
+        print("📄 Morphometry saved to morphometry.csv")
+
+def process_slice(image_path, idx, image=None, page=None, scale=ANALYSIS_SCALE, refine=False,
+                  mode="fixed", export=True, cache_dir=None, cache_bytes=CACHE_BYTES, profile=False,
+                  tile=None, threads=1, morphometry=False, roi=None, roi_margin=ROI_MARGIN, prune=None,
+                  adaptive=None):
+    """
+    Runs every analyser on one slice and returns their tables by name.
+    `image` is the already decoded slice, e.g. from iter_stack; otherwise it
+    is read from `image_path` (and `page` of a multi-page TIFF).
+    Per-slice CSVs and PNGs are only written when `export` is set. With a
+    `cache_dir`, the binary image and the shared arrays are reused from
+    earlier runs on the same slice content, scale and threshold mode.
+    With `profile`, the wall time, peak RSS and array sizes of every stage
+    are returned as an extra "timings" table. With a `tile` size the
+    full-frame stages run tile by tile on `threads` threads. `morphometry`
+    adds the slice's one-row slice_morphometry table. With a `roi` (see
+    crop_roi) only that region is upscaled and analysed; coordinates still
+    refer to the full frame, and its box is returned as a "roi" table.
+    With `prune` settings (a Pruning) the skeleton is pruned before nodes
+    and endpoints are found, and a "pruning" table counts what was removed.
+    `adaptive` holds the window and offset of the "adaptive" threshold mode.
+    """
+    with stage_report() if profile else nullcontext() as records:
+        tables = _process_slice(image_path, idx, image, page, scale, refine, mode, export,
+                                cache_dir, cache_bytes, tile, threads, morphometry, roi, roi_margin, prune,
+                                adaptive)
+    if tables is not None and profile:
+        tables["timings"] = pd.DataFrame(records)
+    return tables
+
+def _process_slice(image_path, idx, image, page, scale, refine, mode, export, cache_dir, cache_bytes,
+                   tile, threads, morphometry, roi, roi_margin, prune, adaptive):
+    filename = os.path.basename(image_path)
+    if page is not None:
+        filename = f"{filename} [page {page}]"
+    print(f"\nProcessing image {idx}: {filename}")
+    if image is None:
+        with stage("load"):
+            image = read_slice(image_path, page)
+    if image is None:
+        print(f"Skipping invalid image: {filename}")
+        return
+    threshold = frame_threshold(image, mode)
+    if roi is not None:
+        with stage("roi", nbytes=image.nbytes) as record:
+            image, box = crop_roi(image, roi, mode, roi_margin, adaptive)
+            record["nbytes"] = image.nbytes
+    else:
+        box = (0, 0) + image.shape[:2]
+
+    def out(path):
+        return path if export else None
+
+    resized_path = out(f"output/new_resize/resize_image_{idx}.png")
+    bin_path = out(f"output/new_binary/binary_image_{idx}.png")
+    scal_csv_path = out(f"output/new_skeletonise/csv/skeletonise_image_{idx}.csv")
+    scal_out_path = out(f"output/new_skeletonise/image/skeletonise_image_{idx}.png")
+    circles_csv_path = out(f"output/circles/csv/circle_image_{idx}.csv")
+    circles_out_path = out(f"output/circles/image/circle_image_{idx}.png")
+    eclipse_csv_path = out(f"output/eclipse/csv/circle_image_{idx}.csv")
+    eclipse_out_path = out(f"output/eclipse/image/circle_image_{idx}.png")
+    all_circle_csv_path = out(f"output/all_circle/csv/circle_image_{idx}.csv")
+    all_circle_shape_csv_path = out(f"output/all_circle/shape/circle_image_{idx}.csv")
+    all_circle_out_path = out(f"output/all_circle/image/circle_image_{idx}.png")
+    volume = out(f"output/volume_{idx}.png")
+
 
-    compute_shape_volumes(binary_image_path, "Volume_file.csv")
+    cache = ArrayCache(cache_dir, cache_bytes) if cache_dir else None
+    settings = [s for s in (threshold, adaptive) if s is not None]
+    slice_key = ArrayCache.key(array_hash(image), scale, mode, *settings) if cache else None
 
-    img_path = Core_code(binary_image_path, "skeletonise_image.csv", "skeletonise_image.png")
-    circle_image(binary_image_path, "circle_image.png", "circle_image.csv")
-    eclipse_image(binary_image_path, "eclipse_image.png", "eclipse_image.csv")
-    all_circle(binary_image_path, "all_circle.png", "all_circle.csv","shape/node_circle.csv")
+    def binarise():
+        with stage("resize", nbytes=image.nbytes) as record:
+            resized = resize_image(image, None, scale)
+            record["nbytes"] = resized.nbytes
+        if resized_path:
+            with stage("io"):
+                cv.imwrite(resized_path, resized)
+        with stage("binarise") as record:
+            binary = convert_image(resized, mode, threshold, adaptive, scale)
+            record["nbytes"] = binary.nbytes
+        return binary
 
-def folder_image():
-    folder_path = input("Enter path to folder: ").strip()
-    if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+    binary_image = cache.fetch(ArrayCache.key(slice_key, "binary"), binarise) if cache else binarise()
+    if bin_path:
+        with stage("io"):
+            cv.imwrite(bin_path, binary_image)
+    analysis = _slice_analysis(image, binary_image, f"binary_image_{idx}", scale, refine,
+                               cache, slice_key, tile, threads, box[:2], prune)
+    with stage("volumes"):
+        volumes = compute_shape_volumes(analysis, volume)
+    with stage("core"):
+        edges, endpoints = Core_code(analysis, scal_csv_path, scal_out_path)
+    with stage("circles"):
+        nodes = circle_image(analysis, circles_out_path, circles_csv_path, refine=refine)
+    with stage("ellipses"):
+        ellipses = eclipse_image(analysis, eclipse_out_path, eclipse_csv_path)
+    with stage("all_circle"):
+        all_nodes, all_shapes = all_circle(analysis, all_circle_out_path, all_circle_csv_path,
+                                           all_circle_shape_csv_path, refine=refine)
+    tables = {
+        "volumes": volumes,
+        "edges": edges,
+        "endpoints": endpoints,
+        "nodes": nodes,
+        "ellipses": ellipses,
+        "all_circle_nodes": all_nodes,
+        "all_circle_shapes": all_shapes,
+    }
+    if threshold is not None:
+        tables["threshold"] = pd.DataFrame({"threshold": [threshold]})
+    if roi is not None:
+        tables["roi"] = _roi_table(box)
+    if prune is not None:
+        tables["pruning"] = _report_pruning(analysis)
+    if morphometry:
+        with stage("morphometry"):
+            tables["morphometry"] = slice_morphometry(analysis, volumes)
+    return tables
+
+def store_slice(results, image_path, idx, page, tables, scale, mode, prune=None, adaptive=None):
+    # One "slices" row describing the source, then every table keyed by slice_id; page is -1 for one file per slice
+    row = {"file": [os.path.basename(image_path)], "path": [image_path],
+           "page": [-1 if page is None else page], "scale": [scale], "mode": [mode]}
+    if adaptive is not None:
+        row.update({"adaptive_block": [adaptive.block_size], "adaptive_offset": [adaptive.offset]})
+    if prune is not None:
+        row.update({"prune_length": [prune.min_length], "prune_ratio": [prune.radius_ratio],
+                    "merge_distance": [prune.merge_distance]})
+    results.append("slices", pd.DataFrame(row), slice_id=idx)
+    for name, df in tables.items():
+        results.append(name, df, slice_id=idx)
+
+def _init_worker():
+    # One OpenCV thread per process; the pool already uses every core
+    cv.setNumThreads(1)
+
+def folder_image(folder_path=None, workers=1, chunksize=1, max_in_flight=None,
+                 scale=ANALYSIS_SCALE, refine=False, mode="fixed",
+                 store=None, store_path="output/results", export=None,
+                 cache_dir=None, cache_bytes=CACHE_BYTES, prefetch=4, profile=None,
+                 tile=None, threads=1, morphometry=False, roi=None, roi_margin=ROI_MARGIN, prune=None,
+                 adaptive=None):
+    # A folder of slices or a multi-page TIFF, processed in z order
+    if folder_path is None:
+        folder_path = input("Enter path to folder: ").strip()
+    if not os.path.exists(folder_path):
         print("Invalid folder path.")
         return
-    
-    os.makedirs("output/new_resize", exist_ok=True)
-    os.makedirs("output/new_binary", exist_ok=True)
-    os.makedirs("output/new_skeletonise/image", exist_ok=True)
-    os.makedirs("output/new_skeletonise/csv", exist_ok=True)
-    os.makedirs("output/circles/image", exist_ok=True)
-    os.makedirs("output/circles/csv", exist_ok=True)
-    os.makedirs("output/eclipse/image", exist_ok=True)
-    os.makedirs("output/eclipse/csv", exist_ok=True)
-    os.makedirs("output/all_circle/image", exist_ok=True)
-    os.makedirs("output/all_circle/csv", exist_ok=True)
-    os.makedirs("output/all_circle/shape", exist_ok=True)
-
-    for idx, filename in enumerate(os.listdir(folder_path), start=1):
-        if not filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            continue
-        print(f"\nProcessing image {idx}: {filename}")
-        image_path = os.path.join(folder_path, filename)
-        image = cv.imread(image_path)
-        if image is None:
-            print(f"Skipping invalid image: {filename}")
-            continue
-        resized_path = f"output/new_resize/resize_image_{idx}.png"
-        bin_path = f"output/new_binary/binary_image_{idx}.png"
-        scal_csv_path = f"output/new_skeletonise/csv/skeletonise_image_{idx}.csv"
-        scal_out_path = f"output/new_skeletonise/image/skeletonise_image_{idx}.png"
-        circles_csv_path = f"output/circles/csv/circle_image_{idx}.csv"
-        circles_out_path = f"output/circles/image/circle_image_{idx}.png"
-        eclipse_csv_path = f"output/eclipse/csv/circle_image_{idx}.csv"
-        eclipse_out_path = f"output/eclipse/image/circle_image_{idx}.png"
-        all_circle_csv_path = f"output/all_circle/csv/circle_image_{idx}.csv"
-        all_circle_shape_csv_path = f"output/all_circle/shape/circle_image_{idx}.csv"
-        all_circle_out_path = f"output/all_circle/image/circle_image_{idx}.png"
-        volume = f"output/volume_{idx}.png"
-
-
-        image = resize_image(image, resized_path)
-        binary_image = convert_image(image)
-        cv.imwrite(bin_path, binary_image)
-        compute_shape_volumes(bin_path, volume)
-        img_path =  Core_code(bin_path, scal_csv_path, scal_out_path)
-        circle_image(bin_path, circles_out_path, circles_csv_path)
-        eclipse_image(bin_path, eclipse_out_path, eclipse_csv_path)
-        all_circle(bin_path, all_circle_out_path, all_circle_csv_path, all_circle_shape_csv_path)
 
+    # With a results store the per-slice CSVs and PNGs are opt-in
+    if export is None:
+        export = store is None
+    if export:
+        for out_dir in OUTPUT_DIRS:
+            os.makedirs(out_dir, exist_ok=True)
+    results = ResultStore(store_path, store) if store else None
+    timings = []
+    summaries = []
+    pruned = []
+    if roi == "stack":
+        # One box for every slice, so crops line up across z
+        roi = stack_roi(folder_path, mode, roi_margin, prefetch, adaptive)
+        print(f"✂️  Analysing rows {roi[0]}:{roi[2]}, columns {roi[1]}:{roi[3]} of every slice")
+
+    def on_result(task, tables):
+        if tables is None:
+            return
+        image_path, idx, _, page = task
+        if profile:
+            timings.append(tables["timings"].assign(slice_id=idx, file=os.path.basename(image_path)))
+        if morphometry:
+            summaries.append(tables["morphometry"].assign(slice_id=idx, file=os.path.basename(image_path)))
+        if prune is not None:
+            pruned.append(tables["pruning"].assign(slice_id=idx, file=os.path.basename(image_path)))
+        if results is not None:
+            store_slice(results, image_path, idx, page, tables, scale, mode, prune, adaptive)
+
+    # Slices are decoded ahead by a reader thread while earlier ones are analysed
+    total = stack_size(folder_path)
+    tasks = ((s.path, s.z, s.image, s.page) for s in iter_stack(folder_path, prefetch))
+    initializer = _init_worker if workers > 1 else None
+    func = partial(process_slice, scale=scale, refine=refine, mode=mode, export=export,
+                   cache_dir=cache_dir, cache_bytes=cache_bytes, profile=bool(profile),
+                   tile=tile, threads=threads, morphometry=morphometry, roi=roi, roi_margin=roi_margin,
+                   prune=prune, adaptive=adaptive)
+    failures = run_batch(func, tasks, workers=workers, chunksize=chunksize,
+                         max_in_flight=max_in_flight, initializer=initializer, on_result=on_result)
+    if results is not None:
+        results.close()
+        print(f"📦 Results stored in {store_path}")
+    if timings:
+        write_report(pd.concat(timings, ignore_index=True), profile)
+    if summaries:
+        # One row per slice in z order, and one for the whole stack
+        per_slice = pd.concat(summaries, ignore_index=True).sort_values("slice_id")
+        os.makedirs("output", exist_ok=True)
+        per_slice.to_csv("output/morphometry_slices.csv", index=False)
+        stack_morphometry(per_slice).to_csv("output/morphometry_stack.csv", index=False)
+        print("📄 Morphometry saved to output/morphometry_slices.csv and output/morphometry_stack.csv")
+    if pruned:
+        pruning = pd.concat(pruned, ignore_index=True).sort_values("slice_id")
+        os.makedirs("output", exist_ok=True)
+        pruning.to_csv("output/pruning.csv", index=False)
+        print(f"🌿 Pruning removed {pruning['nodes_removed'].sum()} nodes and "
+              f"{pruning['endpoints_removed'].sum()} endpoints; per slice in output/pruning.csv")
+
+    if failures:
+        print(f"\n⚠️  {len(failures)} of {total} images failed:")
+        for (image_path, idx, *_), error in sorted(failures, key=lambda f: f[0][1]):
+            print(f"  ❌ {idx}: {os.path.basename(image_path)}: {error.strip().splitlines()[-1]}")
     print("\nAll images processed.")
+    return failures
+
+def volume_folder(folder_path=None, out_dir="output/volume3d", chunk_depth=32, halo=None, mode="fixed",
+                  adaptive=None):
+    if folder_path is None:
+        folder_path = input("Enter path to stack folder: ").strip()
+    if not os.path.exists(folder_path):
+        print("Invalid folder path.")
+        return
+
+    os.makedirs(out_dir, exist_ok=True)
+    volume = load_volume(folder_path, os.path.join(out_dir, "binary_stack.npy"), mode, adaptive=adaptive)
+    print(f"🧊 Loaded stack of {volume.shape[0]} slices ({volume.shape[1]}x{volume.shape[2]})")
+    return analyse_volume(volume, out_dir, chunk_depth=chunk_depth, halo=halo)
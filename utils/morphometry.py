@@ -0,0 +1,167 @@
+import cv2 as cv
+import numpy as np
+import pandas as pd
+from .analysis import SliceAnalysis
+from .visualization import circle_offsets
+
+# Disc pixels stamped at once while building a local thickness map
+STAMP_PIXELS = 4_000_000
+# Larger discs are drawn one at a time with cv.circle instead of from an offset table
+STAMP_RADIUS = 64
+
+
+def local_thickness(dist, ridge, max_radius=None):
+    """
+    Local thickness map of one phase (bone or marrow): every pixel gets the
+    diameter of the largest disc that covers it among the discs centred on
+    the phase's ridge (skeleton) pixels with their EDT radius. Discs are
+    stamped one radius at a time, smallest first, so larger ones win.
+
+    Args:
+        dist: EDT of the phase
+        ridge: skeleton of the phase
+        max_radius: optional largest disc radius; larger discs are skipped
+    """
+    thickness = np.zeros(dist.shape, np.float32)
+    radius_map = np.where(ridge > 0, np.rint(dist), 0).astype(int)
+    if max_radius is not None:
+        radius_map[radius_map > max_radius] = 0
+    # Skip discs inside a neighbour's: its radius exceeds theirs by the step between them
+    keep = radius_map > 0
+    padded = np.pad(radius_map, 1)
+    h, w = radius_map.shape
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy or dx:
+                step = 2 if dy and dx else 1
+                keep &= padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w] < radius_map + step
+    centers = np.argwhere(keep)
+    radii = radius_map[keep]
+    h, w = thickness.shape
+    for radius in np.unique(radii):
+        at = centers[radii == radius]
+        if radius > STAMP_RADIUS:
+            for r, c in at:
+                cv.circle(thickness, (int(c), int(r)), int(radius), float(2 * radius), -1)
+            continue
+        # Bounded number of stamped pixels per call
+        dy, dx = circle_offsets(int(radius))
+        chunk = max(1, STAMP_PIXELS // len(dy))
+        for i in range(0, len(at), chunk):
+            ys = (at[i:i + chunk, :1] + dy).ravel()
+            xs = (at[i:i + chunk, 1:] + dx).ravel()
+            inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+            thickness[ys[inside], xs[inside]] = 2 * radius
+    thickness[dist == 0] = 0
+    return thickness
+
+
+def _stats(thickness, phase):
+    values = thickness[(phase > 0) & (thickness > 0)]
+    if not len(values):
+        return np.nan, np.nan
+    return values.mean(), values.std()
+
+
+def _tissue_ridge(analysis):
+    # The marrow ridge inside the bone's bounding box, and the largest marrow disc radius it allows
+    rows = np.flatnonzero(analysis.bw.any(axis=1))
+    if not len(rows):
+        return np.zeros_like(analysis.marrow_skeleton), 0
+    cols = np.flatnonzero(analysis.bw.any(axis=0))
+    ridge = np.zeros_like(analysis.marrow_skeleton)
+    box = slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+    ridge[box] = analysis.marrow_skeleton[box]
+    return ridge, max(rows[-1] - rows[0], cols[-1] - cols[0]) // 2 + 1
+
+def slice_morphometry(img, volumes=None):
+    """
+    Standard trabecular indices of one slice, as a one-row DataFrame on the
+    report grid:
+
+    - bv_tv: bone area over tissue (image) area; bone area from the
+      compute_shape_volumes table when given
+    - tb_th / tb_sp: mean (and SD) local thickness of bone and of marrow;
+      marrow discs are only centred inside the bone's bounding box and at
+      most half its longer side wide, so empty background around the
+      section does not count as marrow space
+    - tb_n: trabecular number, 1 / (tb_th + tb_sp)
+    - nodes, endpoints: junction clusters and endpoints of the skeleton;
+      branches: its branch segments, one per trabecula between them
+    - euler: Euler number of the bone (shapes minus enclosed marrow holes),
+      connectivity: holes, i.e. independent trabecular loops, and
+      conn_density: connectivity per tissue area
+    """
+    analysis = SliceAnalysis.load(img)
+    tissue = analysis.report_lengths(analysis.bw.size, power=2)
+    if volumes is not None and len(volumes):
+        bone = volumes['pixel_count'].sum()
+    else:
+        bone = analysis.report_lengths(analysis.areas.sum(), power=2)
+
+    tb_th, tb_th_sd = _stats(local_thickness(analysis.dist, analysis.skeleton), analysis.bw)
+    ridge, max_radius = _tissue_ridge(analysis)
+    tb_sp, tb_sp_sd = _stats(local_thickness(analysis.marrow_dist, ridge, max_radius), analysis.marrow)
+    tb_th, tb_th_sd, tb_sp, tb_sp_sd = analysis.report_lengths(np.array([tb_th, tb_th_sd, tb_sp, tb_sp_sd]))
+
+    from skimage.measure import euler_number  # Only needed with --morphometry
+
+    # 4-connected bone, as labelled, so holes are 8-connected marrow
+    euler = int(euler_number(analysis.bw, connectivity=1))
+    holes = analysis.num_shapes - euler
+    return pd.DataFrame([{
+        'tissue_area': tissue,
+        'bone_area': bone,
+        'bv_tv': bone / tissue,
+        'tb_th': tb_th,
+        'tb_th_sd': tb_th_sd,
+        'tb_sp': tb_sp,
+        'tb_sp_sd': tb_sp_sd,
+        'tb_n': 1 / (tb_th + tb_sp),
+        'shapes': analysis.num_shapes,
+        'nodes': len(analysis.nodes),
+        'endpoints': len(analysis.endpoints),
+        'branches': analysis.branches[1],
+        'euler': euler,
+        'connectivity': holes,
+        'conn_density': holes / tissue,
+    }])
+
+
+def _pooled(mean, sd, weight):
+    # Mean and SD over all pixels of several groups, from each group's mean, SD and size
+    ok = (weight > 0) & mean.notna()
+    if not ok.any():
+        return np.nan, np.nan
+    w = weight[ok] / weight[ok].sum()
+    m = (w * mean[ok]).sum()
+    var = (w * (sd[ok] ** 2 + mean[ok] ** 2)).sum() - m ** 2
+    return m, np.sqrt(max(var, 0))
+
+
+def stack_morphometry(slices):
+    """
+    One summary row for a stack from its slice_morphometry rows: areas and
+    counts add up, and Tb.Th / Tb.Sp are pooled over every bone / marrow
+    pixel of the stack.
+    """
+    if not len(slices):
+        return pd.DataFrame()
+    tissue = slices['tissue_area'].sum()
+    bone = slices['bone_area'].sum()
+    tb_th, tb_th_sd = _pooled(slices['tb_th'], slices['tb_th_sd'], slices['bone_area'])
+    tb_sp, tb_sp_sd = _pooled(slices['tb_sp'], slices['tb_sp_sd'], slices['tissue_area'] - slices['bone_area'])
+    counts = slices[['shapes', 'nodes', 'endpoints', 'branches', 'euler', 'connectivity']].sum()
+    return pd.DataFrame([{
+        'slices': len(slices),
+        'tissue_area': tissue,
+        'bone_area': bone,
+        'bv_tv': bone / tissue,
+        'tb_th': tb_th,
+        'tb_th_sd': tb_th_sd,
+        'tb_sp': tb_sp,
+        'tb_sp_sd': tb_sp_sd,
+        'tb_n': 1 / (tb_th + tb_sp),
+        **counts.to_dict(),
+        'conn_density': counts['connectivity'] / tissue,
+    }])
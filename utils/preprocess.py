@@ -1,23 +1,32 @@
 import cv2 as cv
-import numpy as np
-import matplotlib.pyplot as plt
+from .binarize import binarize
 
-def resize_image(image, resize_image_path):
-    img = cv.cvtColor(image, cv.COLOR_BGR2RGB)
-    h, w, _ = img.shape
-    scale = 8
-    methods = [cv.INTER_LANCZOS4]
-    titles = ["INTER_LANCZOS4"] 
+# Default upscale of each slice side before analysis
+ANALYSIS_SCALE = 8
+# Reported coordinates, radii and lengths refer to the pixel grid of an
+# 8x upscale, whatever scale a slice was analysed at, so tables line up
+REPORT_SCALE = 8
 
-    for i in range(len(methods)):
-        resized = cv.resize(img, (w * scale, h * scale), interpolation=methods[i])
-        if i == 0:
-            best_resize = resized
-    cv.imwrite(resize_image_path, cv.cvtColor(best_resize, cv.COLOR_RGB2BGR))
-    return best_resize
+def resize_image(image, resize_image_path=None, scale=ANALYSIS_SCALE):
+    h, w = image.shape[:2]
+    if scale == 1:
+        resized = image
+    else:
+        # Lanczos works per channel, so no RGB round trip is needed
+        resized = cv.resize(image, (w * scale, h * scale), interpolation=cv.INTER_LANCZOS4)
+    if resize_image_path:
+        cv.imwrite(resize_image_path, resized)
+    return resized
 
-def convert_image(image):
-    gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-    mat = np.array(gray) / 255.0
-    mat = np.where(mat < 0.5, 0, 1)
-    return (mat * 255).astype(np.uint8)
+def upsample_crop(image, slices, factor):
+    """Lanczos-upsamples one crop of `image`, e.g. a single component's bounding box."""
+    crop = image[slices]
+    if factor == 1:
+        return crop
+    h, w = crop.shape[:2]
+    size = (max(1, round(w * factor)), max(1, round(h * factor)))
+    return cv.resize(crop, size, interpolation=cv.INTER_LANCZOS4)
+
+def convert_image(image, mode="fixed", threshold=None, adaptive=None, scale=1):
+    # 0/255 binary image, thresholded in uint8; `scale` is the upscale `image` went through
+    return binarize(image, mode, maxval=255, threshold=threshold, adaptive=adaptive, scale=scale)
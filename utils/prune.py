@@ -0,0 +1,137 @@
+import numpy as np
+from typing import NamedTuple, Tuple
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from .graph_analysis import (classify_skeleton, junction_clusters, cluster_centroids, branch_segments,
+                             segment_contacts, segment_lengths, neighbour_offsets, ENDPOINT)
+
+
+class Pruning(NamedTuple):
+    """
+    Settings of the clean-up between skeletonisation and node detection,
+    lengths in reported pixels; 0 turns a step off.
+
+    min_length: spurs (junction-to-endpoint arms) shorter than this are removed
+    radius_ratio: so are spurs shorter than this many times the bone's EDT
+                  radius at their junction, i.e. bumps of the outline
+    merge_distance: junction clusters joined by an arm at most this long, or
+                    touching each other, become one node
+    """
+    min_length: float = 0.0
+    radius_ratio: float = 0.0
+    merge_distance: float = 0.0
+
+
+class _Arms(NamedTuple):
+    labels: np.ndarray    # branch segment of every arm pixel
+    count: int
+    arm: np.ndarray       # (arm, cluster) contacts, one per pair, ordered by arm
+    cluster: np.ndarray
+    step: np.ndarray      # shortest step from the arm to the cluster
+    internal: np.ndarray  # length along each arm
+    ends: np.ndarray      # endpoints per arm
+
+
+def _neighbours(labels, pix, ndim):
+    # Labels of the 3**ndim - 1 neighbours of the flat indices `pix` of a 1-padded array
+    strides = np.array(labels.strides) // labels.itemsize
+    return [labels.flat[pix + int(np.dot(o, strides))] for o in neighbour_offsets(ndim)]
+
+
+def _arms(skel, kind, jlbl):
+    # The branch segments of a skeleton, with the junction clusters they touch
+    labels, count = branch_segments(skel, jlbl)
+    arm, cluster, step = segment_contacts(labels, jlbl)
+    ends = np.bincount(labels[kind == ENDPOINT], minlength=count + 1)
+    return _Arms(labels, int(count), arm, cluster, step, segment_lengths(labels, count), ends)
+
+
+def prune_spurs(skel: np.ndarray, dist: np.ndarray, min_length: float = 0, radius_ratio: float = 0,
+                kind=None) -> Tuple[np.ndarray, dict]:
+    """
+    Removes the spurs of a skeleton: arms from one junction cluster to an
+    endpoint shorter than `min_length` or than `radius_ratio` times the EDT
+    `dist` at the junction (lengths in the skeleton's pixels). A junction
+    keeps at least two arms, so trabeculae are shortened, never cut, and
+    arms between two endpoints are left alone. One pass; spurs the removal
+    exposes are kept.
+
+    Returns the pruned skeleton and the node, endpoint and spur counts of
+    the input.
+    """
+    skel = (skel > 0).astype(np.uint8)
+    if kind is None:
+        kind = classify_skeleton(skel)
+    jlbl, n = junction_clusters(skel, kind)
+    info = {"nodes_before": int(n), "endpoints_before": int((kind == ENDPOINT).sum()), "spurs": 0}
+    if not n:
+        return skel, info
+    arms = _arms(skel, kind, jlbl)
+    touches = np.bincount(arms.arm, minlength=arms.count + 1)
+    spur = (touches[arms.arm] == 1) & (arms.ends[arms.arm] > 0)
+
+    # A spur's length runs from its endpoint to the junction
+    length = arms.internal[arms.arm] + arms.step
+    pos = np.asarray(cluster_centroids(jlbl, n), dtype=np.intp).reshape(-1, skel.ndim)
+    limit = np.maximum(min_length, radius_ratio * dist[tuple(pos.T)])
+    short = np.flatnonzero(spur & (length < limit[arms.cluster - 1]))
+
+    # Shortest spurs first, as many per junction as leave it two arms
+    allowed = np.maximum(np.bincount(arms.cluster, minlength=n + 1) - 2, 0)
+    short = short[np.lexsort((length[short], arms.cluster[short]))]
+    node = arms.cluster[short]
+    rank = np.arange(len(short)) - np.searchsorted(node, node)
+    removed = np.zeros(arms.count + 1, bool)
+    removed[arms.arm[short[rank < allowed[node]]]] = True
+    if not removed.any():
+        return skel, info
+
+    pruned = skel.copy()
+    pruned[removed[arms.labels]] = 0
+    info["spurs"] = int(removed.sum())
+    return pruned, info
+
+
+def merge_junctions(skel: np.ndarray, kind: np.ndarray, junctions: Tuple[np.ndarray, int],
+                    max_length: float) -> Tuple[np.ndarray, int]:
+    """
+    Merges junction clusters joined by an arm at most `max_length` long, or
+    touching each other diagonally, into one cluster that also holds the
+    joining arm. Returns (labels, count) like junction_clusters, merged
+    clusters numbered in the order of their first original cluster.
+    """
+    jlbl, n = junctions
+    if n < 2:
+        return jlbl, n
+    arms = _arms(skel, kind, jlbl)
+    touches = np.bincount(arms.arm, minlength=arms.count + 1)
+    first = np.ones(len(arms.arm), bool)
+    first[1:] = arms.arm[1:] != arms.arm[:-1]
+    at = np.flatnonzero(first & (touches[arms.arm] == 2))
+    at = at[(arms.ends[arms.arm[at]] == 0)
+            & (arms.internal[arms.arm[at]] + arms.step[at] + arms.step[at + 1] <= max_length)]
+    linked = arms.cluster[at]
+    a, b = linked, arms.cluster[at + 1]
+
+    # Clusters whose pixels touch
+    padded = np.pad(jlbl, 1)
+    pix = np.flatnonzero(padded)
+    own = padded.flat[pix]
+    for nb in _neighbours(padded, pix, jlbl.ndim):
+        hit = (nb > 0) & (nb != own)
+        a = np.concatenate([a, own[hit]])
+        b = np.concatenate([b, nb[hit]])
+    if not len(a):
+        return jlbl, n
+
+    adjacency = csr_matrix((np.ones(len(a)), (a - 1, b - 1)), shape=(n, n))
+    count, comp = connected_components(adjacency, directed=False)
+    if count == n:
+        return jlbl, n
+    lut = np.concatenate([[0], comp + 1]).astype(jlbl.dtype)
+    merged = lut[jlbl]
+    # The joining arms join the cluster
+    arm_lut = np.zeros(arms.count + 1, jlbl.dtype)
+    arm_lut[arms.arm[at]] = comp[linked - 1] + 1
+    merged += arm_lut[arms.labels]
+    return merged, count
@@ -0,0 +1,25 @@
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+
+def distance_map(binary_img):
+    mask = binary_img > 0
+    return distance_transform_edt(mask)
+
+
+def node_radii(mask, nodes, dist=None):
+    """
+    Returns the distance-transform radius at every node in one gather.
+
+    Args:
+        mask: binary image of the shape the nodes belong to
+        nodes: sequence of (row, col) coordinates, or (z, row, col) in 3D
+        dist: optional precomputed distance_map of the whole image; labelled
+              components are separated by background, so sampling it inside
+              `mask` gives the same values as a per-shape transform
+    """
+    idx = tuple(np.asarray(nodes, dtype=np.intp).reshape(-1, mask.ndim).T)
+    if dist is None:
+        return distance_map(mask)[idx]
+    return np.where(mask[idx] > 0, dist[idx], 0.0)
+
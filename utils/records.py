@@ -0,0 +1,30 @@
+import numpy as np
+
+# Per-feature records of a slice, one structured array per kind of feature,
+# with (r, c) pixel positions on the analysed grid; lengths are in the
+# producer's units.
+NODE_DTYPE = np.dtype([('id', np.int64), ('shape_id', np.int64), ('r', np.int64), ('c', np.int64),
+                       ('radius', np.float64)])
+ENDPOINT_DTYPE = np.dtype([('id', np.int64), ('shape_id', np.int64), ('r', np.int64), ('c', np.int64),
+                           ('node_id', np.int64), ('distance', np.float64)])
+EDGE_DTYPE = np.dtype([('node1', np.int64), ('node2', np.int64), ('distance', np.float64),
+                       ('length', np.float64)])
+
+
+def make_records(dtype, n=0, **fields):
+    """
+    A structured array of `n` records (or as many as the given columns) with
+    `fields` filled in from arrays or scalars; other fields are zero.
+    """
+    if fields and not n:
+        n = max((np.size(v) for v in fields.values() if np.ndim(v)), default=1)
+    rec = np.zeros(n, dtype)
+    for name, values in fields.items():
+        rec[name] = values
+    return rec
+
+
+def coords(rec):
+    """(n, 2) array of the records' (r, c)."""
+    return np.stack([rec['r'], rec['c']], axis=1)
+
@@ -0,0 +1,60 @@
+import os
+from .preprocess import resize_image, convert_image
+from .binarize import Adaptive
+from .analysis import SliceAnalysis
+from .results import ResultStore
+from .stack import read_slice
+from .roi import roi_slices
+from .prune import Pruning
+from .skeleton import render_skeleton
+from .circle import render_circles
+from .eclipse import render_ellipses
+from .draw_node_circles import render_all_circle
+
+
+def render_slice(store_path, slice_ids, out_dir="output/render"):
+    """
+    Draws the annotated images of selected slices from a results store
+    written by a headless run, so a run never has to allocate colour
+    canvases for slices nobody looks at.
+
+    The binary image is rebuilt from each slice's file with the scale and
+    threshold mode recorded in the store's slices table (and the Otsu cut-off
+    in its threshold table), from the region in its roi table when the run
+    analysed one, and pruned with the run's
+    pruning settings.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    slices = ResultStore.read(store_path, "slices", slice_ids)
+    tables = {name: ResultStore.read(store_path, name, slice_ids)
+              for name in ("nodes", "ellipses", "all_circle_nodes", "roi", "threshold")}
+
+    for row in slices.itertuples():
+        image = read_slice(row.path, row.page if row.page >= 0 else None)
+        if image is None:
+            print(f"Skipping invalid image: {row.path}")
+            continue
+        of_slice = {name: df[df["slice_id"] == row.slice_id] if len(df) else df
+                    for name, df in tables.items()}
+        box = (0, 0) + image.shape[:2]
+        if len(of_slice["roi"]):
+            box = tuple(int(v) for v in of_slice["roi"][["y0", "x0", "y1", "x1"]].iloc[0])
+            image = image[roi_slices(box)]
+        adaptive = None
+        if row.mode == "adaptive" and hasattr(row, "adaptive_block"):
+            adaptive = Adaptive(int(row.adaptive_block), row.adaptive_offset)
+        threshold = of_slice["threshold"]["threshold"].iloc[0] if len(of_slice["threshold"]) else None
+        binary_image = convert_image(resize_image(image, None, row.scale), row.mode, threshold,
+                                     adaptive, row.scale)
+        prune = None
+        if hasattr(row, "prune_length"):
+            prune = Pruning(row.prune_length, row.prune_ratio, row.merge_distance)
+        analysis = SliceAnalysis(binary_image, f"binary_image_{row.slice_id}", scale=row.scale,
+                                 origin=box[:2], prune=prune)
+
+        render_skeleton(analysis, os.path.join(out_dir, f"skeletonise_image_{row.slice_id}.png"))
+        render_circles(analysis, of_slice["nodes"], os.path.join(out_dir, f"circle_image_{row.slice_id}.png"))
+        render_ellipses(analysis, of_slice["ellipses"], os.path.join(out_dir, f"eclipse_image_{row.slice_id}.png"))
+        render_all_circle(analysis, of_slice["all_circle_nodes"],
+                          os.path.join(out_dir, f"all_circle_image_{row.slice_id}.png"))
+        print(f"🖼️  Rendered slice {row.slice_id} to {out_dir}")
@@ -0,0 +1,112 @@
+import os
+import glob
+import pandas as pd
+from .choices import STORE_FORMATS
+
+# Engines pandas needs for each format
+_ENGINES = {"parquet": "pyarrow", "hdf5": "tables"}
+
+
+class ResultStore:
+    """
+    Collects the tables of a whole run (nodes, edges, endpoints, ellipses,
+    volumes, ...) into a few columnar files instead of several CSVs per
+    slice and shape.
+
+    Rows are buffered per table and written in batches of about
+    `batch_rows`. Parquet tables become partitioned datasets
+    (`<path>/<table>/part-00000.parquet`, ...) and HDF5 tables are appended
+    to one `<path>/results.h5` under their table name. Either way
+    ResultStore.read(path, table) returns a single DataFrame.
+
+    Use one store per run, from one process: workers send their tables
+    back (see run_batch's on_result) and the parent appends them. A store
+    opened with append=False replaces the tables of an earlier run.
+    """
+
+    def __init__(self, path, fmt="parquet", batch_rows=100_000, append=False):
+        if fmt not in STORE_FORMATS:
+            raise ValueError(f"Unknown store format {fmt!r}, expected one of {STORE_FORMATS}")
+        try:
+            __import__(_ENGINES[fmt])
+        except ImportError as e:
+            raise ImportError(f"The {fmt} store needs the '{_ENGINES[fmt]}' package") from e
+        self.path = path
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self._buffers = {}
+        self._rows = {}
+        self._parts = {}
+        os.makedirs(path, exist_ok=True)
+        if not append:
+            for old in glob.glob(os.path.join(path, "*", "part-*.parquet")) + glob.glob(os.path.join(path, "results.h5")):
+                os.remove(old)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, table, df, **keys):
+        """Buffers `df` for `table`, adding constant key columns such as slice_id=3."""
+        if df is None or df.empty:
+            return
+        df = df.assign(**keys)[list(keys) + [c for c in df.columns if c not in keys]]
+        self._buffers.setdefault(table, []).append(df)
+        self._rows[table] = self._rows.get(table, 0) + len(df)
+        if self._rows[table] >= self.batch_rows:
+            self._write(table)
+
+    def flush(self):
+        for table in list(self._buffers):
+            self._write(table)
+
+    def close(self):
+        self.flush()
+
+    def _write(self, table):
+        frames = self._buffers.pop(table, [])
+        self._rows.pop(table, None)
+        if not frames:
+            return
+        df = pd.concat(frames, ignore_index=True)
+        if self.fmt == "parquet":
+            part = self._parts.get(table, len(glob.glob(os.path.join(self.path, table, "part-*.parquet"))))
+            self._parts[table] = part + 1
+            os.makedirs(os.path.join(self.path, table), exist_ok=True)
+            df.to_parquet(os.path.join(self.path, table, f"part-{part:05d}.parquet"), index=False)
+        else:
+            # Strings need a fixed width in HDF5 tables; leave room for later batches
+            widths = {c: max(64, int(df[c].astype(str).str.len().max()))
+                      for c in df.columns if not pd.api.types.is_numeric_dtype(df[c])}
+            df.to_hdf(os.path.join(self.path, "results.h5"), key=table, mode="a", format="table",
+                      append=True, index=False, data_columns=True, min_itemsize=widths or None)
+
+    @staticmethod
+    def read(path, table, slice_ids=None):
+        """Returns one stored table, optionally only the rows of some slices."""
+        if table not in ResultStore.tables(path):
+            return pd.DataFrame()
+        if os.path.isdir(os.path.join(path, table)):
+            filters = [("slice_id", "in", list(slice_ids))] if slice_ids is not None else None
+            return pd.read_parquet(os.path.join(path, table), filters=filters)
+        where = f"slice_id in {list(slice_ids)}" if slice_ids is not None else None
+        return pd.read_hdf(os.path.join(path, "results.h5"), key=table, where=where)
+
+    @staticmethod
+    def tables(path):
+        h5 = os.path.join(path, "results.h5")
+        if os.path.exists(h5):
+            with pd.HDFStore(h5, mode="r") as store:
+                return [key.lstrip("/") for key in store.keys()]
+        return sorted(d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d)))
+
+
+def export_csv(path, out_dir, tables=None):
+    """Writes stored tables to one CSV each, on demand, e.g. for the notebooks."""
+    os.makedirs(out_dir, exist_ok=True)
+    for table in tables or ResultStore.tables(path):
+        csv_path = os.path.join(out_dir, f"{table}.csv")
+        ResultStore.read(path, table).to_csv(csv_path, index=False)
+        print(f"📄 {table} saved to {csv_path}")
@@ -0,0 +1,69 @@
+import cv2 as cv
+import numpy as np
+from .binarize import binarize, Adaptive
+from .stack import iter_stack
+
+# Background kept around the foreground, in native pixels. Lanczos reads 4
+# native pixels on each side, so the upscaled crop matches the upscaled
+# frame wherever there is bone.
+ROI_MARGIN = 8
+
+
+def foreground_box(image, mode="fixed", adaptive=None):
+    """(y0, x0, y1, x1) bounding box of a slice's foreground at native resolution, None if it is empty."""
+    bw = binarize(image, mode, adaptive=adaptive)
+    rows = np.flatnonzero(bw.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(bw.any(axis=0))
+    return int(rows[0]), int(cols[0]), int(rows[-1]) + 1, int(cols[-1]) + 1
+
+
+def grow_box(box, shape, margin):
+    # The box plus `margin` pixels on each side, inside the frame; the whole frame when there is no box
+    if box is None:
+        return 0, 0, shape[0], shape[1]
+    y0, x0, y1, x1 = box
+    return max(y0 - margin, 0), max(x0 - margin, 0), min(y1 + margin, shape[0]), min(x1 + margin, shape[1])
+
+
+def union_box(a, b):
+    if a is None or b is None:
+        return a if b is None else b
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def roi_margin(margin, mode="fixed", adaptive=None):
+    # The adaptive threshold also reads half its window around each pixel, so that has to be inside the crop too
+    if mode != "adaptive":
+        return margin
+    return max(margin, (adaptive or Adaptive()).block_size // 2 + ROI_MARGIN)
+
+
+def slice_roi(image, mode="fixed", margin=ROI_MARGIN, adaptive=None):
+    """Region of one slice to upscale and analyse: its foreground box grown by `margin`."""
+    return grow_box(foreground_box(image, mode, adaptive), image.shape[:2], roi_margin(margin, mode, adaptive))
+
+
+def stack_roi(source, mode="fixed", margin=ROI_MARGIN, prefetch=4, adaptive=None):
+    """
+    One region for every slice of a stack: the union of their foreground
+    boxes grown by `margin`, so crops, images and coordinates line up
+    across z. Reads the stack once at native resolution.
+    """
+    box, shape = None, None
+    for item in iter_stack(source, prefetch, cv.IMREAD_GRAYSCALE):
+        if item.image is None:
+            continue
+        if shape is not None and item.image.shape != shape:
+            raise ValueError(f"Slice {item.z} of {source} is {item.image.shape}, expected {shape}")
+        shape = item.image.shape
+        box = union_box(box, foreground_box(item.image, mode, adaptive))
+    if shape is None:
+        raise ValueError(f"No readable slices in {source}")
+    return grow_box(box, shape, roi_margin(margin, mode, adaptive))
+
+
+def roi_slices(box):
+    y0, x0, y1, x1 = box
+    return slice(y0, y1), slice(x0, x1)
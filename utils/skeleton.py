@@ -1,60 +1,87 @@
 import cv2 as cv
 import numpy as np
 import csv
-from .graph_analysis import (
-    skeletonise_image, find_nodes, find_endpoints,
-    find_connections, compute_distances_from_connections,
-    euclidean_distance
-)
+import pandas as pd
+from .records import make_records, coords, ENDPOINT_DTYPE
 from .visualization import overlay_skeleton_nodes
+from .analysis import SliceAnalysis
+from .spatial import nearest
+from .timing import stage, timed
 
-def load_binary(path: str) -> np.ndarray:
-    img = cv.imread(path, cv.IMREAD_GRAYSCALE)
-    _, bw = cv.threshold(img, 127, 1, cv.THRESH_BINARY)
-    return bw.astype(np.uint8)
-
-def Core_code(imput_image, output_csv, output_image):
-    bw = load_binary(imput_image)
-    skel = skeletonise_image(bw)
-    img_gray = cv.imread(imput_image, cv.IMREAD_GRAYSCALE)
-    nodes = find_nodes(skel)
-    endpoints = find_endpoints(skel)
-
-    connections = find_connections(skel, nodes)
-    distances = compute_distances_from_connections(nodes, connections)
-
-    endpoint_distances = []
-    used_node_ids = set()
-    for idx, (er, ec) in enumerate(endpoints):
-        min_dist, nearest = float("inf"), -1
-        for i, (nr, nc) in enumerate(nodes):
-            d = euclidean_distance((er, ec), (nr, nc))
-            if d < min_dist:
-                min_dist, nearest = d, i
-        if nearest != -1:
-            endpoint_distances.append((nearest + 1, nodes[nearest], f"e{idx}", (er, ec), min_dist))
-            used_node_ids.add(nearest + 1)
-
-    connected_node_ids = {i for i, *_ in distances}
-    with open(output_csv, 'w', newline='', encoding='utf-8') as f:
-        w = csv.writer(f)
-        w.writerow(['Node1_ID', 'Coord1', 'Node2_ID', 'Coord2', 'Distance', 'End_point', 'E_Coord', 'E_Distance'])
-        for (i, r1, c1, j, r2, c2, d) in distances:
-            match = next((ep for ep in endpoint_distances if ep[0] == i), None)
-            if match:
-                _, _, label, (er, ec), ed = match
-                w.writerow([i, f"({r1},{c1})", j, f"({r2},{c2})", f"{d:.5f}", label, f"({er},{ec})", f"{ed:.5f}"])
-            else:
-                w.writerow([i, f"({r1},{c1})", j, f"({r2},{c2})", f"{d:.5f}", 'null', 'null', 'null'])
-        for i, (r, c) in enumerate(nodes, 1):
-            if i not in connected_node_ids:
-                match = next((ep for ep in endpoint_distances if ep[0] == i), None)
-                if match:
-                    _, _, label, (er, ec), ed = match
-                    w.writerow([i, f"({r},{c})", 'null', 'null', 'null', label, f"({er},{ec})", f"{ed:.5f}"])
-
-    out_img = overlay_skeleton_nodes(img_gray, skel, nodes, endpoints)
-    cv.imwrite(output_image, out_img)
+# Longest branch, in reported pixels, that counts as a node-to-node connection
+MAX_BRANCH_DISTANCE = 100
+
+def Core_code(imput_image, output_csv=None, output_image=None, max_distance=MAX_BRANCH_DISTANCE):
+    """
+    Node connections, branch lengths and endpoint-to-nearest-node distances
+    of one slice. Returns (edges, endpoints) DataFrames; the CSV and the
+    annotated image are only written when their paths are given.
+    `max_distance` is in reported pixels, so the same branches count as
+    connections whatever scale the slice was analysed at.
+    """
+    analysis = SliceAnalysis.load(imput_image)
+    nodes = analysis.nodes
+    endpoints = analysis.endpoints
+
+    with stage("connections"):
+        edges = analysis.graph.edge_records(max_distance=analysis.grid_lengths(max_distance))
+
+    # Nearest node of every endpoint, and the first endpoint of every node by index
+    node_pos = np.asarray(nodes, dtype=np.int64).reshape(-1, 2)
+    end_pos = np.asarray(endpoints, dtype=np.int64).reshape(-1, 2)
+    e_dist, e_nearest = nearest(endpoints, nodes)
+    ends = make_records(ENDPOINT_DTYPE, len(end_pos), id=np.arange(len(end_pos)),
+                        shape_id=analysis.labeled[end_pos[:, 0], end_pos[:, 1]],
+                        r=end_pos[:, 0], c=end_pos[:, 1], node_id=e_nearest + 1, distance=e_dist)
+    ends = ends[e_nearest != -1]
+    first_end = np.full(len(nodes) + 1, -1)
+    node_ids, first = np.unique(ends['node_id'], return_index=True)
+    first_end[node_ids] = first
+    end_xy = coords(ends)
+
+    # Coordinates and lengths on the report grid
+    pt = lambda p: "({},{})".format(*analysis.report_coords(p))
+    ln = lambda v: f"{analysis.report_lengths(v):.5f}"
+
+    def end_cells(node_id):
+        k = first_end[node_id]
+        if k < 0:
+            return ['null', 'null', 'null']
+        return [f"e{ends['id'][k]}", pt(end_xy[k]), ln(ends['distance'][k])]
 
-    return out_img
+    if output_csv:
+        with stage("io"), open(output_csv, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(['Node1_ID', 'Coord1', 'Node2_ID', 'Coord2', 'Distance', 'End_point', 'E_Coord', 'E_Distance', 'Branch_Length'])
+            for i, j, d, bl in edges[['node1', 'node2', 'distance', 'length']].tolist():
+                w.writerow([i, pt(node_pos[i - 1]), j, pt(node_pos[j - 1]), ln(d), *end_cells(i), ln(bl)])
+            connected = np.zeros(len(nodes) + 1, bool)
+            connected[edges['node1']] = True
+            for i in np.flatnonzero(~connected[1:] & (first_end[1:] >= 0)) + 1:
+                w.writerow([i, pt(node_pos[i - 1]), 'null', 'null', 'null', *end_cells(i), 'null'])
 
+    # The same measurements as tables on the report grid, built once from the record columns
+    p1 = analysis.report_coords(node_pos[edges['node1'] - 1])
+    p2 = analysis.report_coords(node_pos[edges['node2'] - 1])
+    edges_df = pd.DataFrame({
+        'node1_id': edges['node1'], 'y1': p1[:, 0], 'x1': p1[:, 1],
+        'node2_id': edges['node2'], 'y2': p2[:, 0], 'x2': p2[:, 1],
+        'distance': analysis.report_lengths(edges['distance']),
+        'branch_length': analysis.report_lengths(edges['length']),
+    })
+    pe = analysis.report_coords(end_xy)
+    ends_df = pd.DataFrame({
+        'endpoint': [f"e{i}" for i in ends['id']], 'y': pe[:, 0], 'x': pe[:, 1],
+        'node_id': ends['node_id'], 'distance': analysis.report_lengths(ends['distance']),
+    })
+
+    if output_image:
+        render_skeleton(analysis, output_image)
+
+    return edges_df, ends_df
+
+
+@timed("render")
+def render_skeleton(analysis, output_image):
+    out_img = overlay_skeleton_nodes(analysis.gray, analysis.skeleton, analysis.nodes, analysis.endpoints)
+    cv.imwrite(output_image, out_img)
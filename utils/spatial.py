@@ -0,0 +1,33 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Pixel coordinates are integers, so distances that differ by less than this are ties
+_TIE = 1e-9
+
+
+def as_points(points):
+    # (n, 2) for (row, col) points, (n, 3) for (z, row, col); empty input is 2D
+    pts = np.asarray(points, dtype=float)
+    return pts if pts.ndim == 2 else pts.reshape(-1, 2)
+
+
+def nearest(points, targets):
+    """
+    Returns (distance, index) of the nearest target for every point, or
+    (inf, -1) when there are no targets. Ties go to the lowest target index,
+    the same result as a linear scan with a strict '<'.
+    """
+    pts, tgt = as_points(points), as_points(targets)
+    if len(tgt) == 0 or len(pts) == 0:
+        return np.full(len(pts), np.inf), np.full(len(pts), -1)
+    tree = cKDTree(tgt)
+    if len(tgt) == 1:
+        d, idx = tree.query(pts, k=1)
+        return d, idx
+    d, idx = tree.query(pts, k=2)
+    tied = d[:, 1] - d[:, 0] < _TIE
+    d, idx = d[:, 0], idx[:, 0].copy()
+    for p in np.flatnonzero(tied):
+        idx[p] = min(tree.query_ball_point(pts[p], d[p] + _TIE))
+    return d, idx
+
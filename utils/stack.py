@@ -0,0 +1,132 @@
+import os
+import re
+import queue
+import threading
+from typing import NamedTuple, Optional
+import cv2 as cv
+import numpy as np
+
+STACK_EXTENSIONS = ('.tif', '.tiff', '.png', '.jpg', '.jpeg', '.bmp')
+
+_DONE = object()
+
+
+class StackSlice(NamedTuple):
+    z: int
+    path: str
+    page: Optional[int]  # page of a multi-page TIFF, None for one file per slice
+    image: Optional[np.ndarray]  # None when the slice could not be decoded
+
+
+def slice_number(filename):
+    # Trailing number of names like "..._107.tiff"; -1 when there is none
+    match = re.search(r'(\d+)(?=\.[^.]+$)', filename)
+    return int(match.group(1)) if match else -1
+
+
+def stack_files(folder_path):
+    files = [f for f in os.listdir(folder_path) if f.lower().endswith(STACK_EXTENSIONS)]
+    files.sort(key=lambda f: (slice_number(f), f))
+    return [os.path.join(folder_path, f) for f in files]
+
+
+def stack_size(source):
+    """Number of slices in a slice folder or a multi-page TIFF."""
+    if os.path.isdir(source):
+        return len(stack_files(source))
+    return cv.imcount(source)
+
+
+def read_slice(path, page=None, flags=cv.IMREAD_COLOR):
+    if page is None:
+        return cv.imread(path, flags)
+    ok, pages = cv.imreadmulti(path, page, 1, flags=flags)
+    return pages[0] if ok and pages else None
+
+
+def _read_slices(source, flags):
+    if os.path.isdir(source):
+        for z, path in enumerate(stack_files(source)):
+            yield StackSlice(z, path, None, read_slice(path, None, flags))
+    else:
+        for z in range(cv.imcount(source)):
+            yield StackSlice(z, source, z, read_slice(source, z, flags))
+
+
+def iter_stack(source, prefetch=4, flags=cv.IMREAD_COLOR):
+    """
+    Yields a StackSlice for every slice of `source`, in z order: a folder of
+    slice images sorted by the number at the end of their names, or a
+    multi-page TIFF.
+
+    A background thread decodes up to `prefetch` slices ahead into a
+    bounded queue, so disk reads overlap with whatever the caller does
+    with the current slice. prefetch=0 reads in the calling thread.
+    """
+    if prefetch <= 0:
+        yield from _read_slices(source, flags)
+        return
+
+    slots = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in _read_slices(source, flags):
+                if stop.is_set():
+                    return
+                slots.put(item)
+        except Exception as e:
+            slots.put(e)
+        finally:
+            slots.put(_DONE)
+
+    reader = threading.Thread(target=produce, daemon=True)
+    reader.start()
+    try:
+        while True:
+            item = slots.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Unblock a reader waiting on a full queue when the caller stops early
+        stop.set()
+        while reader.is_alive():
+            try:
+                slots.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def load_stack(source, memmap_path, prefetch=4, transform=None):
+    """
+    Reads a whole stack into a (z, y, x) uint8 array memory-mapped from
+    `memmap_path`, slice by slice, so it never has to fit in RAM.
+
+    Args:
+        source: slice folder or multi-page TIFF
+        memmap_path: .npy file backing the array
+        prefetch: slices decoded ahead by the reader thread
+        transform: optional callable(image, out) that writes one grey slice
+                   into its plane `out`, e.g. a thresholding step; by
+                   default the grey values are copied
+    """
+    depth = stack_size(source)
+    if depth == 0:
+        raise ValueError(f"No slices found in {source}")
+    volume = None
+    for item in iter_stack(source, prefetch, cv.IMREAD_GRAYSCALE):
+        if item.image is None or (volume is not None and item.image.shape != volume.shape[1:]):
+            raise ValueError(f"Failed to load slice {item.z} of {source}")
+        if volume is None:
+            volume = np.lib.format.open_memmap(memmap_path, mode="w+", dtype=np.uint8,
+                                               shape=(depth,) + item.image.shape)
+        if transform is None:
+            volume[item.z] = item.image
+        else:
+            transform(item.image, volume[item.z])
+    volume.flush()
+    return volume
@@ -0,0 +1,151 @@
+import os
+from functools import partial
+from itertools import product
+import numpy as np
+import pandas as pd
+from .analysis import SliceAnalysis
+from .batch import run_batch
+from .binarize import THRESHOLD
+from .draw_node_circles import detect_nodes, peak_distance, NODE_MIN_DISTANCE
+from .eclipse import fit_branch_ellipses
+from .io_utils import _init_worker
+from .preprocess import resize_image, convert_image, ANALYSIS_SCALE
+from .radius import node_radii
+from .skeleton import MAX_BRANCH_DISTANCE
+from .stack import stack_files, read_slice
+
+# Settings a sweep varies, with the pipeline's defaults. threshold is the
+# grey-level cut-off (127, i.e. 0.5 of the 8-bit range); max_distance and
+# min_distance are in reported pixels, so they mean the same length at
+# every scale.
+SWEEP_DEFAULTS = {
+    "scale": [ANALYSIS_SCALE],
+    "threshold": [THRESHOLD],
+    "max_distance": [MAX_BRANCH_DISTANCE],
+    "min_distance": [NODE_MIN_DISTANCE],
+    "threshold_rel": [0.1],
+}
+
+# Settings the averaged comparison table groups by
+SWEEP_KEYS = list(SWEEP_DEFAULTS)
+
+
+def _mean(values):
+    return float(np.mean(values)) if len(values) else np.nan
+
+
+def _median(values):
+    return float(np.median(values)) if len(values) else np.nan
+
+
+def _skeleton_metrics(analysis):
+    # Everything that only depends on scale and threshold
+    nodes = np.asarray(analysis.nodes, dtype=np.intp).reshape(-1, 2)
+    ellipses = fit_branch_ellipses(analysis)
+    return {
+        "shapes": analysis.num_shapes,
+        "nodes": len(nodes),
+        "endpoints": len(analysis.endpoints),
+        "node_radius_mean": _mean(analysis.report_lengths(analysis.dist[nodes[:, 0], nodes[:, 1]])),
+        "ellipses": len(ellipses),
+        "semi_major_median": _median(ellipses["semi_major"]),
+        "semi_minor_median": _median(ellipses["semi_minor"]),
+    }
+
+
+def _connection_metrics(analysis, max_distance):
+    edges = analysis.graph.edge_records(max_distance=analysis.grid_lengths(max_distance))
+    return {"connections": len(edges), "branch_length_mean": _mean(analysis.report_lengths(edges["length"]))}
+
+
+def _peak_metrics(analysis, min_distances, thresholds_rel):
+    """
+    all_circle's corner-peak nodes for every (min_distance, threshold_rel),
+    on one set of per-shape crops and skeletons.
+    """
+    keys = list(product(min_distances, thresholds_rel))
+    radii = {key: [np.empty(0)] for key in keys}
+    on_grid = {d: peak_distance(analysis, d) for d in min_distances}
+    # The widest crop margin keeps every min_distance's detection equal to the full frame's
+    for shape_id, sl, shape_mask in analysis.components(pad=max(on_grid.values()) + 1):
+        skel = analysis.shape_skeletons[sl] * shape_mask
+        for key in keys:
+            min_distance, threshold_rel = key
+            peaks = detect_nodes(skel, on_grid[min_distance], threshold_rel)
+            radii[key].append(node_radii(shape_mask, peaks, dist=analysis.dist[sl]))
+    radii = {key: analysis.report_lengths(np.concatenate(r)) for key, r in radii.items()}
+    return {key: {"peaks": len(r), "peak_radius_mean": _mean(r)} for key, r in radii.items()}
+
+
+def sweep_slice(image_path, idx, page=None, scale=ANALYSIS_SCALE, grid=None):
+    """
+    Tidy metrics of one slice at one scale for every combination of the
+    other settings in `grid`: one resize, one binarisation, skeleton, graph,
+    EDT and ellipse fit per threshold, and only the connection filter and
+    peak detection per max_distance / (min_distance, threshold_rel).
+    """
+    grid = {**SWEEP_DEFAULTS, **(grid or {})}
+    image = read_slice(image_path, page)
+    if image is None:
+        raise ValueError(f"Failed to load {image_path}")
+    resized = resize_image(image, None, scale)
+    rows = []
+    for threshold in grid["threshold"]:
+        binary = convert_image(resized, threshold=threshold)
+        analysis = SliceAnalysis(binary, f"binary_image_{idx}", scale=scale)
+        base = _skeleton_metrics(analysis)
+        peaks = _peak_metrics(analysis, grid["min_distance"], grid["threshold_rel"])
+        for max_distance in grid["max_distance"]:
+            connections = _connection_metrics(analysis, max_distance)
+            for (min_distance, threshold_rel), peak in peaks.items():
+                rows.append({"slice_id": idx, "file": os.path.basename(image_path), "scale": scale,
+                             "threshold": threshold, "max_distance": max_distance,
+                             "min_distance": min_distance, "threshold_rel": threshold_rel,
+                             **base, **connections, **peak})
+    return pd.DataFrame(rows)
+
+
+def parameter_sweep(source, grid=None, slices=None, workers=1, out_dir="output/sweep"):
+    """
+    Runs every configuration of `grid` (setting -> list of values, see
+    SWEEP_DEFAULTS) on the slices of `source`, a slice folder or a single
+    image, and returns one row per slice and configuration. Slices and
+    scales run in parallel on `workers` processes. Writes the rows and
+    their per-configuration means over the slices to `out_dir`.
+
+    Args:
+        source: folder of slices or one slice image
+        grid: dict of the settings to vary; missing ones keep their default
+        slices: optional z indices (positions in z order, from 0) of the
+                folder's slices to use
+        workers: number of processes
+        out_dir: folder of sweep.csv and sweep_summary.csv
+    """
+    grid = {**SWEEP_DEFAULTS, **(grid or {})}
+    files = stack_files(source) if os.path.isdir(source) else [source]
+    zs = range(len(files)) if slices is None else list(slices)
+    outside = [z for z in zs if not 0 <= z < len(files)]
+    if outside:
+        raise ValueError(f"Slices {outside} are outside 0..{len(files) - 1}; "
+                         f"--slices takes z indices, not file numbers")
+    tasks = [(files[z], z, None, scale) for z in zs for scale in grid["scale"]]
+    configs = np.prod([len(v) for v in grid.values()])
+    print(f"🧪 Sweeping {configs} configurations over {len(zs)} slice(s), {len(tasks)} task(s)")
+
+    frames = []
+    failures = run_batch(partial(sweep_slice, grid=grid), tasks, workers=workers,
+                         initializer=_init_worker if workers > 1 else None,
+                         on_result=lambda task, df: frames.append(df))
+    for (image_path, idx, _, scale), error in failures:
+        print(f"  ❌ {idx}: {os.path.basename(image_path)} at scale {scale}: {error.strip().splitlines()[-1]}")
+    if not frames:
+        return pd.DataFrame()
+
+    rows = pd.concat(frames, ignore_index=True).sort_values(["slice_id"] + SWEEP_KEYS, kind="stable")
+    summary = rows.drop(columns=["slice_id", "file"]).groupby(SWEEP_KEYS).mean().reset_index()
+    os.makedirs(out_dir, exist_ok=True)
+    rows.to_csv(os.path.join(out_dir, "sweep.csv"), index=False)
+    summary.to_csv(os.path.join(out_dir, "sweep_summary.csv"), index=False)
+    print(summary.round(3).to_string(index=False))
+    print(f"📄 Sweep saved to {out_dir}/sweep.csv and {out_dir}/sweep_summary.csv")
+    return rows
@@ -0,0 +1,135 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.ndimage import label, distance_transform_edt
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .components import pad_slices
+from .graph_analysis import skeletonise_image
+
+# Default tile side in analysed pixels
+TILE_SIZE = 1024
+
+
+def tile_grid(shape, size):
+    """(row, col) slices of the tiles covering a 2D `shape`, in raster order."""
+    return [(slice(r, min(r + size, shape[0])), slice(c, min(c + size, shape[1])))
+            for r in range(0, shape[0], size) for c in range(0, shape[1], size)]
+
+
+def with_halo(core, shape, halo):
+    # The tile grown by `halo` pixels, and where the tile itself lies inside it
+    outer = pad_slices(core, shape, halo)
+    inner = tuple(slice(c.start - o.start, c.stop - o.start) for c, o in zip(core, outer))
+    return outer, inner
+
+
+def _map(func, items, threads):
+    # scipy.ndimage and skimage's thinning release the GIL, so threads overlap
+    if threads > 1 and len(items) > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
+
+
+def tiled_apply(func, image, size=TILE_SIZE, halo=1, dtype=np.uint8, threads=1):
+    """
+    Runs `func` on every tile of `image` grown by `halo` pixels and writes
+    each tile's own part of the result into one full-frame array. Exact
+    whenever `func`'s output at a pixel only depends on pixels within `halo`.
+    """
+    out = np.empty(image.shape, dtype)
+
+    def run(core):
+        outer, inner = with_halo(core, image.shape, halo)
+        out[core] = func(image[outer])[inner]
+
+    _map(run, tile_grid(image.shape, size), threads)
+    return out
+
+
+def tiled_label(bw, size=TILE_SIZE, threads=1):
+    """
+    The same (labels, count) as scipy.ndimage.label(bw), tile by tile.
+
+    Tiles are labelled on their own, labels that touch across a seam are
+    merged with union-find (connected components of the seam contacts), and
+    the merged shapes are numbered in raster order of their first pixel, as
+    label() numbers them.
+    """
+    shape = bw.shape
+    tiles = tile_grid(shape, size)
+
+    def run(core):
+        lbl, n = label(bw[core])
+        ids, first = np.unique(lbl.ravel(), return_index=True)
+        rows, cols = np.unravel_index(first[ids > 0], lbl.shape)
+        # Full-frame raster index of every label's first pixel
+        return lbl, n, (rows + core[0].start) * shape[1] + cols + core[1].start
+
+    labeled = np.zeros(shape, np.int32)
+    firsts = []
+    total = 0
+    for core, (lbl, n, first) in zip(tiles, _map(run, tiles, threads)):
+        labeled[core] = np.where(lbl > 0, lbl + total, 0)
+        firsts.append(first)
+        total += n
+    if total == 0:
+        return labeled, 0
+
+    # Face-connected contacts across vertical and horizontal seams
+    pairs = [np.empty((0, 2), np.int32)]
+    for axis in (0, 1):
+        for seam in range(size, shape[axis], size):
+            a = np.take(labeled, seam - 1, axis=axis)
+            b = np.take(labeled, seam, axis=axis)
+            touch = (a > 0) & (b > 0)
+            pairs.append(np.stack([a[touch], b[touch]], axis=1))
+    pairs = np.concatenate(pairs)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0] - 1, pairs[:, 1] - 1)), shape=(total, total))
+    num_shapes, merged = connected_components(graph, directed=False)
+
+    first = np.full(num_shapes, np.iinfo(np.int64).max)
+    np.minimum.at(first, merged, np.concatenate(firsts))
+    rank = np.empty(num_shapes, np.int32)
+    rank[np.argsort(first)] = np.arange(1, num_shapes + 1)
+    lut = np.concatenate([[0], rank[merged]]).astype(np.int32)
+    np.take(lut, labeled, out=labeled)
+    return labeled, num_shapes
+
+
+def tiled_edt(bw, size=TILE_SIZE, halo=32, threads=1):
+    """
+    The same Euclidean distance transform as distance_transform_edt(bw > 0),
+    tile by tile. Background outside a tile's halo is more than `halo` pixels
+    away, so a tile is exact once none of its distances exceeds the halo;
+    tiles where one does are redone with twice the halo.
+    """
+    mask = bw > 0
+    out = np.empty(mask.shape)
+
+    def run(core):
+        h = halo
+        while True:
+            outer, inner = with_halo(core, mask.shape, h)
+            dist = distance_transform_edt(mask[outer])[inner]
+            whole = all(o.start == 0 and o.stop == n for o, n in zip(outer, mask.shape))
+            if whole or dist.max(initial=0) <= h:
+                out[core] = dist
+                return
+            h *= 2
+
+    _map(run, tile_grid(mask.shape, size), threads)
+    return out
+
+
+def skeleton_halo(dist):
+    # Thinning peels one pixel layer per iteration of two sub-iterations, so it
+    # stops after about one iteration per pixel of the largest inscribed
+    # radius; a seam's effect travels at most one pixel per sub-iteration and
+    # never reaches a tile's own pixels through a halo of twice that radius.
+    return 2 * int(np.ceil(dist.max(initial=0))) + 4
+
+
+def tiled_skeleton(bw, dist, size=TILE_SIZE, threads=1):
+    """The same skeleton as skeletonise_image(bw), tile by tile; `dist` is bw's distance map."""
+    return tiled_apply(skeletonise_image, bw, size, skeleton_halo(dist), np.uint8, threads)
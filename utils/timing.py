@@ -0,0 +1,96 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Records of the stage_report() block currently collecting, and the stage nesting depth
+_records = ContextVar("stage_records", default=None)
+_depth = ContextVar("stage_depth", default=0)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return float("nan")
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def nbytes(value):
+    """Total size of the arrays in `value` (an array or a tuple of them)."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(nbytes(v) for v in value)
+    return 0
+
+
+@contextmanager
+def stage_report():
+    """
+    Collects every stage() timed inside the block, in this thread, and
+    yields the list of records: dicts with the stage name, its nesting
+    depth, wall time in seconds, peak RSS of the process in MB once the
+    stage ended, and any extra fields the stage set (e.g. nbytes).
+    """
+    records = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+@contextmanager
+def stage(name, **info):
+    """
+    Times one pipeline stage when a stage_report() is collecting and does
+    nothing otherwise. Yields the record so the stage can add fields.
+    """
+    records = _records.get()
+    if records is None:
+        yield {}
+        return
+    depth = _depth.get()
+    record = {"stage": name, "depth": depth, **info}
+    token = _depth.set(depth + 1)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        record["peak_rss_mb"] = peak_rss_mb()
+        _depth.reset(token)
+        records.append(record)
+
+
+def timed(name):
+    """Decorator form of stage()."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def stage_summary(timings):
+    """Per-stage call count, total and mean seconds and highest peak RSS of a timings table."""
+    summary = timings.groupby("stage").agg(calls=("seconds", "size"), total_s=("seconds", "sum"),
+                                           mean_s=("seconds", "mean"), peak_rss_mb=("peak_rss_mb", "max"))
+    return summary.sort_values("total_s", ascending=False)
+
+
+def write_report(timings, path):
+    """Writes a timings table to CSV and prints its per-stage summary."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    timings.to_csv(path, index=False)
+    print(stage_summary(timings).round(4).to_string())
+    print(f"⏱️  Stage timings saved to {path}")
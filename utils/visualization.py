@@ -1,16 +1,54 @@
 import cv2 as cv
 import numpy as np
+from functools import lru_cache
 from typing import List, Tuple
 
+def circle_offsets(radius, thickness=-1):
+    # Pixel offsets cv.circle fills for this radius/thickness, drawn once on a small patch
+    size = radius + max(thickness, 1) + 2
+    patch = np.zeros((2 * size + 1, 2 * size + 1), np.uint8)
+    cv.circle(patch, (size, size), radius, 1, thickness)
+    dy, dx = np.nonzero(patch)
+    return dy - size, dx - size
+
+# Annotation radii repeat across slices; the bound keeps one-off large stamps from piling up
+_circle_stamp = lru_cache(maxsize=256)(circle_offsets)
+
+def draw_circles(canvas, centers, radii, color, thickness=-1):
+    """
+    Draws circles around many (row, col) centres in one pass per distinct
+    radius, stamping the same pixels cv.circle would draw at each centre.
+    """
+    centers = np.asarray(centers, dtype=np.intp).reshape(-1, 2)
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.intp), (len(centers),))
+    h, w = canvas.shape[:2]
+    for radius in np.unique(radii):
+        dy, dx = _circle_stamp(int(radius), thickness)
+        c = centers[radii == radius]
+        ys = (c[:, :1] + dy).ravel()
+        xs = (c[:, 1:] + dx).ravel()
+        inside = (ys >= 0) & (ys < h) & (xs >= 0) & (xs < w)
+        canvas[ys[inside], xs[inside]] = color
+
+def draw_skeleton(canvas, skel, color=(0, 0, 255)):
+    canvas[skel > 0] = color
+
+def draw_labels(canvas, points, texts, color, font_scale=0.5, thickness=1, shift=(6, -6), line_type=cv.LINE_8):
+    # Text has no vectorised equivalent; one putText per label in a single pass
+    for (r, c), text in zip(points, texts):
+        cv.putText(canvas, str(text), (int(c) + shift[0], int(r) + shift[1]),
+                   cv.FONT_HERSHEY_SIMPLEX, font_scale, color, thickness, line_type)
+
+def draw_shape_labels(canvas, centroids, line_type=cv.LINE_8):
+    centers = [tuple(c.astype(int)) for c in centroids if not np.isnan(c).any()]
+    ids = [i for i, c in enumerate(centroids, start=1) if not np.isnan(c).any()]
+    draw_labels(canvas, centers, [f'S{i}' for i in ids], (255, 0, 255), 0.5, 2, (-10, 0), line_type)
+
 def overlay_skeleton_nodes(img_gray: np.ndarray, skel: np.ndarray, nodes: List[Tuple[int, int]], endpoints: List[Tuple[int, int]]) -> np.ndarray:
     out = cv.cvtColor(img_gray, cv.COLOR_GRAY2BGR)
-    ys, xs = np.where(skel)
-    out[ys, xs] = (0, 0, 255)
-    for node_id, (r, c) in enumerate(nodes, 1):
-        cv.circle(out, (c, r), 3, (0, 255, 0), -1)
-        cv.putText(out, str(node_id), (c + 6, r - 6), cv.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
-    for idx, (r, c) in enumerate(endpoints):
-        cv.circle(out, (c, r), 3, (255, 0, 0), -1)
-        label = f"e{idx}"
-        cv.putText(out, label, (c + 6, r - 6), cv.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 1)
+    draw_skeleton(out, skel)
+    draw_circles(out, nodes, 3, (0, 255, 0))
+    draw_labels(out, nodes, range(1, len(nodes) + 1), (0, 0, 255))
+    draw_circles(out, endpoints, 3, (255, 0, 0))
+    draw_labels(out, endpoints, [f"e{idx}" for idx in range(len(endpoints))], (255, 0, 0))
     return out
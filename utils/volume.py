@@ -1,34 +1,26 @@
-import os
-import cv2
-import numpy as np
 import pandas as pd
-from scipy.ndimage import label
+from .analysis import SliceAnalysis
+from .timing import stage
 
-def compute_shape_volumes(img_path, out_csv_path, pixel_area=1.0):
+def compute_shape_volumes(img_path, out_csv_path=None, pixel_area=1.0):
     """
     Computes the volume (area) of each white shape in a binary image.
     
     Args:
-        img_path: path to the binary image
-        out_csv_path: path to save the output CSV
+        img_path: path to the binary image, or a SliceAnalysis of it
+        out_csv_path: optional path to save the output CSV
         pixel_area: real-world area per pixel (default = 1.0)
     """
-    # Load grayscale image
-    img = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
-    if img is None:
-        raise ValueError(f"Failed to load image from {img_path}")
-
-    # Convert to binary (white=1, black=0)
-    _, binary = cv2.threshold(img, 127, 1, cv2.THRESH_BINARY)
-
-    # Label connected components
-    labeled, num_shapes = label(binary)
+    # Load, binarise and label once (shared with the other analysers)
+    analysis = SliceAnalysis.load(img_path)
+    labeled, num_shapes = analysis.labels
 
+    # Pixel counts of every label in one pass
     shape_areas = []
 
-    for shape_id in range(1, num_shapes + 1):
-        shape_mask = labeled == shape_id
-        pixel_count = np.count_nonzero(shape_mask)
+    for shape_id, pixel_count in enumerate(analysis.areas, start=1):
+        # Pixel counts on the report grid, whatever scale the slice was analysed at
+        pixel_count = analysis.report_lengths(pixel_count, power=2)
         volume = pixel_count * pixel_area
 
         shape_areas.append({
@@ -39,7 +31,9 @@ def compute_shape_volumes(img_path, out_csv_path, pixel_area=1.0):
 
     # Save to CSV
     df = pd.DataFrame(shape_areas)
-    df.to_csv(out_csv_path, index=False)
-
     print(f"✅ Found {num_shapes} shapes")
-    print(f"📄 Volume data saved to {out_csv_path}")
+    if out_csv_path:
+        with stage("io"):
+            df.to_csv(out_csv_path, index=False)
+        print(f"📄 Volume data saved to {out_csv_path}")
+    return df
@@ -0,0 +1,211 @@
+import os
+import numpy as np
+import pandas as pd
+from scipy.ndimage import label, distance_transform_edt
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from .graph_analysis import skeletonise_image, skeleton_graph
+from .spatial import nearest
+from .binarize import binarize
+from .stack import load_stack
+
+
+def load_volume(source, memmap_path, mode="fixed", prefetch=4, adaptive=None):
+    """
+    Binarises every slice of a stack (slice folder or multi-page TIFF), in
+    z order, into a (z, y, x) uint8 array memory-mapped from `memmap_path`,
+    so the stack never has to fit in RAM.
+    """
+    return load_stack(source, memmap_path, prefetch,
+                      lambda img, out: binarize(img, mode, adaptive=adaptive, out=out))
+
+
+def z_chunks(depth, chunk_depth, halo):
+    """Yields (core_start, core_stop, lo, hi): each core z-range and the range read with its halo."""
+    for start in range(0, depth, chunk_depth):
+        stop = min(start + chunk_depth, depth)
+        yield start, stop, max(start - halo, 0), min(stop + halo, depth)
+
+
+def label_volume(volume, labels_path, chunk_depth=32):
+    """
+    Labels the 3D connected components of a memory-mapped volume chunk by
+    chunk and joins labels that touch across chunk faces.
+
+    Returns (labels, shape_of_label, num_shapes): provisional labels written
+    to a memory-mapped int32 array, the final shape id of each provisional
+    label (0 for background) and the number of shapes.
+    """
+    labels = np.lib.format.open_memmap(labels_path, mode="w+", dtype=np.int32, shape=volume.shape)
+    offset = 0
+    pairs = []
+    for start, stop, _, _ in z_chunks(volume.shape[0], chunk_depth, 0):
+        lbl, n = label(volume[start:stop])
+        lbl[lbl > 0] += offset
+        labels[start:stop] = lbl
+        if start > 0:
+            below, above = labels[start - 1], lbl[0]
+            touch = (below > 0) & (above > 0)
+            pairs.append(np.stack([below[touch], above[touch]], axis=1))
+        offset += n
+    labels.flush()
+
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), np.int32)
+    graph = coo_matrix((np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(offset + 1, offset + 1))
+    # Components are numbered in order of their lowest label, so background stays 0
+    num_shapes, shape_of_label = connected_components(graph, directed=False)
+    return labels, shape_of_label, num_shapes - 1
+
+
+def shape_table(labels, shape_of_label, num_shapes, chunk_depth=32, voxel_volume=1.0):
+    counts = np.zeros(num_shapes + 1)
+    z_min = np.full(num_shapes + 1, labels.shape[0])
+    z_max = np.full(num_shapes + 1, -1)
+    for start, stop, _, _ in z_chunks(labels.shape[0], chunk_depth, 0):
+        shape_ids = shape_of_label[np.asarray(labels[start:stop])]
+        counts += np.bincount(shape_ids.ravel(), minlength=num_shapes + 1)
+        for z in range(start, stop):
+            present = np.unique(shape_ids[z - start])
+            z_min[present] = np.minimum(z_min[present], z)
+            z_max[present] = np.maximum(z_max[present], z)
+    return pd.DataFrame({
+        'shape_id': np.arange(1, num_shapes + 1),
+        'voxel_count': counts[1:].astype(np.int64),
+        'volume': counts[1:] * voxel_volume,
+        'z_min': z_min[1:],
+        'z_max': z_max[1:],
+    })
+
+
+def _chunk_features(sub, lo, start, stop, cut_lo, cut_hi):
+    # Features of the chunk's core, and whether a branch it keeps runs into a
+    # face where the volume was cut (`cut_lo` / `cut_hi`), i.e. the halo was
+    # too thin to see the branch's far end
+    skel = skeletonise_image(sub > 0)
+    graph = skeleton_graph(skel)
+    dist = distance_transform_edt(sub)
+
+    verts = np.array(graph.nodes + graph.endpoints, dtype=np.intp).reshape(-1, 3)
+    radii = dist[tuple(verts.T)]
+    verts[:, 0] += lo
+    in_core = (verts[:, 0] >= start) & (verts[:, 0] < stop)
+    is_node = np.arange(len(verts)) < len(graph.nodes)
+
+    # Each edge is kept by the chunk whose core holds its lower-z vertex
+    pairs, lengths = graph.shortest_edges()
+    owner = np.where(verts[pairs[:, 0], 0] <= verts[pairs[:, 1], 0], pairs[:, 0], pairs[:, 1])
+    keep = in_core[owner]
+    end_z = verts[pairs[keep], 0]
+    truncated = (cut_lo and (end_z <= lo + 1).any()) or (cut_hi and (end_z >= lo + len(sub) - 2).any())
+    return (verts[in_core], radii[in_core], is_node[in_core],
+            verts[pairs[keep, 0]], verts[pairs[keep, 1]], lengths[keep]), truncated
+
+
+def chunk_halo(core):
+    """
+    Slices to read on each side of a chunk so thinning sees the same
+    neighbourhood as on the whole volume, from the largest inscribed
+    radius of the chunk's own slices (cutting the volume only makes it
+    larger, so it is an upper bound). 3D thinning peels one layer per
+    iteration in six directional sub-iterations, and a cut face's effect
+    can move one slice per sub-iteration.
+    """
+    return 6 * int(np.ceil(distance_transform_edt(core).max(initial=0))) + 4
+
+
+def analyse_volume(volume, out_dir, chunk_depth=32, halo=None, voxel_volume=1.0, match_tolerance=2.0):
+    """
+    3D skeleton, node, edge and shape analysis of a (z, y, x) binary volume,
+    processed in overlapping z-chunks so only chunk_depth + 2 * halo slices
+    are in memory at once. Writes volume_nodes.csv, volume_endpoints.csv,
+    volume_edges.csv and volume_shapes.csv to `out_dir`.
+
+    Each chunk's halo is at least chunk_halo of its slices, and is doubled
+    while a branch the chunk keeps runs out of it, so the results do not
+    depend on chunk_depth.
+
+    Args:
+        volume: (z, y, x) binary array, typically from load_volume
+        out_dir: folder for the CSVs and the memory-mapped label stack
+        chunk_depth: slices per chunk
+        halo: optional smallest number of extra slices read on each side of
+              a chunk; raised, with a warning, where the chunk needs more
+        voxel_volume: real-world volume per voxel
+        match_tolerance: how far (in voxels) a branch end seen in a halo may be
+                         from the vertex found by the chunk that owns it
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    labels, shape_of_label, num_shapes = label_volume(
+        volume, os.path.join(out_dir, "labels_stack.npy"), chunk_depth)
+
+    depth = volume.shape[0]
+    chunks = []
+    for start, stop, _, _ in z_chunks(depth, chunk_depth, 0):
+        needed = chunk_halo(np.asarray(volume[start:stop]))
+        if halo is not None and halo < needed:
+            print(f"  ⚠️  Halo {halo} is too thin for slices {start}-{stop - 1}, using {needed}")
+        grow = max(needed, halo or 0)
+        while True:
+            lo, hi = max(start - grow, 0), min(stop + grow, depth)
+            print(f"  ▶ Slices {start}-{stop - 1} (halo {lo}-{hi - 1})")
+            features, truncated = _chunk_features(np.asarray(volume[lo:hi]), lo, start, stop, lo > 0, hi < depth)
+            if not truncated:
+                break
+            grow *= 2
+        chunks.append(features)
+    verts, radii, is_node, edge_a, edge_b, lengths = (np.concatenate(parts) for parts in zip(*chunks))
+    # Vertices in (z, y, x) order over the whole volume, whatever chunk found them
+    order = np.lexsort(verts.T[::-1]) if len(verts) else np.empty(0, int)
+    verts, radii, is_node = verts[order], radii[order], is_node[order]
+    shape_ids = shape_of_label[labels[tuple(verts.T)]] if len(verts) else np.empty(0, int)
+
+    # Vertex ids in z order: junctions n1, n2, ... and endpoints e0, e1, ...
+    names = np.empty(len(verts), object)
+    names[is_node] = [f"n{i}" for i in range(1, is_node.sum() + 1)]
+    names[~is_node] = [f"e{i}" for i in range(int((~is_node).sum()))]
+
+    # Edge ends in a halo are matched to the vertex found in that slice's own chunk
+    da, ia = nearest(edge_a, verts)
+    db, ib = nearest(edge_b, verts)
+    matched = (da <= match_tolerance) & (db <= match_tolerance) & (ia != ib)
+    ia, ib, lengths = ia[matched], ib[matched], lengths[matched]
+    # Each edge from its lower vertex id, edges ordered by their ends
+    ia, ib = np.minimum(ia, ib), np.maximum(ia, ib)
+    order = np.lexsort((lengths, ib, ia))
+    ia, ib, lengths = ia[order], ib[order], lengths[order]
+
+    nodes = verts[is_node]
+    end_idx = np.flatnonzero(~is_node)
+    e_dist, e_nearest = nearest(verts[end_idx], nodes)
+
+    tables = {
+        'nodes': pd.DataFrame({
+            'node_id': np.arange(1, len(nodes) + 1),
+            'shape_id': shape_ids[is_node],
+            'z': nodes[:, 0], 'y': nodes[:, 1], 'x': nodes[:, 2],
+            'radius': radii[is_node],
+        }),
+        'endpoints': pd.DataFrame({
+            'endpoint': names[end_idx],
+            'shape_id': shape_ids[end_idx],
+            'z': verts[end_idx, 0], 'y': verts[end_idx, 1], 'x': verts[end_idx, 2],
+            'radius': radii[end_idx],
+            'nearest_node_id': np.where(e_nearest >= 0, e_nearest + 1, -1),
+            'distance': e_dist,
+        }),
+        'edges': pd.DataFrame({
+            'source': names[ia], 'target': names[ib],
+            'z1': verts[ia, 0], 'y1': verts[ia, 1], 'x1': verts[ia, 2],
+            'z2': verts[ib, 0], 'y2': verts[ib, 1], 'x2': verts[ib, 2],
+            'branch_length': lengths,
+            'distance': np.linalg.norm(verts[ia] - verts[ib], axis=1),
+        }),
+        'shapes': shape_table(labels, shape_of_label, num_shapes, chunk_depth, voxel_volume),
+    }
+    for name, df in tables.items():
+        df.to_csv(os.path.join(out_dir, f"volume_{name}.csv"), index=False)
+
+    print(f"✅ Found {num_shapes} shapes, {len(nodes)} nodes, {len(end_idx)} endpoints "
+          f"and {len(lengths)} branches")
+    print(f"📄 Volume data saved to {out_dir}")
+    return tables
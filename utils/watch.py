@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import signal
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from .stack import STACK_EXTENSIONS, stack_files
+from .io_utils import (process_slice, store_slice, _init_worker, OUTPUT_DIRS, CACHE_BYTES,
+                       ANALYSIS_SCALE, ROI_MARGIN)
+from .results import ResultStore
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # Polling only
+    INotify = None
+
+
+class SliceWatcher:
+    """
+    Finds the slices of a folder once they are completely written: from
+    inotify close-write and move events when the inotify_simple package is
+    available, and from a directory poll in any case, which also picks up
+    slices written before the watch started. A polled file counts as
+    complete once its size and modification time have not changed for
+    `settle` seconds. Every slice is reported once, unless it is handed
+    back with retry().
+    """
+
+    def __init__(self, folder, settle=2.0):
+        self.folder = folder
+        self.settle = settle
+        self._seen = set()
+        self._pending = {}
+        self._unreadable = {}
+        self.inotify = None
+        if INotify is not None:
+            self.inotify = INotify()
+            self.inotify.add_watch(folder, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    @property
+    def unreadable(self):
+        return len(self._unreadable)
+
+    def retry(self, path):
+        # A slice that failed to decode, e.g. a write that paused for longer
+        # than `settle`, is reported again once the file changes
+        self._seen.discard(path)
+        self._unreadable[path] = self._signature(path)
+
+    def _new(self, path):
+        if path in self._seen:
+            return []
+        self._seen.add(path)
+        self._pending.pop(path, None)
+        self._unreadable.pop(path, None)
+        return [path]
+
+    def events(self):
+        """Slices the inotify watch saw closed or moved in since the last call."""
+        ready = []
+        for event in self.inotify.read(timeout=0):
+            if event.name.lower().endswith(STACK_EXTENSIONS):
+                ready += self._new(os.path.join(self.folder, event.name))
+        return ready
+
+    def poll(self, now):
+        """Slices whose size and mtime have been stable for `settle` seconds, in z order."""
+        ready = []
+        for path in stack_files(self.folder):
+            if path in self._seen:
+                continue
+            signature = self._signature(path)
+            if signature is None or self._unreadable.get(path) == signature:
+                continue
+            last = self._pending.get(path)
+            if last is None or last[0] != signature:
+                self._pending[path] = (signature, now)
+            elif signature[0] and now - last[1] >= self.settle:
+                ready += self._new(path)
+        return ready
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+
+
+def _warm_worker():
+    # Ctrl+C stops the service from the parent, which then shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Load the parts of the pipeline imported on first use before the first slice arrives
+    _init_worker()
+    from skimage.morphology import skeletonize
+    from skimage.feature import corner_peaks
+    from skimage.graph import MCP_Geometric
+
+
+class WatchService:
+    """
+    Analyses slices as a scanner writes them into `folder`: new slices are
+    queued on an asyncio queue and handed to a pool of `workers` processes
+    that were started, and had the pipeline imported, before the first
+    slice. Slices are numbered by their position in the sorted folder, as
+    in folder mode. Tables go to the results store (flushed at every status
+    report, so they can be read while the watch runs) and/or the per-slice
+    CSVs.
+
+    Queue depth, running and finished slices and throughput are printed
+    every `report_every` seconds and written to `status_path` as JSON.
+    """
+
+    def __init__(self, folder, analyse, workers=1, results=None, scale=ANALYSIS_SCALE, mode="fixed",
+                 poll=1.0, settle=2.0, idle=None, report_every=10.0, status_path="output/watch_status.json",
+                 prune=None, adaptive=None):
+        self.folder = folder
+        self.analyse = analyse
+        self.workers = max(1, workers)
+        self.results = results
+        self.scale = scale
+        self.mode = mode
+        self.prune = prune
+        self.adaptive = adaptive
+        self.poll_every = poll
+        self.idle = idle
+        self.report_every = report_every
+        self.status_path = status_path
+        self.watcher = SliceWatcher(folder, settle)
+        self.queue = None
+        self.running = 0
+        self.done = 0
+        self.failures = []
+        self.started = None
+        self.first_queued = None
+        self.last_activity = None
+        self._ids = set()
+
+    def status(self):
+        now = time.monotonic()
+        busy = now - self.first_queued if self.first_queued is not None else 0.0
+        return {
+            "folder": self.folder,
+            "watching": "inotify" if self.watcher.inotify is not None else "poll",
+            "queued": self.queue.qsize(),
+            "running": self.running,
+            "done": self.done,
+            "failed": len(self.failures),
+            "unreadable": self.watcher.unreadable,
+            "uptime_s": round(now - self.started, 1),
+            "slices_per_min": round(60 * self.done / busy, 2) if busy > 0 else 0.0,
+        }
+
+    def report(self):
+        status = self.status()
+        if self.results is not None:
+            self.results.flush()
+        os.makedirs(os.path.dirname(self.status_path) or ".", exist_ok=True)
+        tmp = self.status_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp, self.status_path)
+        print(f"📡 {status['queued']} queued, {status['running']} running, {status['done']} done, "
+              f"{status['failed']} failed, {status['slices_per_min']:.2f} slices/min")
+
+    def _enqueue(self, paths):
+        for path in paths:
+            # slice_id is the position in the sorted folder, as in folder mode; a slice
+            # written out of z order would take a taken id and goes after the others
+            files = stack_files(self.folder)
+            z = files.index(path) if path in files else len(files)
+            if z in self._ids:
+                z = max(self._ids) + 1
+                print(f"  ⚠️  {os.path.basename(path)} arrived out of z order, stored as slice {z}")
+            self._ids.add(z)
+            self.queue.put_nowait((path, z))
+            if self.first_queued is None:
+                self.first_queued = time.monotonic()
+            self.last_activity = time.monotonic()
+
+    async def _scan(self):
+        loop = asyncio.get_running_loop()
+        if self.watcher.inotify is not None:
+            loop.add_reader(self.watcher.inotify.fileno(), lambda: self._enqueue(self.watcher.events()))
+        try:
+            while True:
+                self._enqueue(self.watcher.poll(time.monotonic()))
+                await asyncio.sleep(self.poll_every)
+        finally:
+            if self.watcher.inotify is not None:
+                loop.remove_reader(self.watcher.inotify.fileno())
+
+    async def _work(self, pool):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, idx = await self.queue.get()
+            self.running += 1
+            try:
+                tables = await loop.run_in_executor(pool, self.analyse, path, idx)
+            except Exception as e:
+                self.failures.append(((path, idx), repr(e)))
+                print(f"  ❌ {idx}: {os.path.basename(path)}: {e!r}")
+            else:
+                if tables is None:
+                    print(f"  ⏳ {idx}: {os.path.basename(path)} will be retried once it changes")
+                    self.watcher.retry(path)
+                else:
+                    self.done += 1
+                    if self.results is not None:
+                        store_slice(self.results, path, idx, None, tables, self.scale, self.mode,
+                                    self.prune, self.adaptive)
+            finally:
+                self.running -= 1
+                self.last_activity = time.monotonic()
+                self.queue.task_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            self.report()
+
+    def _idle(self):
+        return (self.idle is not None and self.queue.empty() and not self.running
+                and time.monotonic() - self.last_activity >= self.idle)
+
+    async def run(self):
+        self.queue = asyncio.Queue()
+        self.started = self.last_activity = time.monotonic()
+        loop = asyncio.get_running_loop()
+        pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm_worker)
+        tasks = []
+        try:
+            # One call per worker starts them all and runs their warm-up
+            await asyncio.gather(*(loop.run_in_executor(pool, os.getpid) for _ in range(self.workers)))
+            mode = "inotify" if self.watcher.inotify is not None else f"polling every {self.poll_every:g}s"
+            print(f"👀 Watching {self.folder} with {self.workers} warm worker(s), {mode}")
+            tasks = [asyncio.create_task(self._scan()), asyncio.create_task(self._report())]
+            tasks += [asyncio.create_task(self._work(pool)) for _ in range(self.workers)]
+            while not self._idle():
+                await asyncio.sleep(min(self.poll_every, 1.0))
+            print(f"💤 Nothing new for {self.idle:g}s, stopping")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            pool.shutdown(cancel_futures=True)
+            self.watcher.close()
+            self.report()
+        return self.failures
+
+
+def watch_folder(folder_path=None, workers=1, scale=ANALYSIS_SCALE, refine=False, mode="fixed",
+                 store=None, store_path="output/results", export=None,
+                 cache_dir=None, cache_bytes=CACHE_BYTES, tile=None, threads=1,
+                 poll=1.0, settle=2.0, idle=None, report_every=10.0, roi=None, roi_margin=ROI_MARGIN,
+                 prune=None, adaptive=None):
+    """
+    Service mode: analyses every slice that appears in `folder_path` until
+    interrupted, or until nothing new arrived for `idle` seconds. Slices
+    already in the folder are analysed first. Outputs are the same as
+    folder_image's, appended slice by slice. The stack is not known in
+    advance, so `roi` can only be "slice".
+    """
+    if folder_path is None:
+        folder_path = input("Enter path to watch: ").strip()
+    if not os.path.isdir(folder_path):
+        print("Invalid folder path.")
+        return
+
+    if export is None:
+        export = store is None
+    if export:
+        for out_dir in OUTPUT_DIRS:
+            os.makedirs(out_dir, exist_ok=True)
+    results = ResultStore(store_path, store) if store else None
+    analyse = partial(process_slice, scale=scale, refine=refine, mode=mode, export=export,
+                      cache_dir=cache_dir, cache_bytes=cache_bytes, tile=tile, threads=threads,
+                      roi=roi, roi_margin=roi_margin, prune=prune, adaptive=adaptive)
+    service = WatchService(folder_path, analyse, workers, results, scale, mode,
+                           poll=poll, settle=settle, idle=idle, report_every=report_every, prune=prune,
+                           adaptive=adaptive)
+    try:
+        failures = asyncio.run(service.run())
+    except KeyboardInterrupt:
+        print("\n🛑 Watch stopped")
+        failures = service.failures
+    finally:
+        if results is not None:
+            results.close()
+            print(f"📦 Results stored in {store_path}")
+    return failures